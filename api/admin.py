@@ -1,9 +1,30 @@
+from django import forms
 from django.contrib import admin
 
-from api.models import User, Operation, Record
+from api.billing import credit_balance, current_balance
+from api.models import User, Operation, Record, RecordArchive, BalanceEntry, UsageRollup
+
+class UserAdminForm(forms.ModelForm):
+    credit = forms.FloatField(required=False, help_text="Amount credited to the balance, negative to debit it")
+
+    class Meta:
+        model = User
+        fields = '__all__'
 
 class UserAdmin(admin.ModelAdmin):
-    pass
+    # the balance is a snapshot, it's changed through the journal only
+    form = UserAdminForm
+    readonly_fields = ('balance', 'live_balance')
+
+    @admin.display(description="Live balance")
+    def live_balance(self, obj):
+        return current_balance(obj) if obj.pk else obj.balance
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # journaled, check_balances counts it like a credit
+        if form.cleaned_data.get('credit'):
+            credit_balance(obj, form.cleaned_data['credit'])
 
 class OperationAdmin(admin.ModelAdmin):
     pass
@@ -11,6 +32,18 @@ class OperationAdmin(admin.ModelAdmin):
 class RecordAdmin(admin.ModelAdmin):
     pass
 
+class RecordArchiveAdmin(admin.ModelAdmin):
+    pass
+
+class BalanceEntryAdmin(admin.ModelAdmin):
+    pass
+
+class UsageRollupAdmin(admin.ModelAdmin):
+    pass
+
 admin.site.register(User, UserAdmin)
 admin.site.register(Operation, OperationAdmin)
-admin.site.register(Record, RecordAdmin)
\ No newline at end of file
+admin.site.register(Record, RecordAdmin)
+admin.site.register(RecordArchive, RecordArchiveAdmin)
+admin.site.register(BalanceEntry, BalanceEntryAdmin)
+admin.site.register(UsageRollup, UsageRollupAdmin)
\ No newline at end of file
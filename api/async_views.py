@@ -0,0 +1,159 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from api.billing import balance_not_enough, charge
+from api.catalog import catalog
+from api.models import User
+from api.operations import aperform_operation, dict_message
+from api.serializers import RECORD_ROW_FIELDS, serialize_record_rows
+from api.throttling import consume_operation_cost
+from api.views import RecordHistoryMixin
+
+
+async def authenticate(request) -> User:
+    '''
+    Returns the user of the JWT of the request, like JWTAuthentication does,
+    with the async ORM
+
+    :raises AuthenticationFailed: if the token is missing or not valid
+    '''
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        raise AuthenticationFailed("Authentication credentials were not provided.")
+
+    validated_token = authentication.get_validated_token(raw_token)
+    try:
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+        user = await User.objects.with_live_balance().aget(**{api_settings.USER_ID_FIELD: user_id})
+    except (KeyError, User.DoesNotExist) as e:
+        raise AuthenticationFailed("User not found", code="user_not_found")
+    if not user.is_active:
+        raise AuthenticationFailed("User is inactive", code="user_inactive")
+    return user
+
+
+class AsyncAPIView(View):
+    '''
+    Base of the async views, only for authenticated users
+
+    The async views serve the same payloads as their APIView counterparts
+    without holding a worker thread while they wait, when the application
+    runs under an ASGI server.
+    '''
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # authentication is done with the JWT, not with the session cookie
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await authenticate(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({"detail": str(e.detail)}, status=401)
+        return await super().dispatch(request, *args, **kwargs)
+
+    def get_data(self, request) -> dict:
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError as e:
+            data = None
+        return data if isinstance(data, dict) else {}
+
+
+class AsyncHomeView(AsyncAPIView):
+    async def get(self, request):
+        # return all operations from the cached catalog
+        operations = await sync_to_async(catalog.serialized)()
+        content = {'username': request.user.username,
+                   'user_balance': request.user.live_balance,
+                   'operations': operations}
+        return JsonResponse(content)
+
+
+class AsyncOperationView(AsyncAPIView):
+    async def post(self, request):
+        data = self.get_data(request)
+
+        # search for the operation based on the received operation_id
+        try:
+            operation = await sync_to_async(catalog.get)(data.get("operation_id"))
+        except Exception as e:
+            return JsonResponse(dict_message(error_message="Invalid operation"))
+
+        # the same buckets as OperationCostThrottle, which only runs in DRF views
+        user = request.user
+        wait = await sync_to_async(consume_operation_cost)(user.pk, operation.cost)
+        if wait:
+            throttled = Throttled(wait)
+            return JsonResponse({"detail": str(throttled.detail)}, status=throttled.status_code,
+                                headers={"Retry-After": "%d" % throttled.wait})
+
+        if user.live_balance < operation.cost:
+            return JsonResponse(balance_not_enough(operation))
+
+        # the random string is fetched without blocking the event loop
+        response = await aperform_operation(operation_type=operation.type,
+                                            operator1=data.get("operator1"),
+                                            operator2=data.get("operator2"))
+        if response['status'] != 1:
+            return JsonResponse(response)
+
+        try:
+            # debits the user balance, only if it's still enough, and saves the record
+            balance = await sync_to_async(charge)(user, operation, dict(response))
+            if balance is None:
+                return JsonResponse(balance_not_enough(operation))
+        except Exception as e:
+            return JsonResponse(dict_message(error_message=str(e)))
+
+        response["user_balance"] = balance
+        return JsonResponse(response)
+
+
+class AsyncRecordView(RecordHistoryMixin, AsyncAPIView):
+    page_size = 10
+
+    async def get(self, request):
+        queryset = await sync_to_async(self.get_queryset)(request)
+
+        # page number pagination, same payload as the records view
+        try:
+            page = int(request.GET.get('page', 1))
+            if page < 1:
+                raise ValueError(page)
+        except ValueError as e:
+            return JsonResponse({"detail": "Invalid page."}, status=404)
+
+        count = await queryset.acount()
+        if page > 1 and (page - 1) * self.page_size >= count:
+            return JsonResponse({"detail": "Invalid page."}, status=404)
+
+        start = (page - 1) * self.page_size
+        page_rows = queryset.order_by('-date', '-id').values(*RECORD_ROW_FIELDS)[start:start + self.page_size]
+        rows = [row async for row in page_rows]
+        type_str = {operation.id: operation.type_str for operation in await sync_to_async(catalog.all)()}
+
+        url = request.build_absolute_uri()
+        next_link = replace_query_param(url, 'page', page + 1) if start + self.page_size < count else None
+        if page == 1:
+            previous_link = None
+        elif page == 2:
+            previous_link = remove_query_param(url, 'page')
+        else:
+            previous_link = replace_query_param(url, 'page', page - 1)
+
+        return JsonResponse({'count': count,
+                             'next': next_link,
+                             'previous': previous_link,
+                             'results': serialize_record_rows(rows, type_str)})
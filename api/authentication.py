@@ -0,0 +1,128 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.blacklist import blacklist_filter
+from api.models import User
+
+
+class AuthenticatedUserCache:
+    '''
+    Per process cache of the users authenticated by a JWT, keyed by user id
+    and token id
+
+    The entries expire after settings.AUTHENTICATED_USER_CACHE_TTL seconds.
+    The users of a given id are dropped by invalidate(), which is called by the
+    User post_save and post_delete signals and after every balance debit, so
+    a process never serves a balance older than its own last write. Another
+    process may serve it for up to the TTL.
+    '''
+    def __init__(self, max_size:int=10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._size = 0
+
+    def get(self, user_id, token_id):
+        '''
+        Returns a copy of the cached user, or None if it's missing or expired
+        '''
+        entry = self._entries.get(user_id, {}).get(token_id)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        # views may change the instance, like the balance after a debit
+        return copy.copy(entry[0])
+
+    def set(self, user_id, token_id, user:User):
+        ttl = getattr(settings, "AUTHENTICATED_USER_CACHE_TTL", 10)
+        with self._lock:
+            if self._size >= self.max_size:
+                self._prune()
+            tokens = self._entries.setdefault(user_id, {})
+            if token_id not in tokens:
+                self._size += 1
+            tokens[token_id] = (copy.copy(user), time.monotonic() + ttl)
+
+    def invalidate(self, user_id=None):
+        '''
+        Drops the cached entries of user_id, or all of them
+        '''
+        with self._lock:
+            if user_id is None:
+                self._entries = {}
+                self._size = 0
+            else:
+                self._size -= len(self._entries.pop(user_id, {}))
+
+    def __len__(self):
+        return self._size
+
+    def _prune(self):
+        # drop the expired entries, or everything if none expired
+        now = time.monotonic()
+        entries = {}
+        for user_id, tokens in self._entries.items():
+            tokens = {token_id: entry for token_id, entry in tokens.items() if entry[1] >= now}
+            if tokens:
+                entries[user_id] = tokens
+        size = sum(len(tokens) for tokens in entries.values())
+        if size >= self.max_size:
+            entries, size = {}, 0
+        self._entries = entries
+        self._size = size
+
+
+user_cache = AuthenticatedUserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    '''
+    JWTAuthentication that resolves the user from the authenticated user
+    cache, skipping the SELECT on the user table for the repeated requests
+    of a token
+
+    request.user may be a few seconds old, the views that debit the balance
+    read it again from the database (see api.billing.current_balance).
+    '''
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        token_id = validated_token.get(api_settings.JTI_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+        if token_id is None:
+            return self.get_user_with_live_balance(user_id)
+
+        user = user_cache.get(user_id, token_id)
+        if user is None:
+            user = self.get_user_with_live_balance(user_id)
+            user_cache.set(user_id, token_id, user)
+        return user
+
+    def get_user_with_live_balance(self, user_id) -> User:
+        '''
+        Same lookup as JWTAuthentication.get_user, with the live balance of
+        the user annotated in the same query
+        '''
+        try:
+            user = User.objects.with_live_balance().get(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
+
+
+class FilteredRefreshToken(RefreshToken):
+    '''
+    RefreshToken that only looks for itself in the token_blacklist tables
+    when the blacklist filter says it may be blacklisted
+    '''
+    def check_blacklist(self):
+        if blacklist_filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
@@ -0,0 +1,187 @@
+from typing import Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api.authentication import user_cache
+from api.metrics import BALANCE_REJECTIONS, OPERATIONS_CHARGED
+from api.models import BalanceEntry, Operation, Record, UsageRollup, User
+from api.operations import dict_message
+from api.record_buffer import get_record_buffer
+
+
+class BalanceNotEnough(Exception):
+    pass
+
+
+def balance_not_enough(operation:Operation=None) -> dict:
+    '''
+    Counts an operation rejected for the user balance and returns the error
+    message of the views
+
+    :param operation: operation rejected, None for the batches
+    '''
+    BALANCE_REJECTIONS.inc(operation=operation.type_str if operation is not None else "batch")
+    return dict_message(error_message="The user balance is not enough")
+
+
+def current_balance(user:User) -> float:
+    '''
+    Reads the live balance of the user from the database, the balance
+    snapshot plus the pending journal entries
+
+    request.user may come from the authenticated user cache, the views check
+    the balance they are about to debit against the database.
+    '''
+    user.live_balance = User.objects.with_live_balance().values_list('live_balance', flat=True).get(id=user.id)
+    return user.live_balance
+
+
+def debit_balance(user:User, amount:float) -> Optional[float]:
+    '''
+    Debits amount from the user balance by appending an entry to the
+    balance journal, the user row is neither locked nor rewritten
+
+    The entry is inserted first, then the balance is checked: the sequence
+    number of the entry keeps a concurrent debit of the user from committing
+    before this one (see BalanceEntryManager.append), and on SQLite the
+    INSERT takes the write lock. The pending entries summed by the next
+    statement are all the entries committed before this one, plus this
+    one. The entry is rolled back if the balance goes below zero. Call it
+    inside the transaction that saves the records of the debit.
+
+    :param user: user to be charged
+    :param amount: amount to be debited
+    :return: the new balance, or None if the balance is not enough
+    '''
+    try:
+        with transaction.atomic():
+            BalanceEntry.objects.append(user.id, -amount)
+            balance = User.objects.with_live_balance().values_list('live_balance', flat=True).get(id=user.id)
+            if balance < 0:
+                raise BalanceNotEnough()
+    except BalanceNotEnough:
+        return None
+
+    # the cached user holds the live balance of the authentication, another
+    # thread may cache the balance before the debit until it commits
+    transaction.on_commit(lambda: user_cache.invalidate(user.id))
+
+    user.live_balance = balance
+    return balance
+
+
+def credit_balance(user:User, amount:float) -> float:
+    '''
+    Credits amount to the user balance through the balance journal
+
+    Credits made by editing User.balance directly are reported by the
+    check_balances command, which can't tell them apart from a lost debit.
+
+    :return: the new balance
+    '''
+    BalanceEntry.objects.append(user.id, amount)
+    transaction.on_commit(lambda: user_cache.invalidate(user.id))
+    return current_balance(user)
+
+
+def save_records(records:list):
+    '''
+    Saves the records of a debit
+
+    With settings.RECORD_WRITE_BEHIND enabled the records are queued in the
+    record buffer once the transaction of the debit commits, and inserted a
+    moment later by its flusher thread.
+    '''
+    buffer = get_record_buffer()
+    if buffer is None:
+        Record.objects.bulk_create(records)
+    else:
+        transaction.on_commit(lambda: buffer.put(records))
+
+
+def record_usage(user:User, records:list):
+    '''
+    Adds records to the usage rollups of the user, one UPDATE per operation
+    type and day, or an INSERT for the first operation of the day
+
+    Call it inside the transaction of the debit, after debit_balance
+    inserted the entry that serializes the debits of the user.
+    '''
+    usage = {}
+    for record in records:
+        key = (record.operation.type, timezone.localdate(record.date))
+        count, cost = usage.get(key, (0, 0.0))
+        usage[key] = (count + 1, cost + record.cost)
+        OPERATIONS_CHARGED.inc(operation=record.operation.type_str)
+
+    for (operation_type, day), (count, cost) in usage.items():
+        rollup = UsageRollup.objects.filter(user_id=user.id, operation_type=operation_type, day=day)
+        if rollup.update(count=F('count') + count, total_cost=F('total_cost') + cost):
+            continue
+        try:
+            with transaction.atomic():
+                UsageRollup.objects.create(user_id=user.id, operation_type=operation_type, day=day,
+                                           count=count, total_cost=cost)
+        except IntegrityError:
+            # inserted by a concurrent debit of the user
+            rollup.update(count=F('count') + count, total_cost=F('total_cost') + cost)
+
+
+def charge(user:User, operation:Operation, operation_response, cost:float=None) -> Optional[float]:
+    '''
+    Debits an operation, adds it to the usage rollups and saves its record
+    in one transaction, or queues the record once the debit commits in
+    write-behind mode
+
+    :param user: user to be charged
+    :param operation: operation performed
+    :param operation_response: response saved in the record
+    :param cost: amount to be debited, the operation cost by default
+    :return: the new balance, or None if the balance is not enough
+    '''
+    if cost is None:
+        cost = operation.cost
+
+    with transaction.atomic():
+        balance = debit_balance(user, cost)
+        if balance is None:
+            return None
+
+        record = Record(cost=cost,
+                        user_balance=balance + cost,
+                        operation=operation, user=user,
+                        **Record.result_fields(operation_response))
+        record_usage(user, [record])
+        save_records([record])
+    return balance
+
+
+def charge_many(user:User, performed:list) -> Optional[float]:
+    '''
+    Debits several operations at once and saves their records with a
+    single bulk insert, in one transaction
+
+    :param user: user to be charged
+    :param performed: list of (operation, operation_response)
+    :return: the new balance, or None if the balance is not enough
+    '''
+    cost = sum(operation.cost for operation, operation_response in performed)
+
+    with transaction.atomic():
+        balance = debit_balance(user, cost)
+        if balance is None:
+            return None
+
+        records = []
+        user_balance = balance + cost
+        for operation, operation_response in performed:
+            records.append(Record(cost=operation.cost,
+                                  user_balance=user_balance,
+                                  operation=operation, user=user,
+                                  **Record.result_fields(operation_response)))
+            user_balance -= operation.cost
+        record_usage(user, records)
+        save_records(records)
+    return balance
@@ -0,0 +1,123 @@
+import datetime
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+
+class BloomFilter:
+    '''
+    Compact set of strings with no false negatives and a false positive
+    rate of about error_rate, as long as it holds at most capacity items
+
+    :param capacity: expected number of items
+    :param error_rate: false positive rate at capacity
+    '''
+    def __init__(self, capacity:int, error_rate:float=0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / self.capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value:str):
+        # double hashing on the two halves of one digest
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value:str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value:str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class BlacklistFilter:
+    '''
+    Per process Bloom filter of the blacklisted refresh token ids
+
+    A token id missing from the filter is known not to be blacklisted, so
+    only the tokens that may be blacklisted are checked in the
+    token_blacklist tables.
+
+    The filter is loaded on first use with the blacklisted tokens that
+    haven't expired. The tokens blacklisted by this process are added right
+    away by the BlacklistedToken post_save signal. The ones blacklisted by
+    other processes are picked up every settings.TOKEN_BLACKLIST_FILTER_SYNC_INTERVAL
+    seconds, by reading the rows blacklisted since the last sync, minus
+    settings.TOKEN_BLACKLIST_FILTER_SYNC_MARGIN seconds for the transactions
+    that commit late and the clocks of the other servers. The ids don't
+    arrive in commit order on every database, the dates do within the
+    margin. During that window another process may accept a token that was
+    just blacklisted.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._last_sync = None
+        self._synced_at = 0.0
+
+    def _load(self):
+        capacity = getattr(settings, "TOKEN_BLACKLIST_FILTER_CAPACITY", 100000)
+        started = timezone.now()
+        rows = BlacklistedToken.objects.filter(token__expires_at__gt=started).values_list("token__jti", flat=True)
+        bloom = BloomFilter(capacity, getattr(settings, "TOKEN_BLACKLIST_FILTER_ERROR_RATE", 0.001))
+        for jti in rows.iterator(chunk_size=5000):
+            bloom.add(jti)
+        self._filter = bloom
+        self._last_sync = started
+        self._synced_at = time.monotonic()
+
+    def _sync(self):
+        started = timezone.now()
+        margin = datetime.timedelta(seconds=getattr(settings, "TOKEN_BLACKLIST_FILTER_SYNC_MARGIN", 60))
+        rows = BlacklistedToken.objects.filter(blacklisted_at__gte=self._last_sync - margin) \
+                                       .values_list("token__jti", flat=True)
+        for jti in rows:
+            # the windows overlap, count each token once
+            if jti not in self._filter:
+                self._filter.add(jti)
+        self._last_sync = started
+        self._synced_at = time.monotonic()
+        if self._filter.count > self._filter.capacity:
+            # past its capacity the false positive rate grows, rebuild it
+            # without the expired tokens
+            self._load()
+
+    def _get_filter(self) -> BloomFilter:
+        interval = getattr(settings, "TOKEN_BLACKLIST_FILTER_SYNC_INTERVAL", 5)
+        if self._filter is None or time.monotonic() - self._synced_at > interval:
+            with self._lock:
+                if self._filter is None:
+                    self._load()
+                elif time.monotonic() - self._synced_at > interval:
+                    self._sync()
+        return self._filter
+
+    def might_contain(self, jti:str) -> bool:
+        '''
+        Returns False if the token is not blacklisted, True if it may be
+        '''
+        return jti in self._get_filter()
+
+    def add(self, jti:str):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+    def invalidate(self):
+        with self._lock:
+            self._filter = None
+
+
+blacklist_filter = BlacklistFilter()
@@ -0,0 +1,76 @@
+import threading
+import time
+
+from django.conf import settings
+
+from api.models import Operation
+from api.serializers import OperationSerializer
+
+
+class OperationCatalog:
+    '''
+    Per process cache of the Operation rows and of their serialized payload
+
+    The catalog is loaded on first use and reloaded after invalidate(), which
+    is called by the Operation post_save and post_delete signals, or when it's
+    older than settings.OPERATION_CATALOG_TTL seconds.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _load(self) -> tuple:
+        operations = list(Operation.objects.order_by('id'))
+        serialized = [dict(item) for item in OperationSerializer(operations, many=True).data]
+        by_type = {}
+        for operation in operations:
+            by_type.setdefault(operation.type, operation)
+        return ({operation.id: operation for operation in operations}, serialized, time.monotonic(), by_type)
+
+    def _get_state(self) -> tuple:
+        state = self._state
+        ttl = getattr(settings, "OPERATION_CATALOG_TTL", None)
+        if state is None or (ttl is not None and time.monotonic() - state[2] > ttl):
+            with self._lock:
+                if self._state is state:
+                    self._state = self._load()
+                state = self._state
+        return state
+
+    def get(self, operation_id) -> Operation:
+        '''
+        Returns the operation with the given id
+
+        :raises Operation.DoesNotExist: if there's no such operation
+        '''
+        try:
+            return self._get_state()[0][int(operation_id)]
+        except (KeyError, TypeError, ValueError):
+            raise Operation.DoesNotExist("Operation matching id {} does not exist.".format(operation_id))
+
+    def get_by_type(self, operation_type:int) -> Operation:
+        '''
+        Returns the first operation of the given type
+
+        :raises Operation.DoesNotExist: if there's no such operation
+        '''
+        try:
+            return self._get_state()[3][operation_type]
+        except KeyError:
+            raise Operation.DoesNotExist("Operation matching type {} does not exist.".format(operation_type))
+
+    def all(self) -> list:
+        return list(self._get_state()[0].values())
+
+    def serialized(self) -> list:
+        '''
+        Returns the OperationSerializer payload of all the operations
+        '''
+        return self._get_state()[1]
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+
+catalog = OperationCatalog()
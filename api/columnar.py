@@ -0,0 +1,154 @@
+import base64
+import io
+
+import numpy as np
+
+# operations that can be applied to whole columns
+COLUMN_OPERATIONS = {
+    1: np.add,
+    2: np.subtract,
+    3: np.multiply,
+    4: np.true_divide,
+    5: np.power,
+}
+
+# little endian float64, base64 encoded
+FLOAT64_BASE64 = "float64-base64"
+FLOAT64 = np.dtype("<f8")
+# upper bound of the bytes of a CSV number and its separator
+CSV_BYTES_PER_ELEMENT = 32
+
+
+class ColumnError(ValueError):
+    pass
+
+
+def too_many_elements(max_count:int) -> ColumnError:
+    return ColumnError("A bulk operation accepts at most {} elements".format(max_count))
+
+
+def decode_column(value, max_count:int=None) -> np.ndarray:
+    '''
+    Decodes an operand column
+
+    :param value: a number, a JSON list of numbers, {"encoding": "float64-base64",
+                  "data": ...}, or an uploaded CSV or .f8 binary file
+    :param max_count: maximum number of elements, the encoded data and the
+                      files are rejected from their size before decoding them
+    '''
+    if value is None or value == "" or value == []:
+        raise ColumnError("Operator 1 and Operator 2 are required")
+    if hasattr(value, "read"):
+        return decode_file(value, max_count)
+
+    if isinstance(value, dict):
+        if value.get("encoding") != FLOAT64_BASE64:
+            raise ColumnError("Unsupported encoding, use {}".format(FLOAT64_BASE64))
+        data = value.get("data", "")
+        if max_count is not None and isinstance(data, str) and len(data) > 4 * -(-max_count * FLOAT64.itemsize // 3):
+            raise too_many_elements(max_count)
+        try:
+            data = base64.b64decode(data, validate=True)
+            return np.frombuffer(data, dtype=FLOAT64)
+        except (TypeError, ValueError) as e:
+            raise ColumnError("Invalid {} data".format(FLOAT64_BASE64))
+
+    if isinstance(value, bool):
+        raise ColumnError("Invalid operator")
+    try:
+        column = np.asarray(value, dtype=FLOAT64)
+    except (TypeError, ValueError) as e:
+        raise ColumnError("Invalid operator")
+    if column.ndim > 1:
+        raise ColumnError("Operators must be numbers or flat lists of numbers")
+    return column
+
+
+def decode_file(file, max_count:int=None) -> np.ndarray:
+    '''
+    Decodes an uploaded column, a .f8 binary buffer or numbers separated by
+    commas or new lines
+
+    :param max_count: maximum number of elements, a larger file is rejected
+                      before it's read
+    '''
+    binary = getattr(file, "name", "").endswith(".f8") or getattr(file, "content_type", "") == "application/octet-stream"
+    if max_count is None:
+        data = file.read()
+    else:
+        max_size = max_count * (FLOAT64.itemsize if binary else CSV_BYTES_PER_ELEMENT)
+        if getattr(file, "size", None) is not None and file.size > max_size:
+            raise too_many_elements(max_count)
+        data = file.read(max_size + 1)
+        if len(data) > max_size:
+            raise too_many_elements(max_count)
+
+    if binary:
+        if len(data) % FLOAT64.itemsize:
+            raise ColumnError("Invalid float64 buffer")
+        return np.frombuffer(data, dtype=FLOAT64)
+
+    try:
+        text = data.decode("utf-8").replace(",", "\n")
+        return np.loadtxt(io.StringIO(text), dtype=FLOAT64, ndmin=1)
+    except ValueError as e:
+        raise ColumnError("Invalid CSV column")
+
+
+def encode_column(column:np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(column, dtype=FLOAT64).tobytes()).decode("ascii")
+
+
+def encode_mask(mask:np.ndarray) -> str:
+    '''
+    Encodes a boolean mask as base64 packed bits, first element in the
+    least significant bit of the first byte
+    '''
+    return base64.b64encode(np.packbits(mask, bitorder="little").tobytes()).decode("ascii")
+
+
+def decode_operands(operator1, operator2, max_count:int=None) -> tuple:
+    '''
+    Decodes the operand columns of a bulk operation
+
+    Any of the operators may be a single number, applied to every element
+    of the other one.
+
+    :param max_count: maximum number of elements of each column
+    :return: both columns and the number of elements of the operation
+    '''
+    column1 = decode_column(operator1, max_count)
+    column2 = decode_column(operator2, max_count)
+    if column1.ndim and column2.ndim and column1.shape != column2.shape:
+        raise ColumnError("Operator 1 and Operator 2 must have the same length")
+    return column1, column2, max(column1.size, column2.size)
+
+
+def evaluate_columns(operation_type:int, column1:np.ndarray, column2:np.ndarray) -> dict:
+    '''
+    Applies an arithmetic operation to operand columns
+
+    The elements that fail, like a division by zero, are reported in an
+    error mask and set to NaN in the result.
+
+    :param operation_type: arithmetic operation type
+    :param column1: first operand column
+    :param column2: second operand column
+    :return: count, error_count, error_mask and the result column, base64 encoded
+    '''
+    if operation_type not in COLUMN_OPERATIONS:
+        raise ColumnError("Invalid operation")
+
+    with np.errstate(all="ignore"):
+        result = COLUMN_OPERATIONS[operation_type](column1, column2)
+    result = np.atleast_1d(result)
+
+    errors = ~np.isfinite(result)
+    result[errors] = np.nan
+    return {
+        "count": int(result.size),
+        "error_count": int(errors.sum()),
+        "encoding": FLOAT64_BASE64,
+        "result": encode_column(result),
+        "error_mask": encode_mask(errors),
+    }
@@ -0,0 +1,158 @@
+import ast
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+
+from api.operations import dict_message, perform_operation
+
+# operation type of each arithmetic operator
+OPERATOR_TYPES = {
+    ast.Add: 1,
+    ast.Sub: 2,
+    ast.Mult: 3,
+    ast.Div: 4,
+    ast.Pow: 5,
+}
+SQUARE_ROOT_TYPE = 5
+SUBSTRACTION_TYPE = 2
+
+MAX_EXPRESSION_LENGTH = 1000
+MAX_EXPRESSION_OPERATIONS = 100
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+class ExpressionPlan:
+    '''
+    Compiled arithmetic expression
+
+    The expression is kept as a postfix program of steps, each step being
+    ("const", value), ("var", name) or ("op", operation_type). Every "op" step
+    runs through perform_operation, so it behaves and is charged like a
+    request to the operation view.
+    '''
+    def __init__(self, expression:str, steps:tuple):
+        self.expression = expression
+        self.steps = steps
+        self.variables = frozenset(arg for step, arg in steps if step == "var")
+        self.operation_counts = Counter(arg for step, arg in steps if step == "op")
+        self.root_type = steps[-1][1] if steps[-1][0] == "op" else None
+
+    def evaluate(self, variables:dict) -> dict:
+        '''
+        Evaluates the expression with the given variable bindings
+
+        :param variables: values of the variables by name
+        :return: the dict_message of the result or of the first error
+        '''
+        missing = self.variables.difference(variables)
+        if missing:
+            return dict_message(error_message="Missing variables: {}".format(", ".join(sorted(missing))))
+
+        stack = []
+        for step, arg in self.steps:
+            if step == "const":
+                stack.append(arg)
+            elif step == "var":
+                stack.append(variables[arg])
+            else:
+                operator2 = stack.pop()
+                operator1 = stack.pop()
+                response = perform_operation(operation_type=arg, operator1=operator1, operator2=operator2)
+                if response['status'] != 1:
+                    return response
+                stack.append(response['response_data'])
+        return dict_message(response_data=stack.pop())
+
+
+class ExpressionCompiler(ast.NodeVisitor):
+    '''
+    Compiles the AST of an arithmetic expression to postfix steps
+
+    Only numbers, variables, the + - * / ** operators and sqrt() are
+    accepted, anything else raises ExpressionError.
+    '''
+    def __init__(self):
+        self.steps = []
+
+    def generic_visit(self, node):
+        raise ExpressionError("Unsupported syntax: {}".format(type(node).__name__))
+
+    def visit_Expression(self, node):
+        self.visit(node.body)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ExpressionError("Unsupported constant: {!r}".format(node.value))
+        self.steps.append(("const", float(node.value)))
+
+    def visit_Name(self, node):
+        self.steps.append(("var", node.id))
+
+    def visit_BinOp(self, node):
+        operation_type = OPERATOR_TYPES.get(type(node.op))
+        if operation_type is None:
+            raise ExpressionError("Unsupported operator: {}".format(type(node.op).__name__))
+        self.visit(node.left)
+        self.visit(node.right)
+        self.steps.append(("op", operation_type))
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.UAdd):
+            self.visit(node.operand)
+        elif isinstance(node.op, ast.USub):
+            if isinstance(node.operand, ast.Constant):
+                # negative numbers are constants
+                self.visit(node.operand)
+                self.steps[-1] = ("const", -self.steps[-1][1])
+            else:
+                # -x is 0 - x
+                self.steps.append(("const", 0.0))
+                self.visit(node.operand)
+                self.steps.append(("op", SUBSTRACTION_TYPE))
+        else:
+            raise ExpressionError("Unsupported operator: {}".format(type(node.op).__name__))
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id != "sqrt" \
+                or len(node.args) != 1 or node.keywords:
+            raise ExpressionError("Only sqrt(x) calls are supported")
+        # sqrt(x) is x ** 0.5
+        self.visit(node.args[0])
+        self.steps.append(("const", 0.5))
+        self.steps.append(("op", SQUARE_ROOT_TYPE))
+
+
+def normalize_expression(expression:str) -> str:
+    return " ".join(expression.split())
+
+
+@lru_cache(maxsize=getattr(settings, "EXPRESSION_PLAN_CACHE_SIZE", 256))
+def _compile(normalized:str) -> ExpressionPlan:
+    try:
+        tree = ast.parse(normalized, mode="eval")
+        compiler = ExpressionCompiler()
+        compiler.visit(tree)
+    except (SyntaxError, RecursionError) as e:
+        raise ExpressionError("Invalid expression")
+    plan = ExpressionPlan(normalized, tuple(compiler.steps))
+    if sum(plan.operation_counts.values()) > MAX_EXPRESSION_OPERATIONS:
+        raise ExpressionError("An expression accepts at most {} operations".format(MAX_EXPRESSION_OPERATIONS))
+    return plan
+
+
+def compile_expression(expression:str) -> ExpressionPlan:
+    '''
+    Compiles an arithmetic expression, with the plans of the recently used
+    expressions kept in a LRU cache keyed by the normalized expression
+
+    :raises ExpressionError: if the expression is invalid
+    '''
+    if not isinstance(expression, str) or not expression.strip():
+        raise ExpressionError("An expression is required")
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError("An expression accepts at most {} characters".format(MAX_EXPRESSION_LENGTH))
+    return _compile(normalize_expression(expression))
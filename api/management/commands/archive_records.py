@@ -0,0 +1,54 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import Record, RecordArchive
+
+# columns copied to the archive, the ids are kept
+ARCHIVE_FIELDS = ('id', 'cost', 'user_balance', 'result_number', 'result_string', 'operation_response',
+                  'date', 'operation_id', 'user_id', 'is_active')
+
+
+class Command(BaseCommand):
+    help = "Moves the soft deleted records, and optionally the old ones, to the archive table in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=0,
+                            help="archive the soft deleted records older than this many days")
+        parser.add_argument("--active-older-than", type=int, default=None, metavar="DAYS",
+                            help="also archive the active records older than this many days, "
+                                 "they leave the records history of the users")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="records moved per transaction")
+        parser.add_argument("--sleep", type=float, default=0,
+                            help="seconds to wait between batches, to let the requests write")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        condition = Q(is_active=False, date__lt=now - datetime.timedelta(days=options["days"]))
+        if options["active_older_than"] is not None:
+            condition |= Q(date__lt=now - datetime.timedelta(days=options["active_older_than"]))
+        queryset = Record.objects.filter(condition).order_by('id')
+
+        archived = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                # each batch starts after the previous one, instead of
+                # scanning the rows already archived again
+                rows = list(queryset.filter(id__gt=last_id).values(*ARCHIVE_FIELDS)[:options["batch_size"]])
+                if not rows:
+                    break
+                # copy and delete in the same transaction, a record is never in both tables
+                RecordArchive.objects.bulk_create([RecordArchive(**row) for row in rows])
+                Record.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            archived += len(rows)
+            last_id = rows[-1]['id']
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write("Archived {} records".format(archived))
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Sum
+
+from api.authentication import user_cache
+from api.models import BalanceEntry, Record, RecordArchive, User
+from api.record_buffer import DEFAULT_WRITE_BEHIND
+
+
+class Command(BaseCommand):
+    help = ("Checks the live balance of the users against their Record history: the balance "
+            "after their last record plus the balance entries journaled after it")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true",
+                            help="adjust the balance snapshots to the rebuilt balances, only upwards")
+        parser.add_argument("--take-back", action="store_true",
+                            help="with --fix, also lower the balances higher than the records rebuild")
+        parser.add_argument("--tolerance", type=float, default=1e-6)
+
+    def expected_balance(self, user_id:int):
+        '''
+        Rebuilds the balance of a user from the Record history, or returns
+        None if the user has no records
+        '''
+        # the last record may have been archived
+        candidates = [model.objects.filter(user_id=user_id).order_by('-date', '-id')
+                                   .values('id', 'date', 'cost', 'user_balance').first()
+                      for model in (Record, RecordArchive)]
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        if not candidates:
+            return None
+        last = max(candidates, key=lambda candidate: (candidate['date'], candidate['id']))
+
+        # each record keeps the balance before its debit, the entries after
+        # it are the credits and the admin edits, whose debit entry is
+        # inserted before the record
+        entries = BalanceEntry.objects.filter(user_id=user_id, date__gt=last['date']) \
+                                      .aggregate(total=Sum('amount'))['total'] or 0.0
+        return last['user_balance'] - last['cost'] + entries
+
+    def handle(self, *args, **options):
+        write_behind = dict(DEFAULT_WRITE_BEHIND, **getattr(settings, "RECORD_WRITE_BEHIND", {}))
+        if options["fix"] and write_behind["ENABLED"]:
+            # the queued and spilled records would be refunded as missing
+            raise CommandError("--fix can't run with RECORD_WRITE_BEHIND enabled, disable it and "
+                               "replay the record spill first")
+
+        inconsistent = 0
+        user_ids = set(Record.objects.order_by().values_list('user_id', flat=True).distinct())
+        user_ids.update(RecordArchive.objects.order_by().values_list('user_id', flat=True).distinct())
+        for user_id in sorted(user_ids):
+            with transaction.atomic():
+                # lock the user so no debit lands between the two reads
+                User.objects.filter(id=user_id).update(balance=F('balance'))
+                expected = self.expected_balance(user_id)
+                live = User.objects.with_live_balance().values_list('live_balance', flat=True).get(id=user_id)
+                if expected is None or abs(expected - live) <= options["tolerance"]:
+                    continue
+
+                inconsistent += 1
+                self.stdout.write("User {}: balance {} but the records rebuild {}".format(user_id, live, expected))
+                # a higher balance is usually a credit made outside of the
+                # journal, like a direct edit of the snapshot
+                if options["fix"] and (expected > live or options["take_back"]):
+                    User.objects.filter(id=user_id).update(balance=F('balance') + (expected - live))
+                    transaction.on_commit(lambda user_id=user_id: user_cache.invalidate(user_id))
+
+        if inconsistent and not options["fix"]:
+            raise CommandError("{} inconsistent balances".format(inconsistent))
+        self.stdout.write("{} inconsistent balances{}".format(inconsistent, ", fixed" if options["fix"] else ""))
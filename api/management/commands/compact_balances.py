@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
+
+from api.authentication import user_cache
+from api.models import BalanceEntry, User
+
+
+class Command(BaseCommand):
+    help = "Folds the pending balance entries into the user balance snapshots"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="entries folded per transaction")
+        parser.add_argument("--delete-applied", action="store_true",
+                            help="delete the applied entries afterwards")
+
+    def compact_user(self, user_id:int, batch_size:int) -> int:
+        '''
+        Folds the pending entries of a user, batch_size entries per transaction
+
+        :return: the number of entries folded
+        '''
+        compacted = 0
+        while True:
+            with transaction.atomic():
+                # write first, so the transaction holds the SQLite write lock
+                # or the user row lock before reading the entries
+                User.objects.filter(id=user_id).update(balance=F('balance'))
+
+                entries = list(BalanceEntry.objects.filter(user_id=user_id, applied=False)
+                                                   .order_by('id').values_list('id', 'amount')[:batch_size])
+                if not entries:
+                    return compacted
+
+                # the snapshot and the applied flags change in the same
+                # transaction, the live balance never sees them apart
+                BalanceEntry.objects.filter(id__in=[id for id, amount in entries]).update(applied=True)
+                User.objects.filter(id=user_id).update(balance=F('balance') + sum(amount for id, amount in entries))
+            compacted += len(entries)
+
+    def delete_applied(self, batch_size:int) -> int:
+        # the last entry of each user is kept, the next entry of the user
+        # continues its sequence
+        last = BalanceEntry.objects.filter(user_id=OuterRef('user_id')).order_by() \
+                                   .values('user_id').annotate(last=Max('seq')).values('last')
+        applied = BalanceEntry.objects.filter(applied=True, seq__lt=Subquery(last))
+        deleted = 0
+        while True:
+            ids = list(applied.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            BalanceEntry.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        user_ids = list(BalanceEntry.objects.filter(applied=False).order_by()
+                                            .values_list('user_id', flat=True).distinct())
+        compacted = 0
+        for user_id in user_ids:
+            compacted += self.compact_user(user_id, batch_size)
+            user_cache.invalidate(user_id)
+        self.stdout.write("Compacted {} balance entries of {} users".format(compacted, len(user_ids)))
+
+        if options["delete_applied"]:
+            deleted = self.delete_applied(batch_size)
+            self.stdout.write("Deleted {} applied balance entries".format(deleted))
@@ -0,0 +1,103 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+# what a worker imports before it serves its first request: the settings,
+# the apps, the WSGI application and the URLconf with the views
+STARTUP_SCRIPT = """
+from django.conf import settings
+from django.urls import get_resolver
+from django.utils.module_loading import import_string
+
+import_string(settings.WSGI_APPLICATION)
+get_resolver().url_patterns
+"""
+
+
+def run_startup(settings_module:str, importtime:bool=False) -> subprocess.CompletedProcess:
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", STARTUP_SCRIPT]
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise CommandError("The application failed to start:\n{}".format(result.stderr[-2000:]))
+    return result
+
+
+def measure_startup(settings_module:str, repeat:int=3) -> float:
+    '''
+    Returns the fastest of repeat cold starts of a new interpreter, in
+    seconds
+    '''
+    durations = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        run_startup(settings_module)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def profile_imports(settings_module:str) -> list:
+    '''
+    Returns the (module, self microseconds, cumulative microseconds) of every
+    module imported by a cold start, from the -X importtime report
+    '''
+    modules = []
+    for line in run_startup(settings_module, importtime=True).stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # the header line
+            continue
+        modules.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return modules
+
+
+def group_by_package(modules:list) -> list:
+    '''
+    Returns the (package, self microseconds, number of modules) of the top
+    level packages, slowest first
+    '''
+    packages = {}
+    for module, self_us, cumulative_us in modules:
+        package = module.split(".")[0]
+        total, count = packages.get(package, (0, 0))
+        packages[package] = (total + self_us, count + 1)
+    return sorted(((package, total, count) for package, (total, count) in packages.items()),
+                  key=lambda row: row[1], reverse=True)
+
+
+class Command(BaseCommand):
+    help = "Reports the cold start time of the application and the import time of each module"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--settings-module", default=os.environ.get("DJANGO_SETTINGS_MODULE"),
+                            help="settings of the profiled start, the current ones by default")
+        parser.add_argument("--top", type=int, default=20,
+                            help="number of modules and packages listed")
+        parser.add_argument("--repeat", type=int, default=3,
+                            help="cold starts timed, the fastest is reported")
+        parser.add_argument("--budget", type=float, default=None, metavar="SECONDS",
+                            help="fail when the cold start takes longer")
+
+    def handle(self, *args, **options):
+        settings_module = options["settings_module"]
+        seconds = measure_startup(settings_module, options["repeat"])
+        modules = profile_imports(settings_module)
+
+        self.stdout.write("{}: cold start {:.3f}s, {} modules imported in {:.3f}s".format(
+            settings_module, seconds, len(modules), sum(row[1] for row in modules) / 1e6))
+
+        self.stdout.write("\n{:<48}{:>12}{:>14}".format("slowest modules", "self ms", "cumulative ms"))
+        for module, self_us, cumulative_us in sorted(modules, key=lambda row: row[2], reverse=True)[:options["top"]]:
+            self.stdout.write("{:<48}{:>12.1f}{:>14.1f}".format(module, self_us / 1000, cumulative_us / 1000))
+
+        self.stdout.write("\n{:<48}{:>12}{:>14}".format("slowest packages", "self ms", "modules"))
+        for package, self_us, count in group_by_package(modules)[:options["top"]]:
+            self.stdout.write("{:<48}{:>12.1f}{:>14}".format(package, self_us / 1000, count))
+
+        if options["budget"] is not None and seconds > options["budget"]:
+            raise CommandError("The cold start took {:.3f}s, over the {:.3f}s budget".format(seconds, options["budget"]))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = "Deletes the expired outstanding and blacklisted tokens in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="rows deleted per transaction")
+
+    def delete_in_batches(self, queryset, batch_size:int) -> int:
+        '''
+        Deletes the rows of queryset, batch_size rows per transaction, so the
+        tables are never locked for long
+        '''
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                ids = list(queryset.values_list("id", flat=True)[:batch_size])
+                if not ids:
+                    return deleted
+                queryset.model.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options["batch_size"]
+
+        # the blacklisted rows first, so deleting the outstanding ones
+        # doesn't cascade
+        blacklisted = self.delete_in_batches(
+            BlacklistedToken.objects.filter(token__expires_at__lte=now).order_by("id"), batch_size)
+        outstanding = self.delete_in_batches(
+            OutstandingToken.objects.filter(expires_at__lte=now).order_by("id"), batch_size)
+
+        self.stdout.write("Deleted {} blacklisted and {} outstanding expired tokens".format(blacklisted, outstanding))
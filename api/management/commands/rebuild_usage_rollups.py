@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from api.models import Record, RecordArchive, UsageRollup, User
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the usage rollups from the records and the archived records"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, default=None, metavar="USER_ID",
+                            help="rebuild the rollups of this user only")
+
+    def usage(self, model, user_id:int) -> list:
+        '''
+        Returns the (operation type, day, count, total cost) of the records
+        of a user in model
+        '''
+        return model.objects.filter(user_id=user_id).order_by() \
+                            .values_list(F('operation__type'), TruncDate('date', tzinfo=timezone.get_current_timezone())) \
+                            .annotate(count=Count('id'), total_cost=Sum('cost'))
+
+    def rebuild_user(self, user_id:int) -> int:
+        '''
+        Replaces the rollups of a user in one transaction
+
+        :return: the number of rollups written
+        '''
+        with transaction.atomic():
+            # write first, so the debits of the user wait for the rebuild
+            # instead of updating the rollups being replaced
+            User.objects.filter(id=user_id).update(balance=F('balance'))
+
+            usage = {}
+            for model in (Record, RecordArchive):
+                for operation_type, day, count, total_cost in self.usage(model, user_id):
+                    previous_count, previous_cost = usage.get((operation_type, day), (0, 0.0))
+                    usage[(operation_type, day)] = (previous_count + count, previous_cost + total_cost)
+
+            UsageRollup.objects.filter(user_id=user_id).delete()
+            UsageRollup.objects.bulk_create([UsageRollup(user_id=user_id, operation_type=operation_type, day=day,
+                                                         count=count, total_cost=total_cost)
+                                             for (operation_type, day), (count, total_cost) in usage.items()],
+                                            batch_size=1000)
+        return len(usage)
+
+    def handle(self, *args, **options):
+        if options["user"] is not None:
+            user_ids = [options["user"]]
+        else:
+            user_ids = set(Record.objects.order_by().values_list('user_id', flat=True).distinct())
+            user_ids.update(RecordArchive.objects.order_by().values_list('user_id', flat=True).distinct())
+            user_ids.update(UsageRollup.objects.order_by().values_list('user_id', flat=True).distinct())
+
+        rollups = 0
+        for user_id in sorted(user_ids):
+            rollups += self.rebuild_user(user_id)
+        self.stdout.write("Rebuilt {} usage rollups of {} users".format(rollups, len(user_ids)))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.record_buffer import DEFAULT_WRITE_BEHIND, replay_spill_files
+
+
+class Command(BaseCommand):
+    help = "Inserts the records spilled to files by the write-behind record buffer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--spill-dir", help="directory of the spill files, RECORD_WRITE_BEHIND['SPILL_DIR'] by default")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        config = dict(DEFAULT_WRITE_BEHIND, **getattr(settings, "RECORD_WRITE_BEHIND", {}))
+        spill_dir = options["spill_dir"] or config["SPILL_DIR"]
+        if not spill_dir:
+            raise CommandError("No spill directory configured")
+
+        inserted = replay_spill_files(spill_dir, batch_size=options["batch_size"])
+        self.stdout.write("Inserted {} spilled records".format(inserted))
@@ -0,0 +1,142 @@
+import glob
+import multiprocessing
+import os
+import threading
+from concurrent.futures import wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from api.catalog import catalog
+from api.metrics import metrics_config, registry
+
+WORKER_CLASSES = {
+    "wsgi": "gthread",
+    "asgi": "uvicorn.workers.UvicornWorker",
+}
+
+
+def clear_metrics(server):
+    '''
+    Deletes the metrics files of the previous run, before the first worker
+    starts
+    '''
+    directory = metrics_config()["DIR"]
+    if directory:
+        for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+            os.remove(path)
+
+
+def fold_metrics(server, worker):
+    # the exited worker flushed its values at exit
+    registry.fold(worker.pid)
+
+
+def close_connections(server, worker):
+    # a forked worker must not share the connections opened by the master
+    # while loading the application
+    connections.close_all()
+
+
+def warm_up(worker):
+    '''
+    Loads the operation catalog and opens a database connection in every
+    thread of the worker, before it accepts requests
+    '''
+    catalog.all()
+
+    pool = getattr(worker, "tpool", None)
+    if pool is None:
+        connections["default"].ensure_connection()
+        return
+
+    # the connections belong to the thread that opened them, hold each
+    # thread of the pool until all of them are connected
+    threads = worker.cfg.threads
+    barrier = threading.Barrier(threads)
+
+    def connect():
+        connections["default"].ensure_connection()
+        try:
+            barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+
+    wait([pool.submit(connect) for i in range(threads)])
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Serves the application with gunicorn prefork workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", default=os.environ.get("SERVE_BIND", "127.0.0.1:8000"),
+                            help="address to listen on, host:port or unix:path")
+        parser.add_argument("--interface", choices=list(WORKER_CLASSES), default="wsgi",
+                            help="wsgi serves the application with threads, asgi with uvicorn event loops")
+        parser.add_argument("--workers", type=int,
+                            default=int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1)),
+                            help="worker processes")
+        parser.add_argument("--threads", type=int, default=4,
+                            help="threads per wsgi worker")
+        parser.add_argument("--max-requests", type=int, default=1000,
+                            help="requests served by a worker before it's replaced, 0 to never replace them")
+        parser.add_argument("--max-requests-jitter", type=int, default=100,
+                            help="random number of requests added to --max-requests per worker")
+        parser.add_argument("--timeout", type=int, default=30,
+                            help="seconds a worker may be silent before it's killed and replaced")
+        parser.add_argument("--graceful-timeout", type=int, default=30,
+                            help="seconds the workers have to finish their requests on reload or stop")
+        parser.add_argument("--keep-alive", type=int, default=5,
+                            help="seconds to wait for the next request on a keep-alive connection")
+        parser.add_argument("--no-preload", action="store_true",
+                            help="import the application in every worker instead of once in the master, "
+                                 "so a reload (HUP) loads the new code")
+        parser.add_argument("--pid", default=None,
+                            help="file to write the master pid to")
+
+    def gunicorn_options(self, options:dict) -> dict:
+        return {
+            "bind": [options["bind"]],
+            "workers": options["workers"],
+            "threads": options["threads"],
+            "worker_class": WORKER_CLASSES[options["interface"]],
+            "max_requests": options["max_requests"],
+            "max_requests_jitter": options["max_requests_jitter"],
+            "timeout": options["timeout"],
+            "graceful_timeout": options["graceful_timeout"],
+            "keepalive": options["keep_alive"],
+            "preload_app": not options["no_preload"],
+            "pidfile": options["pid"],
+            "on_starting": clear_metrics,
+            "pre_fork": close_connections,
+            "post_worker_init": warm_up,
+            "child_exit": fold_metrics,
+        }
+
+    def application_path(self, interface:str) -> str:
+        if interface == "asgi":
+            return getattr(settings, "ASGI_APPLICATION", "arithmetic_calculator_api.asgi.application")
+        return settings.WSGI_APPLICATION
+
+    def handle(self, *args, **options):
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            raise CommandError("gunicorn is required to serve the application")
+
+        gunicorn_options = self.gunicorn_options(options)
+        application_path = self.application_path(options["interface"])
+
+        class Application(BaseApplication):
+            def load_config(self):
+                for name, value in gunicorn_options.items():
+                    if value is not None:
+                        self.cfg.set(name, value)
+
+            def load(self):
+                return import_string(application_path)
+
+        Application().run()
@@ -0,0 +1,336 @@
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.core.signals import setting_changed
+
+DEFAULT_METRICS = {
+    "ENABLED": True,
+    "DIR": None,
+    "FLUSH_INTERVAL": 1.0,
+    "AUTH_TOKEN": None,
+}
+
+# seconds, from a cached read to a random.org round trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def metrics_config() -> dict:
+    return dict(DEFAULT_METRICS, **getattr(settings, "METRICS", {}))
+
+
+class Metric:
+    '''
+    Base class of the metrics, a value per combination of label values
+
+    :param name: metric name, without the histogram suffixes
+    :param documentation: HELP line of the metric
+    :param labels: label names, every update gives a value for each of them
+    '''
+    type = None
+
+    def __init__(self, name:str, documentation:str, labels:tuple=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels:dict) -> tuple:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def _after_fork(self):
+        # the lock may have been held by another thread of the parent
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def dump(self) -> dict:
+        '''
+        Returns the values by label values, joined with tabs to be JSON keys
+        '''
+        with self._lock:
+            return {"\t".join(key): self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount:float=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def samples(self, key:tuple, value) -> list:
+        return [(self.name + "_total", key, value)]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name:str, documentation:str, labels:tuple=(), buckets:tuple=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value:float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [count per bucket, sum, count]
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return [list(value[0]), value[1], value[2]]
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1], total[2] + value[2]]
+
+    def samples(self, key:tuple, value) -> list:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value[0]):
+            cumulative += count
+            samples.append((self.name + "_bucket", key + (format_value(bound),), cumulative))
+        samples.append((self.name + "_bucket", key + ("+Inf",), value[2]))
+        samples.append((self.name + "_sum", key, value[1]))
+        samples.append((self.name + "_count", key, value[2]))
+        return samples
+
+
+def format_value(value) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+def read_values(path:str):
+    '''
+    Returns the values of a metrics file, None if it's missing or being
+    replaced
+    '''
+    try:
+        with open(path) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return None
+
+
+def escape_label(value:str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    '''
+    Metrics of the process, written as the Prometheus text format
+
+    With settings.METRICS['DIR'] every process writes its values to its own
+    file in that directory, at most every FLUSH_INTERVAL seconds and when it
+    exits, and the exposition sums the files of all the processes. The
+    values of the processes that exited are folded into metrics-exited.json
+    by fold(), so the counters never go back and the directory holds a file
+    per live process. Clear the directory when the server starts.
+    '''
+    def __init__(self):
+        self.metrics = {}
+        self._flushed_at = 0.0
+        self._flush_lock = threading.Lock()
+        self._atexit_registered = False
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def register(self, metric:Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name:str, documentation:str, labels:tuple=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name:str, documentation:str, labels:tuple=(), buckets:tuple=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def _after_fork(self):
+        # a forked worker starts from zero before it records anything, its
+        # parent reports its own values
+        self._flushed_at = 0.0
+        self._flush_lock = threading.Lock()
+        self._atexit_registered = False
+        for metric in self.metrics.values():
+            metric._after_fork()
+
+    def dump(self) -> dict:
+        return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def path(self, directory) -> str:
+        return os.path.join(directory, "metrics-{}.json".format(os.getpid()))
+
+    def flush(self, force:bool=False):
+        '''
+        Writes the values of this process to the metrics directory, if
+        there's one and FLUSH_INTERVAL passed since the last write
+        '''
+        config = metrics_config()
+        directory = config["DIR"]
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < config["FLUSH_INTERVAL"]:
+            return
+        if not self._flush_lock.acquire(blocking=force):
+            return
+        try:
+            self._flushed_at = now
+            os.makedirs(directory, exist_ok=True)
+            path = self.path(directory)
+            with open(path + ".tmp", "w") as metrics_file:
+                json.dump(self.dump(), metrics_file)
+            os.replace(path + ".tmp", path)
+            if not self._atexit_registered:
+                atexit.register(self.flush, force=True)
+                self._atexit_registered = True
+        finally:
+            self._flush_lock.release()
+
+    def fold(self, pid:int):
+        '''
+        Adds the values of a process that exited to metrics-exited.json and
+        deletes its file
+
+        Called by the master of the workers, the only writer of that file.
+        '''
+        directory = metrics_config()["DIR"]
+        if not directory:
+            return
+        path = os.path.join(directory, "metrics-{}.json".format(pid))
+        values = read_values(path)
+        if values is None:
+            return
+
+        exited = os.path.join(directory, "metrics-exited.json")
+        totals = self.merge(read_values(exited) or {}, values)
+        with open(exited + ".tmp", "w") as metrics_file:
+            json.dump(totals, metrics_file)
+        os.replace(exited + ".tmp", exited)
+        os.remove(path)
+
+    def merge(self, totals:dict, values:dict) -> dict:
+        '''
+        Adds values to totals, both by metric name and label values
+        '''
+        for name, by_labels in values.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            merged = totals.setdefault(name, {})
+            for key, value in by_labels.items():
+                merged[key] = metric.merge(merged.get(key), value)
+        return totals
+
+    def collect(self) -> dict:
+        '''
+        Returns the values of all the processes, or of this one without a
+        metrics directory
+        '''
+        directory = metrics_config()["DIR"]
+        if not directory:
+            return self.dump()
+
+        self.flush(force=True)
+        totals = {}
+        for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+            values = read_values(path)
+            if values is not None:
+                self.merge(totals, values)
+        return totals
+
+    def exposition(self) -> str:
+        '''
+        Returns the metrics in the Prometheus text format
+        '''
+        values = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append("# HELP {} {}".format(name, metric.documentation))
+            lines.append("# TYPE {} {}".format(name, metric.type))
+            for joined_key, value in sorted(values.get(name, {}).items()):
+                key = tuple(joined_key.split("\t")) if metric.labels else ()
+                for sample, sample_key, sample_value in metric.samples(key, value):
+                    names = metric.labels + (("le",) if sample.endswith("_bucket") else ())
+                    labels = ",".join('{}="{}"'.format(label, escape_label(label_value))
+                                      for label, label_value in zip(names, sample_key))
+                    lines.append("{}{} {}".format(sample, "{" + labels + "}" if labels else "",
+                                                  format_value(sample_value)))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Duration of the requests by URL name", ("view", "method"))
+REQUESTS = registry.counter(
+    "http_requests", "Requests by URL name and status code", ("view", "method", "status"))
+REQUEST_QUERIES = registry.histogram(
+    "http_request_db_queries", "Database queries per request by URL name", ("view",), buckets=QUERY_BUCKETS)
+REQUEST_QUERY_SECONDS = registry.histogram(
+    "http_request_db_duration_seconds", "Time spent in database queries per request by URL name", ("view",))
+OPERATION_SECONDS = registry.histogram(
+    "operation_duration_seconds", "Duration of the operations by operation type", ("operation",))
+OPERATIONS = registry.counter(
+    "operations", "Operations performed by operation type and outcome", ("operation", "outcome"))
+OPERATIONS_CHARGED = registry.counter(
+    "operations_charged", "Operations debited from the user balances by operation type", ("operation",))
+BALANCE_REJECTIONS = registry.counter(
+    "balance_rejections", "Operations rejected because the user balance was not enough", ("operation",))
+THROTTLED_REQUESTS = registry.counter(
+    "throttled_requests", "Requests rejected by the operation cost throttle by limiting bucket", ("scope",))
+RANDOM_ORG_SECONDS = registry.histogram(
+    "random_org_request_duration_seconds", "Duration of the random.org requests")
+RANDOM_ORG_ERRORS = registry.counter(
+    "random_org_errors", "Failed random.org requests")
+
+
+@receiver(setting_changed)
+def reset_metrics(setting, **kwargs):
+    if setting == "METRICS":
+        registry.reset()
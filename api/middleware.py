@@ -0,0 +1,82 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+
+from api.metrics import (REQUEST_QUERIES, REQUEST_QUERY_SECONDS, REQUEST_SECONDS, REQUESTS, metrics_config,
+                         registry)
+
+
+class QueryStats:
+    '''
+    Database execute wrapper counting the queries and the time spent in them
+    '''
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def view_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.url_name or match.route or "unnamed"
+
+
+class MetricsMiddleware:
+    '''
+    Records the duration and the status of every request by URL name, and
+    the database queries of the sync views
+
+    The async views run their queries in other threads, on other
+    connections, so only their duration is recorded. Keep it first in
+    MIDDLEWARE to time the other middleware too.
+    '''
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not metrics_config()["ENABLED"]:
+            return self.get_response(request)
+
+        queries = QueryStats()
+        start = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        seconds = time.perf_counter() - start
+
+        view = view_name(request)
+        REQUEST_QUERIES.observe(queries.count, view=view)
+        REQUEST_QUERY_SECONDS.observe(queries.seconds, view=view)
+        self.observe(request, response, seconds)
+        return response
+
+    async def __acall__(self, request):
+        if not metrics_config()["ENABLED"]:
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start)
+        return response
+
+    def observe(self, request, response, seconds:float):
+        view = view_name(request)
+        REQUEST_SECONDS.observe(seconds, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        registry.flush()
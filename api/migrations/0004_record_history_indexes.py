@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_record_is_active'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', 'date'], name='record_user_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', 'operation', 'date'], name='record_user_op_history_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 16:42
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_balance_journal'),
+    ]
+
+    operations = [
+        # auto_now_add and default=timezone.now are both set by Django, the
+        # column doesn't change and SQLite would rebuild the whole table
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='record',
+                    name='date',
+                    field=models.DateTimeField(blank=True, default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+    ]
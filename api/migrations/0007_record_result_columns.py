@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_record_date_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='result_number',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='result_string',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,99 @@
+import ast
+import json
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+RESULT_STRING_LENGTH = 64
+
+
+def parse_response(text):
+    '''
+    Parses the str() of the dict_message saved by the previous versions
+    '''
+    try:
+        response = ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return None
+    return response if isinstance(response, dict) and 'status' in response else None
+
+
+def result_fields(response):
+    # same split as Record.result_fields at the time of this migration
+    fields = {'result_number': None, 'result_string': None, 'operation_response': None}
+    extra = {key: value for key, value in response.items()
+             if key not in ('status', 'response_data', 'error_message', 'user_balance')}
+    data = response.get('response_data')
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        fields['result_number'] = data
+    elif isinstance(data, str) and len(data) <= RESULT_STRING_LENGTH:
+        fields['result_string'] = data
+    elif data is not None:
+        extra['response_data'] = data
+    if extra:
+        fields['operation_response'] = json.dumps(extra)
+    return fields
+
+
+def convert_responses(apps, schema_editor):
+    '''
+    Moves the results of the existing records to the typed columns, in
+    batches of BATCH_SIZE rows per transaction so the table is never locked
+    for long
+    '''
+    Record = apps.get_model('api', 'Record')
+    pending = Record.objects.filter(result_number__isnull=True, result_string__isnull=True,
+                                    operation_response__startswith='{').order_by('id')
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            records = list(pending.filter(id__gt=last_id).only('id', 'operation_response')[:BATCH_SIZE])
+            if not records:
+                return
+            converted = []
+            for record in records:
+                response = parse_response(record.operation_response)
+                if response is None:
+                    continue
+                for field, value in result_fields(response).items():
+                    setattr(record, field, value)
+                converted.append(record)
+            Record.objects.bulk_update(converted, ['result_number', 'result_string', 'operation_response'])
+        last_id = records[-1].id
+
+
+def restore_responses(apps, schema_editor):
+    '''
+    Rebuilds the str() of the dict_message of the converted records
+    '''
+    Record = apps.get_model('api', 'Record')
+    converted = Record.objects.exclude(result_number__isnull=True, result_string__isnull=True).order_by('id')
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            records = list(converted.filter(id__gt=last_id)[:BATCH_SIZE])
+            if not records:
+                return
+            for record in records:
+                response = {'status': 1,
+                            'response_data': record.result_number if record.result_number is not None else record.result_string}
+                if record.operation_response:
+                    response.update(json.loads(record.operation_response))
+                record.operation_response = str(response)
+                record.result_number = None
+                record.result_string = None
+            Record.objects.bulk_update(records, ['result_number', 'result_string', 'operation_response'])
+        last_id = records[-1].id
+
+
+class Migration(migrations.Migration):
+    # each batch runs in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0007_record_result_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_responses, restore_responses),
+    ]
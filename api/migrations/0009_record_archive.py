@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-18 16:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_convert_record_responses'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('cost', models.FloatField(default=0.0)),
+                ('user_balance', models.FloatField(default=0.0)),
+                ('result_number', models.FloatField(blank=True, null=True)),
+                ('result_string', models.CharField(blank=True, max_length=64, null=True)),
+                ('operation_response', models.TextField(blank=True, null=True)),
+                ('date', models.DateTimeField()),
+                ('is_active', models.BooleanField(default=False)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('operation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.operation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
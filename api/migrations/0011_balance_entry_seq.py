@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def number_entries(apps, schema_editor):
+    '''
+    Numbers the existing entries of each user in the order of their ids
+    '''
+    BalanceEntry = apps.get_model('api', 'BalanceEntry')
+    user_ids = BalanceEntry.objects.order_by().values_list('user_id', flat=True).distinct()
+    for user_id in list(user_ids):
+        entries = list(BalanceEntry.objects.filter(user_id=user_id).order_by('id').only('id'))
+        for seq, entry in enumerate(entries, 1):
+            entry.seq = seq
+        BalanceEntry.objects.bulk_update(entries, ['seq'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_usage_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='balanceentry',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(number_entries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='balanceentry',
+            constraint=models.UniqueConstraint(fields=('user', 'seq'), name='balance_entry_user_seq_unique'),
+        ),
+    ]
@@ -1,10 +1,30 @@
-from django.db import models
-from django.contrib.auth.models import AbstractUser
+import json
+
+from django.db import IntegrityError, connection, models, transaction
+from django.utils import timezone
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+
+
+class UserManager(BaseUserManager):
+    def with_live_balance(self):
+        '''
+        Annotates the live balance of the users, their balance snapshot plus
+        their pending balance entries
+        '''
+        pending = BalanceEntry.objects.filter(user=OuterRef('pk'), applied=False) \
+                                      .order_by().values('user').annotate(total=Sum('amount')).values('total')
+        return self.annotate(live_balance=F('balance') + Coalesce(Subquery(pending, output_field=models.FloatField()),
+                                                                  Value(0.0)))
 
 
 class User(AbstractUser):
+    # snapshot of the balance, the live balance adds the pending BalanceEntry rows
     balance = models.FloatField(null=False, blank=False, default=0.0)
 
+    objects = UserManager()
+
 class Operation(models.Model):
     TYPE_CHOICES = (
         (1, "addition"),
@@ -14,6 +34,7 @@ class Operation(models.Model):
         (5, "square_root"),
         (6, "random_string"),
     )
+    TYPE_STR = dict(TYPE_CHOICES)
     ARITHMETIC_OPERATIONS = [1,2,3,4,5]
 
     type = models.IntegerField(choices=TYPE_CHOICES, null=False)
@@ -21,20 +42,167 @@ class Operation(models.Model):
     
     @property
     def type_str(self):
-        return [v[1] for v in self.TYPE_CHOICES if v[0] == self.type][0]
+        return self.TYPE_STR[self.type]
     
     def __str__(self):
         return "{} {}".format(self.type_str, self.cost)
 
 class Record(models.Model):
+    RESULT_STRING_LENGTH = 64
+
     cost = models.FloatField(null=False, blank=False, default=0.0)
     user_balance = models.FloatField(null=False, blank=False, default=0.0)
+    # typed result of the operation, the rest of the response as JSON
+    result_number = models.FloatField(null=True, blank=True)
+    result_string = models.CharField(max_length=RESULT_STRING_LENGTH, null=True, blank=True)
     operation_response = models.TextField(null=True, blank=True)
-    date = models.DateTimeField(auto_now_add=True, blank=True)
+    # set when the record is created, not when it's inserted (see api.record_buffer)
+    date = models.DateTimeField(default=timezone.now, blank=True)
     operation = models.ForeignKey(Operation, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # active history of the user by date, optionally filtered by operation
+            models.Index(fields=['user', 'date'], condition=models.Q(is_active=True),
+                         name='record_user_history_idx'),
+            models.Index(fields=['user', 'operation', 'date'], condition=models.Q(is_active=True),
+                         name='record_user_op_history_idx'),
+        ]
+
+    @classmethod
+    def result_fields(cls, operation_response) -> dict:
+        '''
+        Splits the dict_message of an operation into the result columns
+
+        A number result goes to result_number and a short string result to
+        result_string. The other keys, like the expression of an expression
+        or the summary of a bulk operation, are kept in operation_response as
+        JSON. The status and the user balance are not kept, the records are
+        only saved for successful operations and have their own user_balance.
+        '''
+        fields = {'result_number': None, 'result_string': None, 'operation_response': None}
+        if not isinstance(operation_response, dict):
+            fields['operation_response'] = operation_response
+            return fields
+
+        extra = {key: value for key, value in operation_response.items()
+                 if key not in ('status', 'response_data', 'error_message', 'user_balance')}
+        data = operation_response.get('response_data')
+        if isinstance(data, (int, float)) and not isinstance(data, bool):
+            fields['result_number'] = data
+        elif isinstance(data, str) and len(data) <= cls.RESULT_STRING_LENGTH:
+            fields['result_string'] = data
+        elif data is not None:
+            extra['response_data'] = data
+
+        if extra:
+            fields['operation_response'] = json.dumps(extra)
+        return fields
+
     def __str__(self):
         return "{} {}".format(self.user, self.operation)
 
+
+class RecordArchive(models.Model):
+    '''
+    Records moved out of the Record table by the archive_records command,
+    with their original ids
+    '''
+    id = models.BigIntegerField(primary_key=True)
+    cost = models.FloatField(null=False, blank=False, default=0.0)
+    user_balance = models.FloatField(null=False, blank=False, default=0.0)
+    result_number = models.FloatField(null=True, blank=True)
+    result_string = models.CharField(max_length=Record.RESULT_STRING_LENGTH, null=True, blank=True)
+    operation_response = models.TextField(null=True, blank=True)
+    date = models.DateTimeField()
+    operation = models.ForeignKey(Operation, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    is_active = models.BooleanField(default=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "{} {}".format(self.user, self.operation)
+
+
+class UsageRollup(models.Model):
+    '''
+    Number of operations and total cost per user, operation type and day
+
+    Updated in the transaction of every debit (see api.billing.charge), and
+    rebuilt from the records by the rebuild_usage_rollups command. Soft
+    deleted records still count, they were charged.
+    '''
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    operation_type = models.IntegerField(choices=Operation.TYPE_CHOICES)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    total_cost = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'operation_type'], name='usage_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return "{} {} {}".format(self.user, self.day, Operation.TYPE_STR[self.operation_type])
+
+
+class BalanceEntryManager(models.Manager):
+    def append(self, user_id:int, amount:float):
+        '''
+        Appends an entry to the journal of a user, with the next sequence
+        number of the user
+
+        The number is read by the INSERT itself. Two concurrent entries of a
+        user get the same number, the second INSERT waits on the unique index
+        until the first commits and is retried with the next number, so the
+        entries of a user are committed in their sequence order.
+        '''
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        date = self.model._meta.get_field('date').get_db_prep_value(timezone.now(), connection)
+        sql = (
+            "INSERT INTO {table} (user_id, amount, date, applied, seq) "
+            "SELECT %s, %s, %s, %s, COALESCE(MAX(seq), 0) + 1 FROM {table} WHERE user_id = %s"
+        ).format(table=table)
+        while True:
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(sql, [user_id, amount, date, False, user_id])
+                return
+            except IntegrityError:
+                # the number was taken by an entry committed since
+                continue
+
+
+class BalanceEntry(models.Model):
+    '''
+    Append-only journal of the debits and credits of the user balances
+
+    The debits add rows here instead of rewriting the user row. The
+    compact_balances command folds the pending entries into User.balance and
+    marks them as applied, in one transaction. seq numbers the entries of
+    each user, the unique index on it serializes the debits of a user
+    instead of a lock of the user row.
+    '''
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    amount = models.FloatField(null=False, blank=False)
+    date = models.DateTimeField(auto_now_add=True, blank=True)
+    applied = models.BooleanField(default=False)
+    seq = models.PositiveBigIntegerField(default=0)
+
+    objects = BalanceEntryManager()
+
+    class Meta:
+        indexes = [
+            # pending entries of the user, summed by every debit
+            models.Index(fields=['user'], condition=models.Q(applied=False),
+                         name='balance_entry_pending_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'seq'], name='balance_entry_user_seq_unique'),
+        ]
+
+    def __str__(self):
+        return "{} {}".format(self.user, self.amount)
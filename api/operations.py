@@ -1,5 +1,9 @@
+import functools
+import time
+
+from api.metrics import OPERATION_SECONDS, OPERATIONS
 from api.models import Operation
-import requests
+from api.random_strings import get_random_string_provider
 
 def dict_message(response_data=None, error_message:str="") -> dict:
     ''''
@@ -9,6 +13,25 @@ def dict_message(response_data=None, error_message:str="") -> dict:
         return {"status":0, "error_message":error_message}
     return {"status":1, "response_data":response_data}
 
+def observe_operation(operation_type:int, response:dict, seconds:float):
+    '''
+    Records the duration and the outcome of an operation
+    '''
+    operation = Operation.TYPE_STR.get(operation_type, "invalid")
+    OPERATION_SECONDS.observe(seconds, operation=operation)
+    OPERATIONS.inc(operation=operation, outcome="ok" if response["status"] == 1 else "error")
+
+
+def instrumented(function):
+    @functools.wraps(function)
+    def wrapper(operation_type:int, *args, **kwargs):
+        start = time.perf_counter()
+        response = function(operation_type, *args, **kwargs)
+        observe_operation(operation_type, response, time.perf_counter() - start)
+        return response
+    return wrapper
+
+@instrumented
 def perform_operation(operation_type:int, operator1:str=None, operator2:str=None) -> dict:
     '''
     Function to perform the operations
@@ -48,11 +71,28 @@ def perform_operation(operation_type:int, operator1:str=None, operator2:str=None
         elif operation_type==5:
             res = pow(operator1, operator2)
         elif operation_type==6:
-            # perform the external API request
-            url = "https://www.random.org/strings/?num=1&len=10&digits=on&upperalpha=on&loweralpha=on&unique=on&format=plain&rnd=new"
-            response = requests.get(url, headers={'Accept': 'application/json'})
-            res = response.content.strip().decode("utf-8")
+            # take a string from the configured provider
+            res = get_random_string_provider().get()
     except Exception as e:  
-        return dict_message(error_message=e)
+        return dict_message(error_message=str(e))
     
-    return dict_message(response_data=res)
\ No newline at end of file
+    return dict_message(response_data=res)
+
+
+async def aperform_operation(operation_type:int, operator1:str=None, operator2:str=None) -> dict:
+    '''
+    Async version of perform_operation, the random string is taken without
+    blocking the event loop
+    '''
+    if operation_type != 6:
+        # the arithmetic operations don't wait on anything
+        return perform_operation(operation_type=operation_type, 
+                                 operator1=operator1, 
+                                 operator2=operator2)
+    start = time.perf_counter()
+    try:
+        response = dict_message(response_data=await get_random_string_provider().aget())
+    except Exception as e:
+        response = dict_message(error_message=str(e))
+    observe_operation(operation_type, response, time.perf_counter() - start)
+    return response
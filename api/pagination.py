@@ -0,0 +1,103 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class RecordCursorPagination(BasePagination):
+    '''
+    Keyset pagination of the records on (date, id), newest first
+
+    Each page is a range seek from the position stored in an opaque cursor,
+    so any page costs the same regardless of its depth. There's no count.
+    '''
+    page_size = 10
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_position(self, record) -> tuple:
+        # pages of values() querysets hold dicts
+        if isinstance(record, dict):
+            return record['date'], record['id']
+        return record.date, record.id
+
+    def encode_cursor(self, record, reverse:bool) -> str:
+        date, id = self.get_position(record)
+        position = {'d': date.isoformat(), 'i': id, 'r': int(reverse)}
+        data = json.dumps(position, separators=(',', ':')).encode('ascii')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            date = parse_datetime(position['d'])
+            if date is None:
+                raise ValueError(position['d'])
+            return date, int(position['i']), bool(position['r'])
+        except Exception as e:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_link(self, record, reverse:bool):
+        if record is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   self.encode_cursor(record, reverse))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        '''
+        Returns a page of the queryset, which must not be ordered or sliced
+        '''
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request)
+
+        if cursor is None:
+            # first page
+            records = list(queryset.order_by('-date', '-id')[:self.page_size + 1])
+            has_more = len(records) > self.page_size
+            records = records[:self.page_size]
+            self.next_record = records[-1] if has_more else None
+            self.previous_record = None
+            return records
+
+        date, id, reverse = cursor
+        if not reverse:
+            # records after the cursor, the date bound allows an index range seek
+            queryset = (queryset.filter(date__lte=date)
+                                .filter(Q(date__lt=date) | Q(id__lt=id))
+                                .order_by('-date', '-id'))
+        else:
+            # records before the cursor, read in the opposite order
+            queryset = (queryset.filter(date__gte=date)
+                                .filter(Q(date__gt=date) | Q(id__gt=id))
+                                .order_by('date', 'id'))
+
+        records = list(queryset[:self.page_size + 1])
+        has_more = len(records) > self.page_size
+        records = records[:self.page_size]
+
+        if not reverse:
+            self.next_record = records[-1] if has_more else None
+            self.previous_record = records[0] if records else None
+        else:
+            records.reverse()
+            self.next_record = records[-1] if records else None
+            self.previous_record = records[0] if has_more else None
+        return records
+
+    def get_paginated_response(self, data):
+        next_link = self.get_link(self.next_record, reverse=False)
+        previous_link = self.get_link(self.previous_record, reverse=True)
+        return Response({
+            'next': next_link,
+            'previous': previous_link,
+            'results': data,
+        })
@@ -0,0 +1,320 @@
+import collections
+import secrets
+import string
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.dispatch import receiver
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from api.metrics import RANDOM_ORG_ERRORS, RANDOM_ORG_SECONDS
+
+RANDOM_ORG_URL = "https://www.random.org/strings/"
+
+DEFAULT_PROVIDER = {
+    "BACKEND": "api.random_strings.RandomOrgProvider",
+    "OPTIONS": {},
+}
+
+
+def on_off(value:bool) -> str:
+    return "on" if value else "off"
+
+def fetch_random_strings(session:"requests.Session", num:int, length:int=10,
+                         digits:bool=True, upperalpha:bool=True, loweralpha:bool=True,
+                         unique:bool=True, url:str=RANDOM_ORG_URL, timeout=None) -> list:
+    '''
+    Fetches num random strings from random.org in a single request
+
+    :param session: session used to reuse the connections
+    :param num: number of strings to fetch
+    :param length: length of each string
+    :param digits: allow digits in the strings
+    :param upperalpha: allow uppercase letters in the strings
+    :param loweralpha: allow lowercase letters in the strings
+    :param unique: don't repeat strings in the same request
+    :param url: random.org strings endpoint
+    :param timeout: requests timeout
+    '''
+    import requests
+
+    params = {"num": num, "len": length, "digits": on_off(digits),
+              "upperalpha": on_off(upperalpha), "loweralpha": on_off(loweralpha),
+              "unique": on_off(unique), "format": "plain", "rnd": "new"}
+    try:
+        with RANDOM_ORG_SECONDS.time():
+            response = session.get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+    except requests.RequestException:
+        RANDOM_ORG_ERRORS.inc()
+        raise
+    return response.text.split()
+
+
+async def afetch_random_strings(num:int, length:int=10, digits:bool=True, upperalpha:bool=True,
+                                loweralpha:bool=True, unique:bool=True, url:str=RANDOM_ORG_URL,
+                                timeout=None, verify=True) -> list:
+    '''
+    Fetches num random strings from random.org without blocking the event loop,
+    same as fetch_random_strings
+
+    :param verify: SSL context of the client, building a new one takes tens
+                   of milliseconds that would block the event loop
+    '''
+    import httpx
+
+    params = {"num": num, "len": length, "digits": on_off(digits),
+              "upperalpha": on_off(upperalpha), "loweralpha": on_off(loweralpha),
+              "unique": on_off(unique), "format": "plain", "rnd": "new"}
+    if isinstance(timeout, tuple):
+        timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+    try:
+        with RANDOM_ORG_SECONDS.time():
+            async with httpx.AsyncClient(timeout=timeout, verify=verify) as client:
+                response = await client.get(url, params=params)
+        response.raise_for_status()
+    except httpx.HTTPError:
+        RANDOM_ORG_ERRORS.inc()
+        raise
+    return response.text.split()
+
+
+class RandomStringPool:
+    '''
+    Pool of random strings kept in the process and refilled in the background
+
+    When the pool goes below low_watermark a background thread fetches batches
+    of strings until it reaches high_watermark. If the pool runs dry the
+    request falls back to a synchronous fetch.
+    '''
+    def __init__(self, url:str=RANDOM_ORG_URL, length:int=10, batch_size:int=200,
+                 low_watermark:int=50, high_watermark:int=500, timeout=(3.05, 10),
+                 digits:bool=True, upperalpha:bool=True, loweralpha:bool=True,
+                 unique:bool=True):
+        self.url = url
+        self.length = length
+        self.flags = {"digits": digits, "upperalpha": upperalpha,
+                      "loweralpha": loweralpha, "unique": unique}
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.timeout = timeout
+
+        self._strings = collections.deque()
+        self._lock = threading.Lock()
+        self._refill_thread = None
+
+        # requests and httpx are only imported by the processes that serve
+        # random strings, they add a tenth of a second to every cold start
+        import httpx
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # a single session keeps the connections to random.org alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # the async fetches build their clients on the same SSL context
+        self.ssl_context = httpx.create_ssl_context()
+
+    def __len__(self):
+        return len(self._strings)
+
+    def fetch(self) -> list:
+        '''
+        Fetches a batch of strings from random.org
+        '''
+        return fetch_random_strings(self.session, num=self.batch_size, length=self.length,
+                                    url=self.url, timeout=self.timeout, **self.flags)
+
+    def get(self) -> str:
+        '''
+        Returns a random string, never returning the same string twice
+        '''
+        try:
+            value = self._strings.popleft()
+        except IndexError:
+            # the pool ran dry, fetch a batch synchronously
+            strings = self.fetch()
+            if not strings:
+                raise ValueError("random.org returned no strings")
+            value = strings.pop()
+            self._strings.extend(strings)
+
+        if len(self._strings) < self.low_watermark:
+            self.refill_in_background()
+        return value
+
+    async def aget(self) -> str:
+        '''
+        Returns a random string, without blocking the event loop when the
+        pool runs dry
+        '''
+        try:
+            value = self._strings.popleft()
+        except IndexError:
+            strings = await afetch_random_strings(num=self.batch_size, length=self.length,
+                                                  url=self.url, timeout=self.timeout,
+                                                  verify=self.ssl_context, **self.flags)
+            if not strings:
+                raise ValueError("random.org returned no strings")
+            value = strings.pop()
+            self._strings.extend(strings)
+
+        if len(self._strings) < self.low_watermark:
+            self.refill_in_background()
+        return value
+
+    def refill(self):
+        '''
+        Fetches batches of strings until the pool reaches high_watermark
+        '''
+        while len(self._strings) < self.high_watermark:
+            strings = self.fetch()
+            if not strings:
+                break
+            self._strings.extend(strings)
+
+    def refill_in_background(self):
+        '''
+        Starts a refill thread, unless there's one already running
+        '''
+        with self._lock:
+            if self._refill_thread is not None and self._refill_thread.is_alive():
+                return
+            self._refill_thread = threading.Thread(target=self._refill, daemon=True)
+            self._refill_thread.start()
+
+    def wait(self, timeout:float=None):
+        '''
+        Waits for the running refill thread, if any
+        '''
+        thread = self._refill_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _refill(self):
+        import requests
+
+        try:
+            self.refill()
+        except requests.RequestException:
+            # the next get() retries synchronously if the pool runs dry
+            pass
+
+
+class RandomStringProvider:
+    '''
+    Base class of the random string providers
+
+    The options follow the random.org strings parameters: the length of the
+    strings, the allowed characters and whether a string may be repeated.
+    '''
+    def __init__(self, length:int=10, digits:bool=True, upperalpha:bool=True,
+                 loweralpha:bool=True, unique:bool=True):
+        self.length = length
+        self.digits = digits
+        self.upperalpha = upperalpha
+        self.loweralpha = loweralpha
+        self.unique = unique
+
+    def get(self) -> str:
+        raise NotImplementedError("subclasses of RandomStringProvider must provide a get() method")
+
+    async def aget(self) -> str:
+        '''
+        Async version of get(), runs get() in a thread unless overridden
+        '''
+        return await sync_to_async(self.get, thread_sensitive=False)()
+
+
+class RandomOrgProvider(RandomStringProvider):
+    '''
+    Provider backed by random.org, served from a RandomStringPool
+    '''
+    def __init__(self, url:str=RANDOM_ORG_URL, batch_size:int=200, low_watermark:int=50,
+                 high_watermark:int=500, timeout=(3.05, 10), **kwargs):
+        super().__init__(**kwargs)
+        self.pool = RandomStringPool(url=url, length=self.length, batch_size=batch_size,
+                                     low_watermark=low_watermark,
+                                     high_watermark=high_watermark, timeout=timeout,
+                                     digits=self.digits, upperalpha=self.upperalpha,
+                                     loweralpha=self.loweralpha, unique=self.unique)
+
+    def get(self) -> str:
+        return self.pool.get()
+
+    async def aget(self) -> str:
+        return await self.pool.aget()
+
+
+class SecretsProvider(RandomStringProvider):
+    '''
+    Local provider backed by the CSPRNG of the secrets module
+
+    random.org only guarantees unique strings inside one request, here the
+    unique strings are checked against a window of the last issued ones. The
+    window is smaller than the number of possible strings, so there's always
+    one left to issue.
+    '''
+    def __init__(self, unique_window:int=10000, **kwargs):
+        super().__init__(**kwargs)
+        self.alphabet = ((string.digits if self.digits else "") +
+                         (string.ascii_uppercase if self.upperalpha else "") +
+                         (string.ascii_lowercase if self.loweralpha else ""))
+        if not self.alphabet:
+            raise ValueError("At least one of digits, upperalpha or loweralpha is required")
+
+        space = len(self.alphabet) ** self.length
+        self._issued = collections.deque(maxlen=max(0, min(unique_window, space - 1)))
+        self._issued_set = set()
+        self._lock = threading.Lock()
+
+    def generate(self) -> str:
+        return "".join(secrets.choice(self.alphabet) for i in range(self.length))
+
+    def get(self) -> str:
+        value = self.generate()
+        if not self.unique or not self._issued.maxlen:
+            return value
+
+        with self._lock:
+            while value in self._issued_set:
+                value = self.generate()
+            if len(self._issued) == self._issued.maxlen:
+                self._issued_set.discard(self._issued[0])
+            self._issued.append(value)
+            self._issued_set.add(value)
+        return value
+
+    async def aget(self) -> str:
+        # generating the string is fast enough to run in the event loop
+        return self.get()
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def get_random_string_provider() -> RandomStringProvider:
+    '''
+    Returns the process wide provider configured by settings.RANDOM_STRING_PROVIDER
+    '''
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                config = getattr(settings, "RANDOM_STRING_PROVIDER", DEFAULT_PROVIDER)
+                backend = import_string(config.get("BACKEND", DEFAULT_PROVIDER["BACKEND"]))
+                _provider = backend(**config.get("OPTIONS", {}))
+    return _provider
+
+
+@receiver(setting_changed)
+def reset_random_string_provider(setting, **kwargs):
+    global _provider
+    if setting == "RANDOM_STRING_PROVIDER":
+        _provider = None
@@ -0,0 +1,281 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.dispatch import receiver
+from django.core.signals import setting_changed
+from django.utils.dateparse import parse_datetime
+
+from api.models import Record
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WRITE_BEHIND = {
+    "ENABLED": False,
+    "MAX_SIZE": 10000,
+    "BATCH_SIZE": 500,
+    "FLUSH_INTERVAL": 0.5,
+    "FLUSH_ON_SHUTDOWN": True,
+    "SPILL_DIR": None,
+}
+
+# columns of the records written to the spill files
+SPILL_FIELDS = ("user_id", "operation_id", "cost", "user_balance", "result_number", "result_string",
+                "operation_response", "is_active")
+
+
+def record_to_json(record:Record) -> str:
+    row = {field: getattr(record, field) for field in SPILL_FIELDS}
+    row["date"] = record.date.isoformat()
+    return json.dumps(row)
+
+
+def record_from_json(line:str) -> Record:
+    row = json.loads(line)
+    row["date"] = parse_datetime(row["date"])
+    return Record(**row)
+
+
+class RecordBuffer:
+    '''
+    Bounded in process queue of the records waiting to be inserted
+
+    A background thread bulk inserts the queued records every batch_size
+    records or every flush_interval seconds. When the queue is full the
+    records are appended to a spill file of this process in spill_dir, or
+    saved right away if there's no spill_dir. The spill files are loaded
+    back by the replay_record_spill command.
+
+    :param max_size: maximum number of queued records
+    :param batch_size: maximum number of records per insert
+    :param flush_interval: maximum seconds a record waits in the queue
+    :param flush_on_shutdown: insert the queued records when the process exits
+    :param spill_dir: directory of the spill files
+    '''
+    def __init__(self, max_size:int=10000, batch_size:int=500, flush_interval:float=0.5,
+                 flush_on_shutdown:bool=True, spill_dir=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_on_shutdown = flush_on_shutdown
+        self.spill_dir = spill_dir
+
+        self._queue = queue.Queue(maxsize=max_size)
+        # batch whose insert failed, retried before the queued records
+        self._retry = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.spilled = 0
+        self.flush_errors = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    def stats(self) -> dict:
+        '''
+        Returns the queue depth and the flush counters
+        '''
+        return {
+            "queue_depth": self._queue.qsize() + len(self._retry),
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "spilled": self.spilled,
+            "flush_errors": self.flush_errors,
+            "flushes": self.flushes,
+            "flush_seconds_total": self.flush_seconds_total,
+            "flush_seconds_max": self.flush_seconds_max,
+        }
+
+    def start(self):
+        '''
+        Starts the flusher thread of this process, unless it's running
+        '''
+        with self._lock:
+            # a forked worker doesn't inherit the thread of its parent
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="record-buffer", daemon=True)
+            self._thread.start()
+            if self.flush_on_shutdown and not self._atexit_registered:
+                atexit.register(self.close)
+                self._atexit_registered = True
+
+    def put(self, records:list):
+        '''
+        Queues records to be inserted by the flusher thread
+        '''
+        self.start()
+        queued = 0
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                break
+            queued += 1
+        with self._lock:
+            self.enqueued += queued
+        if queued < len(records):
+            self.overflow(records[queued:])
+
+    def overflow(self, records:list):
+        if self.spill_dir:
+            self.spill(records)
+        else:
+            # no spill file, the request waits for its records
+            Record.objects.bulk_create(records)
+            with self._lock:
+                self.flushed += len(records)
+
+    def spill(self, records:list):
+        '''
+        Appends records to the spill file of this process
+        '''
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, "records-{}.jsonl".format(os.getpid()))
+        with self._lock, open(path, "a") as spill_file:
+            spill_file.writelines(record_to_json(record) + "\n" for record in records)
+            self.spilled += len(records)
+
+    def _take_batch(self, timeout:float) -> list:
+        with self._lock:
+            batch, self._retry = self._retry, []
+        if batch:
+            return batch
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, batch:list) -> bool:
+        start = time.perf_counter()
+        try:
+            Record.objects.bulk_create(batch)
+        except Exception as e:
+            logger.exception("Failed to insert %d buffered records", len(batch))
+            with self._lock:
+                self.flush_errors += 1
+            if self.spill_dir:
+                self.spill(batch)
+                return True
+            # retried as the next batch, the queue may have been refilled
+            # and only this thread drains it
+            with self._lock:
+                self._retry = batch
+            return False
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.flushed += len(batch)
+            self.flushes += 1
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+        return True
+
+    def flush(self):
+        '''
+        Inserts all the queued records
+        '''
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch(0)
+                if not batch or not self._insert(batch):
+                    return
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                batch = self._take_batch(self.flush_interval)
+                if batch:
+                    with self._flush_lock:
+                        inserted = self._insert(batch)
+                    if not inserted:
+                        # wait before retrying the failed batch
+                        self._stopped.wait(self.flush_interval)
+        finally:
+            connection.close()
+
+    def close(self):
+        '''
+        Stops the flusher thread and inserts the queued records
+        '''
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(self.flush_interval + 5)
+        self.flush()
+
+
+def replay_spill_files(spill_dir, batch_size:int=500) -> int:
+    '''
+    Inserts the records of the spill files in spill_dir and deletes the files
+
+    Each file is inserted in one transaction and deleted once it commits, a
+    file that fails is left for the next run. A file left by a run that
+    failed is replayed before a newer spill of the same process.
+
+    :return: the number of records inserted
+    '''
+    for path in glob.glob(os.path.join(spill_dir, "records-*.jsonl")):
+        # a process still spilling opens a new file with the same name
+        replaying = path + ".replay"
+        if not os.path.exists(replaying):
+            os.replace(path, replaying)
+
+    inserted = 0
+    for replaying in sorted(glob.glob(os.path.join(spill_dir, "records-*.jsonl.replay"))):
+        with open(replaying) as spill_file:
+            records = [record_from_json(line) for line in spill_file if line.strip()]
+        with transaction.atomic():
+            Record.objects.bulk_create(records, batch_size=batch_size)
+        os.remove(replaying)
+        inserted += len(records)
+    return inserted
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_record_buffer():
+    '''
+    Returns the process wide buffer configured by settings.RECORD_WRITE_BEHIND,
+    or None if the records are written synchronously
+    '''
+    global _buffer
+    config = dict(DEFAULT_WRITE_BEHIND, **getattr(settings, "RECORD_WRITE_BEHIND", {}))
+    if not config["ENABLED"]:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = RecordBuffer(max_size=config["MAX_SIZE"], batch_size=config["BATCH_SIZE"],
+                                       flush_interval=config["FLUSH_INTERVAL"],
+                                       flush_on_shutdown=config["FLUSH_ON_SHUTDOWN"],
+                                       spill_dir=config["SPILL_DIR"])
+    return _buffer
+
+
+@receiver(setting_changed)
+def reset_record_buffer(setting, **kwargs):
+    global _buffer
+    if setting == "RECORD_WRITE_BEHIND" and _buffer is not None:
+        _buffer.close()
+        _buffer = None
@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+
+from api.authentication import FilteredRefreshToken
 from api.models import Operation, Record
 
 
@@ -14,4 +17,24 @@ class RecordSerializer(serializers.ModelSerializer):
         model = Record
         fields = ['id', 'date', 'operation', 'cost', 'operation_type_str']
 
-        
\ No newline at end of file
+
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
+
+
+# columns read by serialize_record_rows()
+RECORD_ROW_FIELDS = ('id', 'date', 'operation_id', 'cost')
+
+def serialize_record_rows(rows, type_str:dict) -> list:
+    '''
+    Serializes record rows like RecordSerializer, without model instances
+
+    :param rows: dicts returned by Record.objects.values(*RECORD_ROW_FIELDS)
+    :param type_str: type_str of the operations by operation id
+    '''
+    date_field = serializers.DateTimeField()
+    return [{'id': row['id'],
+             'date': date_field.to_representation(row['date']),
+             'operation': row['operation_id'],
+             'cost': row['cost'],
+             'operation_type_str': type_str[row['operation_id']]} for row in rows]
@@ -1,12 +1,62 @@
 
-from django.test import SimpleTestCase
+import asyncio
+import base64
+import csv
+import datetime
+import glob
+import io
+import json
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import types
+import uuid
+from unittest import mock, skipUnless
+
+import numpy as np
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from parameterized import parameterized
-from rest_framework.test import APITestCase
+from concurrent.futures import ThreadPoolExecutor
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 from rest_framework import status
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.authentication import user_cache
+from api.billing import charge, credit_balance, current_balance, debit_balance
+from api.blacklist import BloomFilter, blacklist_filter
+from api.catalog import catalog
+from api.columnar import ColumnError, decode_file
+from api.expressions import ExpressionError, compile_expression
+from api.metrics import OPERATION_SECONDS, REQUESTS, Histogram, registry
+from api.models import BalanceEntry, Operation, Record, RecordArchive, UsageRollup, User
+from api.operations import aperform_operation, dict_message, perform_operation
+from api.record_buffer import RecordBuffer, get_record_buffer, replay_spill_files
+from api.serializers import RECORD_ROW_FIELDS, RecordSerializer, serialize_record_rows
+from api.random_strings import RandomOrgProvider, RandomStringPool, SecretsProvider, get_random_string_provider
+from api.throttling import CacheBucketStore, consume_operation_cost, get_bucket_store, take, throttle_config
+from api.views import BulkOperationView, OperationBatchView
+from api.management.commands.profile_startup import profile_imports
+from api.management.commands.serve import fold_metrics, warm_up
+from benchmarks.random_org import RandomOrgStandIn
+from benchmarks.utils import start_server
 
-from api.models import Operation, Record, User
-from api.operations import perform_operation
+# run the random_string operation without reaching random.org
+LOCAL_RANDOM_STRINGS = {'BACKEND': 'api.random_strings.SecretsProvider'}
 
 class BasicOperationTests(SimpleTestCase):
     @parameterized.expand([
@@ -46,6 +96,7 @@ class BasicOperationTests(SimpleTestCase):
         else:
             self.assertEqual(result['error_message'], response_data)
 
+    @override_settings(RANDOM_STRING_PROVIDER=LOCAL_RANDOM_STRINGS)
     def test_perform_random_string_operation(self):
         '''
         Test the random string operation
@@ -56,7 +107,121 @@ class BasicOperationTests(SimpleTestCase):
         self.assertIsNotNone(result['response_data'])
         
 
-class AuthenticatedViewTests(APITestCase):
+class RandomStringPoolTests(SimpleTestCase):
+    def test_pool_fetches_in_batches(self):
+        '''
+        Test the pool serves many strings with a few requests
+        '''
+        with RandomOrgStandIn() as stand_in:
+            pool = RandomStringPool(url=stand_in.url, batch_size=20, 
+                                    low_watermark=0, high_watermark=20)
+            strings = [pool.get() for i in range(40)]
+
+        self.assertEqual(stand_in.requests, 2)
+        self.assertEqual(len(set(strings)), 40)
+        self.assertTrue(all(len(s)==10 for s in strings))
+
+    def test_pool_refills_in_background(self):
+        '''
+        Test the pool refills up to the high watermark below the low watermark
+        '''
+        with RandomOrgStandIn() as stand_in:
+            pool = RandomStringPool(url=stand_in.url, batch_size=10, 
+                                    low_watermark=15, high_watermark=30)
+            pool.get()
+            pool.wait(timeout=5)
+
+            self.assertGreaterEqual(len(pool), 30)
+
+            # draining the pool down to the low watermark doesn't block on requests
+            requests_before = stand_in.requests
+            for i in range(len(pool) - 15):
+                pool.get()
+            self.assertEqual(stand_in.requests, requests_before)
+
+    def test_pool_fallback_error(self):
+        '''
+        Test the operation returns an error when random.org fails and the pool is empty
+        '''
+        with RandomOrgStandIn(status_code=503) as stand_in:
+            pool = RandomStringPool(url=stand_in.url, batch_size=10)
+            with self.assertRaises(Exception):
+                pool.get()
+
+
+class RandomStringProviderTests(SimpleTestCase):
+    def test_secrets_provider(self):
+        '''
+        Test the local provider honours the length and the allowed characters
+        '''
+        provider = SecretsProvider(length=16, upperalpha=False, loweralpha=False)
+        strings = [provider.get() for i in range(100)]
+
+        self.assertEqual(len(set(strings)), 100)
+        self.assertTrue(all(len(s)==16 and s.isdigit() for s in strings))
+
+    def test_secrets_provider_small_space(self):
+        '''
+        Test the unique strings don't run out when the window holds every possible string
+        '''
+        provider = SecretsProvider(length=1, upperalpha=False, loweralpha=False)
+        strings = [provider.get() for i in range(30)]
+
+        # each string differs from the 9 issued before it
+        self.assertTrue(all(len(set(strings[i:i + 10])) == 10 for i in range(21)))
+
+    def test_random_org_provider(self):
+        '''
+        Test the random_string operation with the random.org provider
+        '''
+        with RandomOrgStandIn() as stand_in:
+            config = {'BACKEND': 'api.random_strings.RandomOrgProvider', 
+                      'OPTIONS': {'url': stand_in.url, 'length': 12}}
+            with override_settings(RANDOM_STRING_PROVIDER=config):
+                result = perform_operation(operation_type=6)
+
+        self.assertEqual(result['status'], 1)
+        self.assertEqual(len(result['response_data']), 12)
+
+    async def test_random_org_provider_async(self):
+        '''
+        Test the random.org provider fetches batches with the async client
+        '''
+        with RandomOrgStandIn() as stand_in:
+            provider = RandomOrgProvider(url=stand_in.url, batch_size=5,
+                                         low_watermark=0, high_watermark=5)
+            strings = [await provider.aget() for i in range(10)]
+
+        self.assertEqual(stand_in.requests, 2)
+        self.assertEqual(len(set(strings)), 10)
+
+    async def test_async_random_strings_in_flight(self):
+        '''
+        Test the async random_string operations wait on random.org concurrently
+        '''
+        with RandomOrgStandIn(latency=0.2) as stand_in:
+            config = {'BACKEND': 'api.random_strings.RandomOrgProvider', 
+                      'OPTIONS': {'url': stand_in.url, 'batch_size': 1,
+                                  'low_watermark': 0, 'high_watermark': 0}}
+            with override_settings(RANDOM_STRING_PROVIDER=config):
+                start = time.perf_counter()
+                results = await asyncio.gather(*[aperform_operation(operation_type=6) for i in range(20)])
+                elapsed = time.perf_counter() - start
+
+        self.assertTrue(all(result['status'] == 1 for result in results))
+        self.assertEqual(stand_in.requests, 20)
+        # one after the other they would take 20 * 0.2 seconds
+        self.assertLess(elapsed, 2)
+
+    @override_settings(RANDOM_STRING_PROVIDER=LOCAL_RANDOM_STRINGS)
+    def test_provider_from_settings(self):
+        '''
+        Test the provider is selected in the settings
+        '''
+        self.assertIsInstance(get_random_string_provider(), SecretsProvider)
+
+
+class AuthenticatedMixin:
     def setUp(self):
         self.username = 'admin'
         self.password = 'admin'
@@ -77,6 +242,13 @@ class AuthenticatedViewTests(APITestCase):
         self.refresh_token = response.data['refresh']
         self.headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer {}'.format(self.token)}
 
+        # the ids of the users are reused between tests
+        get_bucket_store().reset()
+
+
+class AuthenticatedViewTests(AuthenticatedMixin, APITestCase):
+    pass
+
 
 class HomeViewTests(AuthenticatedViewTests):
     def test_home_view(self):
@@ -96,6 +268,81 @@ class HomeViewTests(AuthenticatedViewTests):
         self.assertEqual(len(response.data['operations']), Operation.objects.count())
 
 
+class CachedAuthenticationTests(AuthenticatedViewTests):
+    def user_queries(self, queries) -> list:
+        return [query['sql'] for query in queries if 'FROM "api_user"' in query['sql']]
+
+    def test_cached_user_lookup(self):
+        """
+        Tests the repeated requests of a token don't select the user
+        """
+        self.client.get(reverse('home'), headers=self.headers, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'), headers=self.headers, format='json')
+
+        self.assertEqual(response.data['username'], self.username)
+        self.assertEqual(self.user_queries(queries), [])
+
+    def test_cache_invalidated_on_save(self):
+        """
+        Tests the home view shows the balance of the saved user
+        """
+        self.client.get(reverse('home'), headers=self.headers, format='json')
+        self.user.balance = 42
+        self.user.save()
+
+        response = self.client.get(reverse('home'), headers=self.headers, format='json')
+        self.assertEqual(response.data['user_balance'], 42)
+
+    def test_cache_invalidated_on_debit(self):
+        """
+        Tests the home view shows the balance after an operation
+        """
+        operation = Operation.objects.get(type=1)
+        self.user.balance = 10
+        self.user.save()
+        self.client.get(reverse('home'), headers=self.headers, format='json')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('operation'), {"operation_id": operation.id, "operator1": 1, "operator2": 1},
+                             headers=self.headers, format='json')
+
+        response = self.client.get(reverse('home'), headers=self.headers, format='json')
+        self.assertEqual(response.data['user_balance'], 10 - operation.cost)
+
+    def test_cache_invalidated_on_commit(self):
+        """
+        Tests a balance cached while the debit is uncommitted is dropped once it commits
+        """
+        operation = Operation.objects.get(type=1)
+        self.user.balance = 10
+        self.user.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                charge(self.user, operation, dict_message(response_data=2))
+                # another thread caches the balance of its snapshot before the commit
+                user_cache.set(self.user.id, 'token', self.user)
+            self.assertIsNotNone(user_cache.get(self.user.id, 'token'))
+
+        self.assertIsNone(user_cache.get(self.user.id, 'token'))
+
+    def test_operation_reads_authoritative_balance(self):
+        """
+        Tests the operation view checks the balance in the database, not the cached one
+        """
+        operation = Operation.objects.get(type=1)
+        self.client.get(reverse('home'), headers=self.headers, format='json')
+
+        # update() doesn't send post_save, the cached user keeps a balance of 0
+        User.objects.filter(id=self.user.id).update(balance=operation.cost)
+        response = self.client.post(reverse('operation'), {"operation_id": operation.id, "operator1": 1, "operator2": 1},
+                                    headers=self.headers, format='json')
+
+        self.assertEqual(response.data['status'], 1)
+        self.assertEqual(response.data['user_balance'], 0)
+
+
 class OperationViewTests(AuthenticatedViewTests):
     @parameterized.expand([
         [[1, 1, 1, 1, 2]],
@@ -147,6 +394,7 @@ class OperationViewTests(AuthenticatedViewTests):
         else:
             self.assertEqual(response.data['error_message'], response_data)
 
+    @override_settings(RANDOM_STRING_PROVIDER=LOCAL_RANDOM_STRINGS)
     def test_operation_view_random_string(self):
         """
         Tests the operation view with random_string operation
@@ -176,119 +424,1849 @@ class OperationViewTests(AuthenticatedViewTests):
         
 
 
-class LogoutViewTests(AuthenticatedViewTests):
-    def test_logout_view(self):
+class ConcurrentOperationTests(AuthenticatedMixin, APITransactionTestCase):
+    # keep the operations inserted by the migrations after the flush
+    serialized_rollback = True
+
+    def post_operation(self, operation):
+        client = APIClient()
+        try:
+            response = client.post(reverse('operation'), 
+                                   {"operation_id": operation.id, "operator1": 1, "operator2": 1},
+                                   headers=self.headers, 
+                                   format='json')
+            return response.data
+        finally:
+            connection.close()
+
+    def test_parallel_operations_balance(self):
         """
-        Tests the logout view
+        Tests parallel operations of the same user never lose a debit or overdraw
         """
-        # perform the request to home 
+        operation = Operation.objects.get(type=1)
+        requests_count = 40
+        affordable = 25
+
+        self.user.balance = affordable * operation.cost
+        self.user.save()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(self.post_operation, [operation] * requests_count))
+
+        succeeded = [r for r in responses if r['status'] == 1]
+        self.assertEqual(len(succeeded), affordable)
+
+        self.assertEqual(current_balance(self.user), 0)
+        self.assertEqual(Record.objects.filter(user=self.user).count(), affordable)
+
+    def test_debit_waits_for_concurrent_debit(self):
+        """
+        Tests a debit blocked by another one reads the balance it committed
+        """
+        self.user.balance = 1
+        self.user.save()
+        debited = threading.Event()
+        release = threading.Event()
+
+        def first_debit():
+            try:
+                with transaction.atomic():
+                    balance = debit_balance(self.user, 1)
+                    debited.set()
+                    release.wait(10)
+                return balance
+            finally:
+                connection.close()
+
+        def second_debit():
+            try:
+                user = User.objects.get(id=self.user.id)
+                with transaction.atomic():
+                    return debit_balance(user, 1)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(first_debit)
+            self.assertTrue(debited.wait(10))
+            second = executor.submit(second_debit)
+            # let the second debit block on the lock before the first commits
+            time.sleep(0.5)
+            release.set()
+            self.assertEqual(first.result(), 0)
+            self.assertIsNone(second.result())
+
+        self.assertEqual(current_balance(self.user), 0)
+
+
+class BalanceJournalTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        self.operation = Operation.objects.get(type=3)
+        self.user.balance = 10 * self.operation.cost
+        self.user.save()
+
+    def post_operations(self, count):
+        for i in range(count):
+            # the cached user is dropped once the debit commits
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('operation'),
+                                            {"operation_id": self.operation.id, "operator1": 2, "operator2": 3},
+                                            headers=self.headers, format='json')
+            self.assertEqual(response.data['status'], 1)
+        return response
+
+    def test_debits_append_entries(self):
+        """
+        Tests the debits are journaled without rewriting the balance snapshot
+        """
+        response = self.post_operations(3)
+
+        self.assertEqual(response.data['user_balance'], 7 * self.operation.cost)
+        self.assertEqual(User.objects.get(id=self.user.id).balance, 10 * self.operation.cost)
+        self.assertEqual(list(BalanceEntry.objects.values_list('amount', flat=True)), [-self.operation.cost] * 3)
+
         response = self.client.get(reverse('home'), headers=self.headers, format='json')
-        # assert the response is OK
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user_balance'], 7 * self.operation.cost)
 
-        # perform the request to logout 
-        logout_response = self.client.post(reverse('logout'), 
-                                           {'refresh_token':self.refresh_token}, 
-                                           headers=self.headers, 
-                                           format='json')
-        # assert the response is HTTP_205_RESET_CONTENT
-        self.assertEqual(logout_response.status_code, status.HTTP_205_RESET_CONTENT)
-        
+    def test_compact_balances(self):
+        """
+        Tests the compaction folds the pending entries into the snapshot
+        """
+        self.post_operations(4)
+        credit_balance(self.user, 5)
 
-class RecordsViewTests(AuthenticatedViewTests):
-    def test_record_view(self):
+        call_command('compact_balances', batch_size=2, delete_applied=True, stdout=io.StringIO())
+
+        self.assertEqual(User.objects.get(id=self.user.id).balance, 6 * self.operation.cost + 5)
+        self.assertEqual(current_balance(self.user), 6 * self.operation.cost + 5)
+        # the last entry is kept for its sequence number
+        self.assertEqual(list(BalanceEntry.objects.values_list('seq', 'applied')), [(5, True)])
+
+        # the debits keep working on top of the new snapshot
+        response = self.post_operations(1)
+        self.assertEqual(response.data['user_balance'], 5 * self.operation.cost + 5)
+        self.assertEqual(list(BalanceEntry.objects.filter(applied=False).values_list('seq', flat=True)), [6])
+
+    def test_entries_sequence(self):
         """
-        Tests the records view with no records
+        Tests the entries of each user are numbered and an entry holding a number is never overwritten
         """
-        # perform the request to records 
-        response = self.client.get(reverse('records'), headers=self.headers, format='json')
+        other = User.objects.create_user(username='other', password='other')
+        self.post_operations(2)
+        credit_balance(other, 5)
+        credit_balance(self.user, 5)
+        self.assertEqual(list(BalanceEntry.objects.filter(user=self.user).values_list('seq', flat=True)), [1, 2, 3])
+        self.assertEqual(list(BalanceEntry.objects.filter(user=other).values_list('seq', flat=True)), [1])
 
-        # assert the response is OK
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BalanceEntry.objects.create(user=self.user, amount=-1, seq=3)
 
-        # make sure that the count is equal to 0
-        self.assertEqual(response.data['count'], 0)
+    def test_debit_does_not_lock_user(self):
+        """
+        Tests a debit neither locks nor rewrites the user row
+        """
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            self.assertEqual(debit_balance(self.user, self.operation.cost), 9 * self.operation.cost)
+        for query in queries.captured_queries:
+            self.assertNotIn('FOR UPDATE', query['sql'])
+            self.assertFalse(query['sql'].startswith('UPDATE'))
 
-        # assert the results returned
-        self.assertEqual(len(response.data['results']), 0)
+    def test_check_balances(self):
+        """
+        Tests the consistency check rebuilds the balances from the records
+        """
+        self.post_operations(2)
+        credit_balance(self.user, 5)
+        call_command('check_balances', stdout=io.StringIO())
 
+        # a snapshot out of step with the records
+        User.objects.filter(id=self.user.id).update(balance=1000)
+        with self.assertRaises(CommandError):
+            call_command('check_balances', stdout=io.StringIO())
 
-    def test_record_view_with_one_record(self):
+        # the balances are only lowered on request
+        call_command('check_balances', fix=True, stdout=io.StringIO())
+        self.assertEqual(current_balance(self.user), 1000 - 2 * self.operation.cost + 5)
+        call_command('check_balances', fix=True, take_back=True, stdout=io.StringIO())
+        self.assertEqual(current_balance(self.user), 8 * self.operation.cost + 5)
+        call_command('check_balances', stdout=io.StringIO())
+
+        with override_settings(RECORD_WRITE_BEHIND={'ENABLED': True, 'SPILL_DIR': None}):
+            with self.assertRaises(CommandError):
+                call_command('check_balances', fix=True, stdout=io.StringIO())
+
+    def test_admin_balance_edit_journaled(self):
         """
-        Tests the records view with one record
+        Tests a credit in the admin is journaled and passes the consistency check
         """
-        operation = Operation.objects.get(type=1)
-        record = Record(user=self.user, operation=operation, cost=operation.cost, 
-                        user_balance=self.user.balance, operation_response="" )
-        record.save()
+        self.post_operations(2)
+        admin_user = User.objects.create_superuser(username='root', password='root', email='root@root.com')
+        self.client.force_login(admin_user)
+        url = reverse('admin:api_user_change', args=[self.user.id])
 
-        # perform the request to records 
-        response = self.client.get(reverse('records'), headers=self.headers, format='json')
+        # the live balance is shown, not the snapshot
+        response = self.client.get(url)
+        self.assertContains(response, str(8 * self.operation.cost))
+
+        response = self.client.post(url, {
+            'username': self.user.username, 'password': self.user.password,
+            'date_joined_0': '2024-01-01', 'date_joined_1': '00:00:00',
+            'balance': 1000, 'credit': 50,
+        })
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+
+        self.assertEqual(User.objects.get(id=self.user.id).balance, 10 * self.operation.cost)
+        self.assertEqual(current_balance(self.user), 8 * self.operation.cost + 50)
+        call_command('check_balances', stdout=io.StringIO())
+
+
+class RecordWriteBehindTests(AuthenticatedMixin, APITransactionTestCase):
+    # keep the operations inserted by the migrations after the flush
+    serialized_rollback = True
+
+    def setUp(self):
+        super().setUp()
+        self.spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spill_dir)
+        self.write_behind = {'ENABLED': True, 'FLUSH_INTERVAL': 0.05, 'SPILL_DIR': self.spill_dir}
+
+        self.operation = Operation.objects.get(type=1)
+        self.user.balance = 10
+        self.user.save()
+
+    def test_operation_write_behind(self):
+        """
+        Tests the records are inserted by the buffer after the operation returns
+        """
+        with override_settings(RECORD_WRITE_BEHIND=self.write_behind):
+            before = timezone.now()
+            response = self.client.post(reverse('operation'),
+                                        {"operation_id": self.operation.id, "operator1": 1, "operator2": 1},
+                                        headers=self.headers, format='json')
+            self.assertEqual(response.data['status'], 1)
+
+            buffer = get_record_buffer()
+            buffer.close()
+            stats = buffer.stats()
+
+        record = Record.objects.get(user=self.user)
+        self.assertEqual(record.user_balance, 10)
+        # the date is the one of the operation, not of the insert
+        self.assertLess(record.date - before, datetime.timedelta(seconds=1))
+        self.assertEqual(stats['enqueued'], 1)
+        self.assertEqual(stats['flushed'], 1)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_backpressure_spill(self):
+        """
+        Tests the records that don't fit in the queue are spilled to a file and replayed
+        """
+        buffer = RecordBuffer(max_size=2, spill_dir=self.spill_dir)
+        # keep the flusher from draining the queue
+        buffer.start = lambda: None
+
+        records = [Record(user=self.user, operation=self.operation, cost=1, user_balance=10 - i)
+                   for i in range(5)]
+        buffer.put(records)
+        self.assertEqual(buffer.stats()['queue_depth'], 2)
+        self.assertEqual(buffer.stats()['spilled'], 3)
+
+        buffer.flush()
+        self.assertEqual(Record.objects.count(), 2)
+
+        with override_settings(RECORD_WRITE_BEHIND=self.write_behind):
+            call_command('replay_record_spill', stdout=io.StringIO())
+        self.assertEqual(sorted(Record.objects.values_list('user_balance', flat=True)), [6, 7, 8, 9, 10])
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_failed_replay_retried(self):
+        """
+        Tests a spill file whose insert fails halfway is rolled back and replayed by the next run
+        """
+        buffer = RecordBuffer(max_size=1, spill_dir=self.spill_dir)
+        buffer.start = lambda: None
+        # the first record stays in the queue
+        buffer.put([Record(user=self.user, operation=self.operation, cost=1, user_balance=11 - i) for i in range(4)])
+
+        bulk_create = Record.objects.bulk_create
+        def fail_after_first_batch(records, batch_size=None):
+            bulk_create(records[:1])
+            raise DatabaseError("disk I/O error")
+
+        with mock.patch.object(Record.objects, 'bulk_create', side_effect=fail_after_first_batch):
+            with self.assertRaises(DatabaseError):
+                replay_spill_files(self.spill_dir)
+        self.assertEqual(Record.objects.count(), 0)
+        self.assertEqual(len(glob.glob(os.path.join(self.spill_dir, "*.jsonl.replay"))), 1)
+
+        # the process spilled again meanwhile
+        buffer.put([Record(user=self.user, operation=self.operation, cost=1, user_balance=7)])
+        self.assertEqual(replay_spill_files(self.spill_dir), 3)
+        self.assertEqual(replay_spill_files(self.spill_dir), 1)
+        self.assertEqual(sorted(Record.objects.values_list('user_balance', flat=True)), [7, 8, 9, 10])
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_failed_insert_retried(self):
+        """
+        Tests a failed batch is retried without waiting for room in a refilled queue
+        """
+        buffer = RecordBuffer(max_size=2, batch_size=2)
+        buffer.start = lambda: None
+        records = [Record(user=self.user, operation=self.operation, cost=1, user_balance=10 - i)
+                   for i in range(4)]
+        buffer.put(records[:2])
+
+        def fail_and_refill(batch):
+            # the requests refill the queue while the insert fails
+            buffer.put(records[2:])
+            raise DatabaseError("database is locked")
+
+        with mock.patch.object(Record.objects, 'bulk_create', side_effect=fail_and_refill):
+            buffer.flush()
+        self.assertEqual(buffer.stats()['queue_depth'], 4)
+        self.assertEqual(buffer.stats()['flush_errors'], 1)
+
+        buffer.flush()
+        self.assertEqual(sorted(Record.objects.values_list('user_balance', flat=True)), [7, 8, 9, 10])
+        self.assertEqual(buffer.stats()['queue_depth'], 0)
+
+
+class OperationBatchViewTests(AuthenticatedViewTests):
+    def post_batch(self, items):
+        return self.client.post(reverse('operation_batch'), 
+                                {"operations": items},
+                                headers=self.headers, 
+                                format='json')
+
+    def test_operation_batch_view(self):
+        """
+        Tests the batch view charges only the successful operations
+        """
+        addition = Operation.objects.get(type=1)
+        division = Operation.objects.get(type=4)
+
+        self.user.balance = addition.cost + 2 * division.cost
+        self.user.save()
+
+        response = self.post_batch([
+            {"operation_id": addition.id, "operator1": 1, "operator2": 2},
+            {"operation_id": division.id, "operator1": 1, "operator2": 0},
+            {"operation_id": division.id, "operator1": 3, "operator2": 2},
+            {"operation_id": 0, "operator1": 1, "operator2": 1},
+        ])
 
         # assert the response is OK
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 1)
 
-        # make sure that the count is equal to 1
-        self.assertEqual(response.data['count'], 1)
+        results = response.data['response_data']
+        self.assertEqual([r['status'] for r in results], [1, 0, 1, 0])
+        self.assertEqual(results[0]['response_data'], 3)
+        self.assertEqual(results[2]['response_data'], 1.5)
+        self.assertEqual(results[3]['error_message'], "Invalid operation")
 
-        # assert the results returned
-        self.assertEqual(len(response.data['results']), 1)
-        self.assertEqual(response.data['results'][0]['id'], record.id)
+        # make sure that only the successful operations were charged and recorded
+        self.assertEqual(current_balance(self.user), division.cost)
+        self.assertEqual(response.data['user_balance'], division.cost)
+        self.assertEqual(Record.objects.filter(user=self.user).count(), 2)
 
-    def test_record_view_delete(self):
+    def test_operation_batch_view_nothing_performed(self):
         """
-        Tests the record_delete view
+        Tests a batch without any successful operation is not charged
+        """
+        division = Operation.objects.get(type=4)
+        self.user.balance = division.cost
+        self.user.save()
+
+        response = self.post_batch([
+            {"operation_id": division.id, "operator1": 1, "operator2": 0},
+            {"operation_id": 0, "operator1": 1, "operator2": 1},
+        ])
+
+        self.assertEqual(response.data['status'], 1)
+        self.assertEqual([r['status'] for r in response.data['response_data']], [0, 0])
+        self.assertEqual(response.data['user_balance'], division.cost)
+        self.assertFalse(BalanceEntry.objects.exists())
+        self.assertFalse(Record.objects.exists())
+
+    def test_operation_batch_view_balance_not_enough(self):
+        """
+        Tests the batch view rejects the whole batch when the balance is not enough
         """
         operation = Operation.objects.get(type=1)
-        record = Record(user=self.user, operation=operation, cost=operation.cost, 
-                        user_balance=self.user.balance, operation_response="" )
-        record.save()
 
-        # perform the request to record_delete 
-        response = self.client.delete(reverse('record_delete', kwargs={'id': record.id}), 
-                                    headers=self.headers, format='json')
+        self.user.balance = operation.cost
+        self.user.save()
 
-        # assert the response is OK
-        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        item = {"operation_id": operation.id, "operator1": 1, "operator2": 1}
+        response = self.post_batch([item, item])
 
-        # make sure that there are no records on the database
-        self.assertEqual(Record.objects.filter(is_active=True).count(), 0)
+        self.assertEqual(response.data['error_message'], "The user balance is not enough")
+        self.assertEqual(Record.objects.count(), 0)
 
-    def test_record_view_filter(self):
+    def test_operation_batch_view_query_count(self):
         """
-        Tests the records view filter
+        Tests the number of queries does not grow with the batch size
         """
-        # create records of all types
-        for i in Operation.TYPE_CHOICES:
-            operation = Operation.objects.get(type=i[0])
-            record = Record(user=self.user, operation=operation, cost=operation.cost, 
-                            user_balance=self.user.balance, operation_response="" )
-            record.save()
+        operation = Operation.objects.get(type=1)
 
-        # perform the request to records 
-        response = self.client.get(reverse('records'), headers=self.headers, format='json')
+        self.user.balance = 100 * operation.cost
+        self.user.save()
 
-        # assert the response is OK
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        item = {"operation_id": operation.id, "operator1": 1, "operator2": 1}
+        # the first operation of the day inserts its usage rollup
+        self.post_batch([item])
+        with CaptureQueriesContext(connection) as small_batch:
+            self.post_batch([item] * 2)
+        with CaptureQueriesContext(connection) as large_batch:
+            self.post_batch([item] * 50)
 
-        # make sure that the count is right
-        self.assertEqual(response.data['count'], len(Operation.TYPE_CHOICES))
+        self.assertEqual(len(small_batch), len(large_batch))
+        self.assertEqual(Record.objects.count(), 53)
 
-         # perform the request to records 
-        response = self.client.get(reverse('records'), {"operations":1}, 
-                                   headers=self.headers, format='json')
-        
-        # assert the response is OK
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-         # make sure that there's only one record for the operation_type 1
-        self.assertEqual(response.data['count'], 1)
+class OperationCatalogTests(TestCase):
+    def setUp(self):
+        # don't leak the operations changed by the test to the next ones
+        self.addCleanup(catalog.invalidate)
+        catalog.invalidate()
 
-        
+    def test_catalog_is_cached(self):
+        """
+        Tests the catalog only queries the operations once
+        """
+        operation = Operation.objects.get(type=1)
+        operations_count = Operation.objects.count()
 
-    
+        with self.assertNumQueries(1):
+            self.assertEqual(catalog.get(operation.id), operation)
+            self.assertEqual(catalog.get(str(operation.id)), operation)
+            self.assertEqual(len(catalog.serialized()), operations_count)
 
-        
+        with self.assertRaises(Operation.DoesNotExist):
+            catalog.get(0)
+
+    def test_catalog_invalidation(self):
+        """
+        Tests the catalog is reloaded when an operation is saved
+        """
+        operation = Operation.objects.get(type=1)
+        catalog.get(operation.id)
+
+        operation.cost = 42
+        operation.save()
+
+        self.assertEqual(catalog.get(operation.id).cost, 42)
+        serialized = [o for o in catalog.serialized() if o['id'] == operation.id]
+        self.assertEqual(serialized[0]['cost'], 42)
+
+    @override_settings(OPERATION_CATALOG_TTL=0)
+    def test_catalog_ttl(self):
+        """
+        Tests the catalog is reloaded when it's older than the TTL
+        """
+        operation = Operation.objects.get(type=1)
+        catalog.get(operation.id)
+
+        # bypass the signals
+        Operation.objects.filter(id=operation.id).update(cost=42)
+        time.sleep(0.01)
 
+        self.assertEqual(catalog.get(operation.id).cost, 42)
+
+
+class ExpressionTests(SimpleTestCase):
+    @parameterized.expand([
+        ["1 + 2 * 3", {}, 7],
+        ["(a + b) * c / sqrt(d)", {"a": 1, "b": 2, "c": 4, "d": 16}, 3],
+        ["-a ** 2", {"a": 3}, -9],
+        ["2 ** -1", {}, 0.5],
+    ])
+    def test_evaluate_expression(self, expression, variables, result):
+        '''
+        Test the expressions are evaluated with the operations
+        '''
+        response = compile_expression(expression).evaluate(variables)
+        self.assertEqual(response['status'], 1)
+        self.assertEqual(response['response_data'], result)
+
+    @parameterized.expand([
+        ["__import__('os')"],
+        ["a.b + 1"],
+        ["a % 2"],
+        ["[1] * 2"],
+        ["1 +"],
+        ["2 3"],
+    ])
+    def test_invalid_expression(self, expression):
+        '''
+        Test anything but arithmetic is rejected
+        '''
+        with self.assertRaises(ExpressionError):
+            compile_expression(expression)
+
+    def test_expression_plan_cache(self):
+        '''
+        Test the plans are cached by normalized expression
+        '''
+        plan = compile_expression("(x + y)  *  z")
+        self.assertIs(compile_expression(" (x + y) * z "), plan)
+        self.assertEqual(plan.operation_counts, {1: 1, 3: 1})
+        self.assertEqual(plan.evaluate({"x": 1, "y": 1, "z": 2})['response_data'], 4)
+        self.assertEqual(plan.evaluate({"x": 2, "y": 3, "z": 2})['response_data'], 10)
+
+
+class ExpressionViewTests(AuthenticatedViewTests):
+    def post_expression(self, expression, variables=None):
+        return self.client.post(reverse('operation_expression'), 
+                                {"expression": expression, "variables": variables or {}},
+                                headers=self.headers, 
+                                format='json')
+
+    def test_expression_view(self):
+        """
+        Tests the expression is billed as one debit and one record
+        """
+        cost = sum(Operation.objects.get(type=t).cost for t in [1, 3, 4, 5])
+        self.user.balance = cost + 1
+        self.user.save()
+
+        response = self.post_expression("(a + b) * c / sqrt(d)", {"a": 1, "b": 2, "c": 4, "d": 16})
+
+        self.assertEqual(response.data['status'], 1)
+        self.assertEqual(response.data['response_data'], 3)
+        self.assertEqual(response.data['cost'], cost)
+        self.assertEqual(response.data['user_balance'], 1)
+
+        record = Record.objects.get(user=self.user)
+        self.assertEqual(record.cost, cost)
+        self.assertEqual(record.operation.type, 4)
+
+    def test_expression_view_errors(self):
+        """
+        Tests failed and unaffordable expressions are not charged
+        """
+        self.user.balance = 10
+        self.user.save()
+
+        response = self.post_expression("a / 0", {"a": 1})
+        self.assertEqual(response.data['status'], 0)
+
+        response = self.post_expression("a * b", {"a": 1})
+        self.assertEqual(response.data['error_message'], "Missing variables: b")
+
+        response = self.post_expression("sqrt(" * 5 + "2" + ")" * 5)
+        self.assertEqual(response.data['error_message'], "The user balance is not enough")
+
+        self.assertEqual(current_balance(self.user), 10)
+        self.assertEqual(Record.objects.count(), 0)
+
+
+class BulkOperationViewTests(AuthenticatedViewTests):
+    def decode(self, response_data):
+        result = np.frombuffer(base64.b64decode(response_data['result']), dtype='<f8')
+        mask = np.unpackbits(np.frombuffer(base64.b64decode(response_data['error_mask']), dtype=np.uint8), 
+                             count=response_data['count'], bitorder='little').astype(bool)
+        return result, mask
+
+    def test_bulk_operation_view(self):
+        """
+        Tests a column divided by a constant, with an error mask
+        """
+        operation = Operation.objects.get(type=4)
+        self.user.balance = 4 * operation.cost
+        self.user.save()
+
+        response = self.client.post(reverse('operation_bulk'), 
+                                    {"operation_id": operation.id, 
+                                     "operator1": [1, 2, 0, 8], "operator2": [2, 0, 0, 2]},
+                                    headers=self.headers, format='json')
+
+        self.assertEqual(response.data['status'], 1)
+        self.assertEqual(response.data['cost'], 4 * operation.cost)
+        self.assertEqual(response.data['user_balance'], 0)
+
+        result, mask = self.decode(response.data['response_data'])
+        self.assertEqual(mask.tolist(), [False, True, True, False])
+        self.assertEqual(result[~mask].tolist(), [0.5, 4])
+        self.assertEqual(response.data['response_data']['error_count'], 2)
+        self.assertEqual(Record.objects.get(user=self.user).cost, 4 * operation.cost)
+
+    def test_bulk_operation_view_encoded_columns(self):
+        """
+        Tests the encoded and uploaded columns
+        """
+        operation = Operation.objects.get(type=5)
+        self.user.balance = 100
+        self.user.save()
+
+        column = np.array([1, 2, 3], dtype='<f8')
+        encoded = {"encoding": "float64-base64", "data": base64.b64encode(column.tobytes()).decode()}
+        response = self.client.post(reverse('operation_bulk'), 
+                                    {"operation_id": operation.id, "operator1": encoded, "operator2": 2},
+                                    headers=self.headers, format='json')
+        self.assertEqual(self.decode(response.data['response_data'])[0].tolist(), [1, 4, 9])
+
+        response = self.client.post(reverse('operation_bulk'), 
+                                    {"operation_id": operation.id, 
+                                     "operator1": SimpleUploadedFile("operator1.csv", b"1,2\n3\n"),
+                                     "operator2": SimpleUploadedFile("operator2.f8", column.tobytes())},
+                                    headers={'Authorization': self.headers['Authorization']}, 
+                                    format='multipart')
+        self.assertEqual(self.decode(response.data['response_data'])[0].tolist(), [1, 4, 27])
+
+    def test_bulk_operation_view_errors(self):
+        """
+        Tests invalid and unaffordable bulk operations are not charged
+        """
+        operation = Operation.objects.get(type=1)
+        self.user.balance = 2 * operation.cost
+        self.user.save()
+
+        for operator1, operator2, error_message in [
+            [[1, 2, 3], [1, 2], "Operator 1 and Operator 2 must have the same length"],
+            [[1, "a"], 1, "Invalid operator"],
+            [None, 1, "Operator 1 and Operator 2 are required"],
+            [{"encoding": "float64-base64", "data": 123}, 1, "Invalid float64-base64 data"],
+            [[1, 2, 3], 1, "The user balance is not enough"],
+        ]:
+            response = self.client.post(reverse('operation_bulk'), 
+                                        {"operation_id": operation.id, 
+                                         "operator1": operator1, "operator2": operator2},
+                                        headers=self.headers, format='json')
+            self.assertEqual(response.data['error_message'], error_message)
+
+        self.assertEqual(Record.objects.count(), 0)
+
+    @mock.patch.object(BulkOperationView, 'max_count', 4)
+    def test_bulk_operation_view_too_large(self):
+        """
+        Tests the encoded and uploaded columns over max_count are rejected from their size
+        """
+        operation = Operation.objects.get(type=1)
+        self.user.balance = 100
+        self.user.save()
+        column = np.arange(5, dtype='<f8')
+        error_message = "A bulk operation accepts at most 4 elements"
+
+        encoded = {"encoding": "float64-base64", "data": base64.b64encode(column.tobytes()).decode()}
+        response = self.client.post(reverse('operation_bulk'), 
+                                    {"operation_id": operation.id, "operator1": encoded, "operator2": 1},
+                                    headers=self.headers, format='json')
+        self.assertEqual(response.data['error_message'], error_message)
+
+        for upload in [SimpleUploadedFile("operator1.f8", column.tobytes()),
+                       SimpleUploadedFile("operator1.csv", b"1," * 64 + b"1")]:
+            response = self.client.post(reverse('operation_bulk'), 
+                                        {"operation_id": operation.id, "operator1": upload, "operator2": 1},
+                                        headers={'Authorization': self.headers['Authorization']}, 
+                                        format='multipart')
+            self.assertEqual(response.data['error_message'], error_message)
+        self.assertEqual(Record.objects.count(), 0)
+
+        # the file is not read
+        upload = mock.Mock(size=5 * 8, content_type="application/octet-stream")
+        upload.name = "operator1.f8"
+        with self.assertRaises(ColumnError):
+            decode_file(upload, max_count=4)
+        upload.read.assert_not_called()
+
+
+class LogoutViewTests(AuthenticatedViewTests):
+    def test_logout_view(self):
+        """
+        Tests the logout view
+        """
+        # perform the request to home 
+        response = self.client.get(reverse('home'), headers=self.headers, format='json')
+        # assert the response is OK
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # perform the request to logout 
+        logout_response = self.client.post(reverse('logout'), 
+                                           {'refresh_token':self.refresh_token}, 
+                                           headers=self.headers, 
+                                           format='json')
+        # assert the response is HTTP_205_RESET_CONTENT
+        self.assertEqual(logout_response.status_code, status.HTTP_205_RESET_CONTENT)
+        
+
+class BloomFilterTests(SimpleTestCase):
+    def test_bloom_filter(self):
+        '''
+        Test the filter has no false negatives and few false positives
+        '''
+        bloom = BloomFilter(1000, error_rate=0.01)
+        added = [str(uuid.uuid4()) for i in range(1000)]
+        for value in added:
+            bloom.add(value)
+
+        self.assertTrue(all(value in bloom for value in added))
+        false_positives = sum(str(uuid.uuid4()) in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TokenBlacklistTests(AuthenticatedViewTests):
+    def blacklist_queries(self, queries) -> list:
+        return [query['sql'] for query in queries if 'token_blacklist_blacklistedtoken' in query['sql']]
+
+    def test_refresh_skips_blacklist_lookup(self):
+        """
+        Tests refreshing a token that was never blacklisted doesn't look it up in the blacklist
+        """
+        # load the filter
+        blacklist_filter.might_contain('')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh_token}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the rotation still blacklists the token, but never looks up its jti
+        lookups = [sql for sql in self.blacklist_queries(queries) if '"jti" =' in sql]
+        self.assertEqual(lookups, [])
+
+    def test_rotated_token_rejected(self):
+        """
+        Tests a refresh token can't be used again after its rotation
+        """
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh_token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh_token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logged_out_token_rejected(self):
+        """
+        Tests a refresh token can't be used after the logout
+        """
+        response = self.client.post(reverse('logout'), {'refresh_token': self.refresh_token},
+                                    headers=self.headers, format='json')
+        self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh_token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_blacklisted_by_another_process(self):
+        """
+        Tests the filter reads the tokens blacklisted by other processes after the sync interval
+        """
+        blacklist_filter.might_contain('')
+        token = RefreshToken(self.refresh_token)
+
+        # a row written by another process doesn't send post_save here
+        outstanding = OutstandingToken.objects.get(jti=token['jti'])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+
+        with override_settings(TOKEN_BLACKLIST_FILTER_SYNC_INTERVAL=0):
+            response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh_token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_blacklisted_with_lower_id(self):
+        """
+        Tests the sync reads a token whose row commits after a row with a higher id
+        """
+        token = RefreshToken(self.refresh_token)
+        outstanding = OutstandingToken.objects.get(jti=token['jti'])
+        other = OutstandingToken.objects.create(jti=str(uuid.uuid4()), token='other', 
+                                                expires_at=outstanding.expires_at)
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(id=1000, token=other)])
+        blacklist_filter.invalidate()
+        blacklist_filter.might_contain('')
+
+        # the sequence handed this id out before 1000, its transaction commits later
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(id=10, token=outstanding)])
+
+        with override_settings(TOKEN_BLACKLIST_FILTER_SYNC_INTERVAL=0):
+            self.assertTrue(blacklist_filter.might_contain(token['jti']))
+
+    def test_prune_tokens(self):
+        """
+        Tests the prune_tokens command deletes only the expired tokens
+        """
+        expired = timezone.now() - datetime.timedelta(days=1)
+        for i in range(5):
+            token = OutstandingToken.objects.create(user=self.user, jti='expired-{}'.format(i),
+                                                    token='', expires_at=expired)
+            if i % 2 == 0:
+                BlacklistedToken.objects.create(token=token)
+        self.client.post(reverse('logout'), {'refresh_token': self.refresh_token},
+                         headers=self.headers, format='json')
+
+        call_command('prune_tokens', batch_size=2, stdout=io.StringIO())
+
+        self.assertFalse(OutstandingToken.objects.filter(expires_at__lte=timezone.now()).exists())
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+
+class RecordsViewTests(AuthenticatedViewTests):
+    def test_record_view(self):
+        """
+        Tests the records view with no records
+        """
+        # perform the request to records 
+        response = self.client.get(reverse('records'), headers=self.headers, format='json')
+
+        # assert the response is OK
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # make sure that the count is equal to 0
+        self.assertEqual(response.data['count'], 0)
+
+        # assert the results returned
+        self.assertEqual(len(response.data['results']), 0)
+
+
+    def test_record_view_with_one_record(self):
+        """
+        Tests the records view with one record
+        """
+        operation = Operation.objects.get(type=1)
+        record = Record(user=self.user, operation=operation, cost=operation.cost, 
+                        user_balance=self.user.balance, operation_response="" )
+        record.save()
+
+        # perform the request to records 
+        response = self.client.get(reverse('records'), headers=self.headers, format='json')
+
+        # assert the response is OK
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # make sure that the count is equal to 1
+        self.assertEqual(response.data['count'], 1)
+
+        # assert the results returned
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['id'], record.id)
+
+    def test_record_view_delete(self):
+        """
+        Tests the record_delete view
+        """
+        operation = Operation.objects.get(type=1)
+        record = Record(user=self.user, operation=operation, cost=operation.cost, 
+                        user_balance=self.user.balance, operation_response="" )
+        record.save()
+
+        # perform the request to record_delete 
+        response = self.client.delete(reverse('record_delete', kwargs={'id': record.id}), 
+                                    headers=self.headers, format='json')
+
+        # assert the response is OK
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        # make sure that there are no records on the database
+        self.assertEqual(Record.objects.filter(is_active=True).count(), 0)
+
+    def test_record_view_filter(self):
+        """
+        Tests the records view filter
+        """
+        # create records of all types
+        for i in Operation.TYPE_CHOICES:
+            operation = Operation.objects.get(type=i[0])
+            record = Record(user=self.user, operation=operation, cost=operation.cost, 
+                            user_balance=self.user.balance, operation_response="" )
+            record.save()
+
+        # perform the request to records 
+        response = self.client.get(reverse('records'), headers=self.headers, format='json')
+
+        # assert the response is OK
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # make sure that the count is right
+        self.assertEqual(response.data['count'], len(Operation.TYPE_CHOICES))
+
+         # perform the request to records 
+        response = self.client.get(reverse('records'), {"operations":1}, 
+                                   headers=self.headers, format='json')
+        
+        # assert the response is OK
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+         # make sure that there's only one record for the operation_type 1
+        self.assertEqual(response.data['count'], 1)
+
+
+class UsageRollupTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        self.addition = Operation.objects.get(type=1)
+        self.division = Operation.objects.get(type=4)
+        self.user.balance = 100
+        self.user.save()
+
+    def post_operation(self, operation, operator1=1, operator2=2):
+        return self.client.post(reverse('operation'), 
+                                {"operation_id": operation.id, "operator1": operator1, "operator2": operator2},
+                                headers=self.headers, format='json')
+
+    def test_operations_update_rollups(self):
+        """
+        Tests the charged operations are added to the rollups of the day
+        """
+        self.post_operation(self.addition)
+        self.post_operation(self.addition)
+        self.post_operation(self.division)
+        # a failed operation isn't charged
+        self.post_operation(self.division, operator2=0)
+        self.client.post(reverse('operation_batch'), 
+                         {"operations": [{"operation_id": self.addition.id, "operator1": 1, "operator2": 2}] * 2},
+                         headers=self.headers, format='json')
+
+        rollups = UsageRollup.objects.filter(user=self.user, day=timezone.localdate())
+        self.assertEqual({rollup.operation_type: (rollup.count, rollup.total_cost) for rollup in rollups},
+                         {1: (4, 4 * self.addition.cost), 4: (1, self.division.cost)})
+
+    def test_rollups_rolled_back_with_debit(self):
+        """
+        Tests a rejected debit leaves the rollups untouched
+        """
+        self.user.balance = 0
+        self.user.save()
+        self.post_operation(self.addition)
+        self.assertFalse(UsageRollup.objects.exists())
+
+    def test_rebuild_usage_rollups(self):
+        """
+        Tests the rebuild command backfills the rollups from the records and the archive
+        """
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        Record.objects.bulk_create([
+            Record(user=self.user, operation=self.addition, cost=2, user_balance=0),
+            Record(user=self.user, operation=self.addition, cost=3, user_balance=0, is_active=False),
+            Record(user=self.user, operation=self.division, cost=4, user_balance=0, date=yesterday),
+        ])
+        RecordArchive.objects.create(id=1000, user=self.user, operation=self.addition, cost=5, user_balance=0, 
+                                     date=yesterday)
+        # a stale rollup is replaced
+        UsageRollup.objects.create(user=self.user, operation_type=6, day=timezone.localdate(), count=1, total_cost=1)
+
+        call_command('rebuild_usage_rollups', stdout=io.StringIO())
+
+        rollups = UsageRollup.objects.filter(user=self.user)
+        self.assertEqual({(rollup.day, rollup.operation_type): (rollup.count, rollup.total_cost) for rollup in rollups},
+                         {(timezone.localdate(), 1): (2, 5), 
+                          (timezone.localdate(yesterday), 1): (1, 5),
+                          (timezone.localdate(yesterday), 4): (1, 4)})
+
+    def test_usage_view(self):
+        """
+        Tests the usage view sums the rollups of the user per day
+        """
+        today = timezone.localdate()
+        other_user = User.objects.create_user(username='other', password='other')
+        UsageRollup.objects.bulk_create([
+            UsageRollup(user=self.user, operation_type=1, day=today, count=2, total_cost=2),
+            UsageRollup(user=self.user, operation_type=4, day=today, count=1, total_cost=3),
+            UsageRollup(user=self.user, operation_type=1, day=today - datetime.timedelta(days=2), count=1, total_cost=1),
+            UsageRollup(user=self.user, operation_type=1, day=today - datetime.timedelta(days=40), count=9, total_cost=9),
+            UsageRollup(user=other_user, operation_type=1, day=today, count=5, total_cost=5),
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('usage'), headers=self.headers, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'api_record' in query['sql']])
+
+        usage = response.data['response_data']
+        self.assertEqual((usage['count'], usage['total_cost']), (4, 6))
+        self.assertEqual(usage['days'], [
+            {'day': (today - datetime.timedelta(days=2)).isoformat(), 'count': 1, 'total_cost': 1, 
+             'operations': {'addition': {'count': 1, 'total_cost': 1}}},
+            {'day': today.isoformat(), 'count': 3, 'total_cost': 5, 
+             'operations': {'addition': {'count': 2, 'total_cost': 2}, 'division': {'count': 1, 'total_cost': 3}}},
+        ])
+
+        response = self.client.get(reverse('usage'), {'date_from': (today - datetime.timedelta(days=40)).isoformat(), 
+                                                      'date_to': (today - datetime.timedelta(days=1)).isoformat()},
+                                   headers=self.headers)
+        self.assertEqual(response.data['response_data']['count'], 10)
+
+    def test_usage_view_invalid_dates(self):
+        """
+        Tests the usage view rejects invalid date ranges
+        """
+        for params in [{'date_from': 'yesterday'}, {'date_from': '2024-02-01', 'date_to': '2024-01-01'}, 
+                       {'date_from': '2020-01-01', 'date_to': '2024-01-01'}]:
+            response = self.client.get(reverse('usage'), params, headers=self.headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def get_metrics(self, **kwargs):
+        response = self.client.get(reverse('metrics'), **kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_request_metrics(self):
+        """
+        Tests the requests are timed by URL name, with their queries
+        """
+        self.client.get(reverse('home'), headers=self.headers)
+        self.client.get(reverse('home'), headers=self.headers)
+        self.client.get('/missing/', headers=self.headers)
+
+        metrics = self.get_metrics()
+        self.assertIn('http_request_duration_seconds_count{view="home",method="GET"} 2\n', metrics)
+        self.assertIn('http_request_duration_seconds_bucket{view="home",method="GET",le="+Inf"} 2\n', metrics)
+        self.assertIn('http_requests_total{view="home",method="GET",status="200"} 2\n', metrics)
+        self.assertIn('http_requests_total{view="unmatched",method="GET",status="404"} 1\n', metrics)
+        self.assertIn('http_request_db_queries_count{view="home"} 2\n', metrics)
+        self.assertIn('# TYPE http_request_duration_seconds histogram\n', metrics)
+
+    def test_operation_metrics(self):
+        """
+        Tests the operations are timed by type and the balance rejections counted
+        """
+        operation = Operation.objects.get(type=1)
+        self.user.balance = operation.cost
+        self.user.save()
+        for i in range(2):
+            self.client.post(reverse('operation'), {"operation_id": operation.id, "operator1": 1, "operator2": 2},
+                             headers=self.headers, format='json')
+
+        metrics = self.get_metrics()
+        self.assertIn('operation_duration_seconds_count{operation="addition"} 1\n', metrics)
+        self.assertIn('operations_total{operation="addition",outcome="ok"} 1\n', metrics)
+        self.assertIn('operations_charged_total{operation="addition"} 1\n', metrics)
+        self.assertIn('balance_rejections_total{operation="addition"} 1\n', metrics)
+
+        # the debit of the operation reads and writes the database
+        queries = [line for line in metrics.splitlines() if line.startswith('http_request_db_queries_sum{view="operation"}')]
+        self.assertGreater(float(queries[0].split()[-1]), 0)
+
+    def test_random_org_metrics(self):
+        """
+        Tests the failed random.org requests are counted
+        """
+        with RandomOrgStandIn(status_code=503) as stand_in:
+            pool = RandomStringPool(url=stand_in.url, batch_size=10)
+            with self.assertRaises(Exception):
+                pool.get()
+
+        metrics = self.get_metrics()
+        self.assertIn('random_org_errors_total 1\n', metrics)
+        self.assertIn('random_org_request_duration_seconds_count 1\n', metrics)
+
+    def test_histogram_buckets(self):
+        """
+        Tests the histogram buckets are cumulative
+        """
+        histogram = Histogram('test_seconds', 'Test', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.samples((), histogram.dump()['']), [
+            ('test_seconds_bucket', ('0.1',), 1),
+            ('test_seconds_bucket', ('1',), 3),
+            ('test_seconds_bucket', ('+Inf',), 4),
+            ('test_seconds_sum', (), 6.05),
+            ('test_seconds_count', (), 4),
+        ])
+
+    def test_metrics_of_all_processes(self):
+        """
+        Tests the metrics files of the workers are summed
+        """
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+
+        with override_settings(METRICS={'DIR': metrics_dir}):
+            # values written by another worker
+            REQUESTS.inc(view="home", method="GET", status=200)
+            OPERATION_SECONDS.observe(0.002, operation="addition")
+            with open(os.path.join(metrics_dir, 'metrics-1.json'), 'w') as metrics_file:
+                json.dump(registry.dump(), metrics_file)
+            registry.reset()
+
+            self.client.get(reverse('home'), headers=self.headers)
+            OPERATION_SECONDS.observe(0.02, operation="addition")
+            metrics = self.get_metrics()
+
+            self.assertTrue(os.path.exists(os.path.join(metrics_dir, 'metrics-{}.json'.format(os.getpid()))))
+
+        self.assertIn('http_requests_total{view="home",method="GET",status="200"} 2\n', metrics)
+        self.assertIn('operation_duration_seconds_bucket{operation="addition",le="0.0025"} 1\n', metrics)
+        self.assertIn('operation_duration_seconds_bucket{operation="addition",le="0.025"} 2\n', metrics)
+        self.assertIn('operation_duration_seconds_count{operation="addition"} 2\n', metrics)
+
+    def test_exited_worker_metrics(self):
+        """
+        Tests the metrics of an exited worker are folded into one file and still summed
+        """
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+
+        with override_settings(METRICS={'DIR': metrics_dir}):
+            REQUESTS.inc(view="home", method="GET", status=200)
+            for pid in (1, 2):
+                with open(os.path.join(metrics_dir, 'metrics-{}.json'.format(pid)), 'w') as metrics_file:
+                    json.dump(registry.dump(), metrics_file)
+            registry.reset()
+
+            fold_metrics(None, types.SimpleNamespace(pid=1))
+            fold_metrics(None, types.SimpleNamespace(pid=2))
+            # never flushed
+            fold_metrics(None, types.SimpleNamespace(pid=3))
+            self.assertEqual(sorted(os.listdir(metrics_dir)), ['metrics-exited.json'])
+
+            self.client.get(reverse('home'), headers=self.headers)
+            metrics = self.get_metrics()
+
+        self.assertIn('http_requests_total{view="home",method="GET",status="200"} 3\n', metrics)
+
+    @skipUnless(hasattr(os, 'fork'), "needs os.fork")
+    def test_forked_worker_metrics(self):
+        """
+        Tests a forked worker starts from zero and keeps its first values
+        """
+        REQUESTS.inc(view="home", method="GET", status=200)
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                REQUESTS.inc(view="home", method="GET", status=200)
+                os.write(write_end, json.dumps(registry.dump()['http_requests']).encode())
+            finally:
+                os._exit(0)
+
+        os.close(write_end)
+        os.waitpid(pid, 0)
+        with os.fdopen(read_end) as pipe:
+            self.assertEqual(json.loads(pipe.read()), {'home\tGET\t200': 1})
+        self.assertEqual(registry.dump()['http_requests'], {'home\tGET\t200': 1})
+
+    @override_settings(METRICS={'AUTH_TOKEN': 'scraper'})
+    def test_metrics_token(self):
+        """
+        Tests the metrics require the token when there's one
+        """
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.get_metrics(headers={'Authorization': 'Bearer scraper'})
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+class SQLitePragmaTests(TestCase):
+    def pragmas(self, database_connection):
+        with database_connection.cursor() as cursor:
+            return {name: cursor.execute('PRAGMA {}'.format(name)).fetchone()[0]
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size')}
+
+    def test_sqlite_pragmas(self):
+        """
+        Tests the connections run the pragmas of the settings
+        """
+        self.assertEqual(self.pragmas(connection), 
+                         {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'cache_size': -20000})
+
+    @override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234})
+    def test_new_connection_pragmas(self):
+        """
+        Tests the pragmas run when a connection opens
+        """
+        new_connection = connections.create_connection('default')
+        try:
+            self.assertEqual(self.pragmas(new_connection)['busy_timeout'], 1234)
+        finally:
+            new_connection.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def child_pids(pid:int) -> set:
+    '''
+    Returns the pids of the children of a process, from /proc
+    '''
+    children = set()
+    for stat_path in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat_path) as stat_file:
+                # the command name in parentheses may hold spaces
+                fields = stat_file.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.add(int(stat_path.split('/')[2]))
+    return children
+
+
+class ServeCommandTests(APITransactionTestCase):
+    def test_warm_up(self):
+        """
+        Tests the warm up opens a database connection in every thread of the worker
+        """
+        connected = set()
+        def record_thread(sender, connection, **kwargs):
+            connected.add(threading.get_ident())
+        connection_created.connect(record_thread)
+        self.addCleanup(connection_created.disconnect, record_thread)
+
+        pool = ThreadPoolExecutor(max_workers=3)
+        self.addCleanup(pool.shutdown)
+        worker = types.SimpleNamespace(tpool=pool, cfg=types.SimpleNamespace(threads=3))
+        warm_up(worker)
+
+        self.assertEqual(len(connected - {threading.get_ident()}), 3)
+        self.assertTrue(catalog._state is not None)
+
+    def wait_for_workers(self, master:int, count:int, replaced:set=frozenset(), timeout:float=30) -> set:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            workers = child_pids(master)
+            if len(workers) == count and not workers & replaced:
+                return workers
+            time.sleep(0.1)
+        self.fail("The server has {} workers, {} were expected".format(len(workers), count))
+
+    @skipUnless(os.path.isdir('/proc'), "reads the worker pids from /proc")
+    def test_serve(self):
+        """
+        Tests the server answers requests, before and after a graceful reload
+        """
+        User.objects.create_user(username='serve', password='serve')
+        pid_file = os.path.join(tempfile.mkdtemp(), 'serve.pid')
+        self.addCleanup(shutil.rmtree, os.path.dirname(pid_file))
+
+        port = free_port()
+        process = start_server(['manage', 'serve', '--bind', '127.0.0.1:{}'.format(port), '--workers', '2', 
+                                '--threads', '2', '--pid', pid_file], 
+                               port, {'BENCHMARK_DATABASE': str(connection.settings_dict['NAME'])})
+        try:
+            url = 'http://127.0.0.1:{}/token/'.format(port)
+            response = requests.post(url, json={'username': 'serve', 'password': 'serve'}, timeout=10)
+            self.assertEqual(response.status_code, 200)
+
+            with open(pid_file) as pid:
+                master = int(pid.read())
+            workers = self.wait_for_workers(master, 2)
+            os.kill(master, signal.SIGHUP)
+            # the reload is done once both workers were replaced
+            self.wait_for_workers(master, 2, replaced=workers)
+
+            response = requests.post(url, json={'username': 'serve', 'password': 'serve'}, timeout=10)
+            self.assertEqual(response.status_code, 200)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+class StartupTests(SimpleTestCase):
+    # seconds, the fastest of 3 cold starts of the lean settings
+    budget = float(os.environ.get('COLD_START_BUDGET', 1.5))
+
+    def test_lean_settings_imports(self):
+        """
+        Tests the lean settings start without the optional modules
+        """
+        modules = {module for module, self_us, cumulative_us in profile_imports('arithmetic_calculator_api.settings_lean')}
+
+        self.assertIn('api.views', modules)
+        for module in ('numpy', 'httpx', 'api.columnar', 'django.contrib.sessions', 'django.contrib.staticfiles'):
+            self.assertNotIn(module, modules)
+
+    def test_cold_start_budget(self):
+        """
+        Tests the cold start of the lean settings stays under its budget
+        """
+        out = io.StringIO()
+        call_command('profile_startup', settings_module='arithmetic_calculator_api.settings_lean', 
+                     budget=self.budget, top=5, stdout=out)
+        self.assertIn('cold start', out.getvalue())
+
+
+class RecordDeleteTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        self.other_user = User.objects.create_user(username='other', password='other')
+        operation = Operation.objects.get(type=1)
+        Record.objects.bulk_create([Record(user=user, operation=operation, cost=operation.cost, user_balance=0)
+                                    for user in [self.user] * 3 + [self.other_user] * 2])
+        self.own_ids = list(Record.objects.filter(user=self.user).values_list('id', flat=True))
+        self.other_ids = list(Record.objects.filter(user=self.other_user).values_list('id', flat=True))
+
+    def test_delete_checks_ownership(self):
+        """
+        Tests a user can't delete the records of another user
+        """
+        response = self.client.delete(reverse('record_delete', kwargs={'id': self.other_ids[0]}), 
+                                      headers=self.headers, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(Record.objects.get(id=self.other_ids[0]).is_active)
+
+    def test_bulk_delete(self):
+        """
+        Tests the bulk delete flips the records of the user in one UPDATE
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('records_delete'), {"ids": self.own_ids[:2] + self.other_ids}, 
+                                        headers=self.headers, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['response_data'], {"deleted": 2})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "api_record"')]), 1)
+
+        self.assertEqual(list(Record.objects.filter(is_active=True, user=self.user).values_list('id', flat=True)), 
+                         self.own_ids[2:])
+        self.assertEqual(Record.objects.filter(is_active=True, user=self.other_user).count(), 2)
+
+    def test_bulk_delete_invalid(self):
+        """
+        Tests the invalid bulk delete requests
+        """
+        for ids in [None, [], ["a"], list(range(1001))]:
+            response = self.client.post(reverse('records_delete'), {"ids": ids}, headers=self.headers, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_archive_records(self):
+        """
+        Tests the archive command moves the soft deleted and the old records
+        """
+        Record.objects.filter(id__in=self.own_ids[:2]).update(is_active=False)
+        Record.objects.filter(id=self.other_ids[0]).update(date=timezone.now() - datetime.timedelta(days=400))
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command('archive_records', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(sorted(RecordArchive.objects.values_list('id', flat=True)), self.own_ids[:2])
+        # the batches are paginated on the id
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 3)
+        for select, last_id in zip(selects, [0] + sorted(self.own_ids[:2])):
+            self.assertIn('"id" > {}'.format(last_id), select)
+        self.assertFalse(Record.objects.filter(id__in=self.own_ids[:2]).exists())
+
+        call_command('archive_records', active_older_than=365, stdout=io.StringIO())
+        self.assertEqual(RecordArchive.objects.count(), 3)
+        self.assertEqual(Record.objects.count(), 2)
+
+
+class RecordRowsSerializationTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        for i in Operation.TYPE_CHOICES:
+            operation = Operation.objects.get(type=i[0])
+            Record(user=self.user, operation=operation, cost=operation.cost, 
+                   user_balance=self.user.balance, operation_response="").save()
+
+    def test_serialize_record_rows(self):
+        """
+        Tests the record rows are serialized like RecordSerializer
+        """
+        records = Record.objects.order_by('id')
+        type_str = {operation.id: operation.type_str for operation in Operation.objects.all()}
+
+        self.assertEqual(serialize_record_rows(records.values(*RECORD_ROW_FIELDS), type_str),
+                         [dict(r) for r in RecordSerializer(records, many=True).data])
+
+    def test_record_view_query_count(self):
+        """
+        Tests the records page doesn't query the operation of each record
+        """
+        catalog.all()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('records'), headers=self.headers, format='json')
+
+        self.assertEqual(len(response.data['results']), len(Operation.TYPE_CHOICES))
+        # the user, the count and the page
+        self.assertEqual(len(queries), 3)
+
+
+class RecordResultColumnsTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        self.user.balance = 100
+        self.user.save()
+
+    @override_settings(RANDOM_STRING_PROVIDER=LOCAL_RANDOM_STRINGS)
+    def test_operation_result_columns(self):
+        """
+        Tests the operations save their result in the typed columns
+        """
+        for operation_type, operator1, operator2 in [(3, 6, 7), (6, "", "")]:
+            operation = Operation.objects.get(type=operation_type)
+            self.client.post(reverse('operation'), 
+                             {"operation_id": operation.id, "operator1": operator1, "operator2": operator2},
+                             headers=self.headers, format='json')
+
+        product, random_string = Record.objects.order_by('id')
+        self.assertEqual(product.result_number, 42)
+        self.assertIsNone(product.result_string)
+        self.assertIsNone(product.operation_response)
+        self.assertEqual(len(random_string.result_string), 10)
+        self.assertIsNone(random_string.result_number)
+
+        # the results can be filtered in SQL
+        self.assertEqual(Record.objects.filter(result_number__gt=40).count(), 1)
+
+    def test_expression_result_columns(self):
+        """
+        Tests the expression is kept next to the result of an expression
+        """
+        self.client.post(reverse('operation_expression'), {"expression": "a * (b + 1)", "variables": {"a": 2, "b": 3}},
+                         headers=self.headers, format='json')
+
+        record = Record.objects.get()
+        self.assertEqual(record.result_number, 8)
+        self.assertEqual(json.loads(record.operation_response), {"expression": "a * (b + 1)"})
+
+
+class RecordResultMigrationTests(AuthenticatedMixin, APITransactionTestCase):
+    # keep the operations inserted by the migrations after the flush
+    serialized_rollback = True
+
+    def test_convert_record_responses(self):
+        """
+        Tests the data migration moves the saved responses to the typed columns
+        """
+        call_command('migrate', 'api', '0007', verbosity=0)
+        try:
+            state = MigrationExecutor(connection).loader.project_state(('api', '0007_record_result_columns'))
+            HistoricalRecord = state.apps.get_model('api', 'Record')
+            operation = Operation.objects.get(type=1)
+            responses = ["{'status': 1, 'response_data': 3.0}",
+                         "{'status': 1, 'response_data': 'aZ3kQ9mN2p'}",
+                         "{'status': 1, 'response_data': 8.0, 'expression': 'a * b'}",
+                         "not a response"]
+            HistoricalRecord.objects.bulk_create([HistoricalRecord(user_id=self.user.id, operation_id=operation.id,
+                                                                   operation_response=response)
+                                                  for response in responses])
+        finally:
+            call_command('migrate', 'api', verbosity=0)
+
+        records = list(Record.objects.order_by('id').values_list('result_number', 'result_string', 'operation_response'))
+        self.assertEqual(records, [(3.0, None, None),
+                                   (None, 'aZ3kQ9mN2p', None),
+                                   (8.0, None, '{"expression": "a * b"}'),
+                                   (None, None, 'not a response')])
+
+
+class RecordsCursorPaginationTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        # 25 records, half of them sharing the same date
+        operations = [Operation.objects.get(type=1), Operation.objects.get(type=2)]
+        for i in range(25):
+            operation = operations[i % 2]
+            Record(user=self.user, operation=operation, cost=operation.cost, 
+                   user_balance=self.user.balance, operation_response="").save()
+        first = Record.objects.order_by('id').first()
+        Record.objects.filter(id__lte=first.id + 12).update(date=first.date)
+
+    def get_pages(self, url, params=None, link='next'):
+        pages = []
+        while url:
+            response = self.client.get(url, params, headers=self.headers, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([r['id'] for r in response.data['results']])
+            url = response.data[link]
+            params = None
+        return pages
+
+    def test_record_view_cursor_pages(self):
+        """
+        Tests walking the records forwards and backwards with the cursors
+        """
+        expected = list(Record.objects.order_by('-date', '-id').values_list('id', flat=True))
+
+        pages = self.get_pages(reverse('records'), {'pagination': 'cursor'})
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), expected)
+
+        # walk back from the last page
+        response = self.client.get(reverse('records'), {'pagination': 'cursor'}, 
+                                   headers=self.headers, format='json')
+        response = self.client.get(response.data['next'], headers=self.headers, format='json')
+        response = self.client.get(response.data['next'], headers=self.headers, format='json')
+        self.assertIsNone(response.data['next'])
+
+        pages = self.get_pages(response.data['previous'], link='previous')
+        self.assertEqual(pages, [expected[10:20], expected[0:10]])
+
+    def test_record_view_cursor_filter(self):
+        """
+        Tests the cursor pagination keeps the operations filter
+        """
+        pages = self.get_pages(reverse('records'), {'pagination': 'cursor', 'operations': 1})
+        expected = list(Record.objects.filter(operation__type=1)
+                                      .order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_record_view_invalid_cursor(self):
+        """
+        Tests an invalid cursor is not found
+        """
+        response = self.client.get(reverse('records'), {'cursor': 'invalid'}, 
+                                   headers=self.headers, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+
+@skipUnlessDBFeature('supports_partial_indexes')
+class RecordsQueryPlanTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        if connection.vendor != 'sqlite':
+            self.skipTest("EXPLAIN QUERY PLAN is specific to SQLite")
+
+        operation = Operation.objects.get(type=1)
+        for i in range(15):
+            Record(user=self.user, operation=operation, cost=operation.cost, 
+                   user_balance=self.user.balance, operation_response="").save()
+
+    def assert_history_plans(self, url, params=None):
+        """
+        Runs EXPLAIN QUERY PLAN on the history queries of a records request
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params, headers=self.headers, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        history_queries = [q['sql'] for q in queries 
+                           if 'FROM "api_record"' in q['sql'] and 'ORDER BY' in q['sql']]
+        self.assertTrue(history_queries)
+
+        for sql in history_queries:
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                plan = " | ".join(row[-1] for row in cursor.fetchall())
+
+            self.assertNotIn("TEMP B-TREE", plan, sql)
+            self.assertNotIn("SCAN", plan, sql)
+            self.assertIn("USING INDEX record_user_", plan, sql)
+        return response
+
+    def test_history_query_plan(self):
+        """
+        Tests the history queries use the history indexes
+        """
+        self.assert_history_plans(reverse('records'))
+        self.assert_history_plans(reverse('records'), {'operations': 1})
+
+    def test_history_cursor_query_plan(self):
+        """
+        Tests the keyset pages use the history indexes
+        """
+        for params in [{'pagination': 'cursor'}, {'pagination': 'cursor', 'operations': 1}]:
+            response = self.assert_history_plans(reverse('records'), params)
+            response = self.assert_history_plans(response.data['next'])
+            self.assert_history_plans(response.data['previous'])
+
+
+class RecordExportViewTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        for i in Operation.TYPE_CHOICES:
+            operation = Operation.objects.get(type=i[0])
+            Record(user=self.user, operation=operation, cost=operation.cost, 
+                   user_balance=self.user.balance, operation_response="").save()
+        # move the first record to the previous day
+        self.first = Record.objects.order_by('id').first()
+        self.first.date = self.first.date - datetime.timedelta(days=1)
+        self.first.save()
+
+    def export(self, params):
+        response = self.client.get(reverse('records_export'), params, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode("utf-8")
+
+    def test_record_export_csv(self):
+        """
+        Tests the csv export of the records, oldest first
+        """
+        rows = list(csv.DictReader(self.export({'output': 'csv'}).splitlines()))
+
+        self.assertEqual(len(rows), len(Operation.TYPE_CHOICES))
+        self.assertEqual(int(rows[0]['id']), self.first.id)
+        self.assertEqual(rows[0]['operation_type_str'], "addition")
+
+    def test_record_export_ndjson_filters(self):
+        """
+        Tests the ndjson export with the operations filter and date range
+        """
+        rows = [json.loads(line) for line in self.export({'output': 'ndjson', 'operations': 2}).splitlines()]
+        self.assertEqual([r['operation_type_str'] for r in rows], ["substraction"])
+
+        today = timezone.localdate().isoformat()
+        rows = self.export({'output': 'ndjson', 'date_from': today}).splitlines()
+        self.assertEqual(len(rows), len(Operation.TYPE_CHOICES) - 1)
+
+        rows = self.export({'output': 'ndjson', 'date_to': self.first.date.isoformat()}).splitlines()
+        self.assertEqual(len(rows), 1)
+
+    def test_record_export_invalid_params(self):
+        """
+        Tests the invalid export parameters
+        """
+        for params in [{'output': 'xml'}, {'date_from': 'yesterday'}]:
+            response = self.client.get(reverse('records_export'), params, headers=self.headers)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncViewTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.async_headers = {'Authorization': 'Bearer {}'.format(self.token)}
+
+    async def test_async_home_view(self):
+        """
+        Tests the async home view
+        """
+        response = await self.async_client.get(reverse('async_home'), headers=self.async_headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['username'], self.username)
+        self.assertEqual(len(response.json()['operations']), await Operation.objects.acount())
+
+    async def test_async_view_unauthenticated(self):
+        """
+        Tests the async views require a valid token
+        """
+        response = await AsyncClient().get(reverse('async_home'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await AsyncClient().get(reverse('async_records'), headers={'Authorization': 'Bearer invalid'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_async_operation_view(self):
+        """
+        Tests the async operation view charges the operation like the operation view
+        """
+        operation = await Operation.objects.aget(type=3)
+        balance = 10
+        await User.objects.filter(id=self.user.id).aupdate(balance=balance)
+
+        response = await self.async_client.post(reverse('async_operation'),
+                                                {"operation_id": operation.id, "operator1": 3, "operator2": 5},
+                                                headers=self.async_headers, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], 1)
+        self.assertEqual(response.json()['response_data'], 15)
+        self.assertEqual(response.json()['user_balance'], balance - operation.cost)
+
+        record = await Record.objects.aget(user=self.user)
+        self.assertEqual(record.cost, operation.cost)
+        self.assertEqual(record.user_balance, balance)
+
+    @override_settings(RANDOM_STRING_PROVIDER=LOCAL_RANDOM_STRINGS)
+    async def test_async_operation_view_random_string(self):
+        """
+        Tests the async operation view with random_string operation
+        """
+        operation = await Operation.objects.aget(type=6)
+        await User.objects.filter(id=self.user.id).aupdate(balance=operation.cost)
+
+        response = await self.async_client.post(reverse('async_operation'), {"operation_id": operation.id},
+                                                headers=self.async_headers, content_type='application/json')
+
+        self.assertEqual(response.json()['status'], 1)
+        self.assertEqual(len(response.json()['response_data']), 10)
+
+    async def test_async_operation_view_balance(self):
+        """
+        Tests the async operation view denies the operation when the balance is not enough
+        """
+        operation = await Operation.objects.aget(type=1)
+        await User.objects.filter(id=self.user.id).aupdate(balance=0)
+
+        response = await self.async_client.post(reverse('async_operation'),
+                                                {"operation_id": operation.id, "operator1": 1, "operator2": 1},
+                                                headers=self.async_headers, content_type='application/json')
+
+        self.assertEqual(response.json()['status'], 0)
+        self.assertEqual(response.json()['error_message'], "The user balance is not enough")
+        self.assertFalse(await Record.objects.filter(user=self.user).aexists())
+
+    def test_async_records_view(self):
+        """
+        Tests the async records view returns the same pages as the records view
+        """
+        operation = Operation.objects.get(type=1)
+        Record.objects.bulk_create([Record(user=self.user, operation=operation, cost=operation.cost,
+                                           user_balance=self.user.balance, operation_response="")
+                                    for i in range(15)])
+
+        for params in ({}, {'page': 2}, {'operations': 1}, {'operations': 2}):
+            response = self.client.get(reverse('records'), params, headers=self.headers, format='json')
+            async_response = async_to_sync(self.async_client.get)(reverse('async_records'), params,
+                                                                headers=self.async_headers)
+
+            self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+            expected = json.loads(response.content)
+            actual = async_response.json()
+            self.assertEqual(actual['count'], expected['count'])
+            self.assertEqual(actual['results'], expected['results'])
+            self.assertEqual(actual['next'] is None, expected['next'] is None)
+            self.assertEqual(actual['previous'] is None, expected['previous'] is None)
+
+        response = async_to_sync(self.async_client.get)(reverse('async_records'), {'page': 3},
+                                                          headers=self.async_headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+THROTTLE = {'USER_RATE': 1, 'USER_CAPACITY': 5, 'GLOBAL_RATE': 10, 'GLOBAL_CAPACITY': 50}
+
+@override_settings(OPERATION_THROTTLE=THROTTLE)
+class OperationThrottleTests(AuthenticatedViewTests):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.user.balance = 100
+        self.user.save()
+
+    def post_operation(self, operation:Operation):
+        return self.client.post(reverse('operation'), {"operation_id": operation.id, "operator1": 2, "operator2": 3},
+                                headers=self.headers, format='json')
+
+    def test_operation_cost_throttle(self):
+        """
+        Tests the requests are throttled by the cost of their operation, before the debit
+        """
+        operation = Operation.objects.get(type=5)
+        self.assertEqual(self.post_operation(operation).data['status'], 1)
+
+        # 2 tokens left, the next square root waits for 1 more
+        response = self.post_operation(operation)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Record.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(current_balance(self.user), 100 - operation.cost)
+
+        # the cheaper operations still fit
+        self.assertEqual(self.post_operation(Operation.objects.get(type=1)).data['status'], 1)
+        self.assertIn('throttled_requests_total{scope="user"} 1\n', registry.exposition())
+
+    def test_bulk_operation_cost_invalid_data(self):
+        """
+        Tests the element count of invalid bulk operands is estimated without errors
+        """
+        for operand in [{"encoding": "float64-base64", "data": 123}, {"encoding": "float64-base64"}, 
+                        {"data": ["a"]}, "a", 3]:
+            self.assertEqual(BulkOperationView.estimate_count(operand), 1)
+        self.assertEqual(BulkOperationView.estimate_count({"data": "A" * 32}), 3)
+
+    def test_invalid_operation_not_throttled(self):
+        """
+        Tests the invalid operations take no tokens
+        """
+        for i in range(10):
+            response = self.client.post(reverse('operation'), {"operation_id": 0, "operator1": 1, "operator2": 1},
+                                        headers=self.headers, format='json')
+            self.assertEqual(response.data['error_message'], "Invalid operation")
+
+    def test_batch_throttled_by_total_cost(self):
+        """
+        Tests a batch is charged the cost of all its operations
+        """
+        item = {"operation_id": Operation.objects.get(type=3).id, "operator1": 2, "operator2": 3}
+        response = self.client.post(reverse('operation_batch'), {"operations": [item] * 2},
+                                    headers=self.headers, format='json')
+        self.assertEqual(response.data['status'], 1)
+
+        response = self.client.post(reverse('operation_batch'), {"operations": [item] * 2},
+                                    headers=self.headers, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_global_bucket(self):
+        """
+        Tests the users share the global bucket
+        """
+        for ident in range(10):
+            self.assertEqual(consume_operation_cost('other{}'.format(ident), 5), 0)
+
+        response = self.post_operation(Operation.objects.get(type=1))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('throttled_requests_total{scope="global"} 1\n', registry.exposition())
+
+    def test_cost_over_capacity(self):
+        """
+        Tests a request costing more than a bucket holds leaves it in debt of at most its capacity
+        """
+        limits = [("user", "user:1", 1, 5)]
+        states, wait, scope = take([None], limits, [20], 100.0)
+        self.assertEqual(states, [(-5, 100.0)])
+
+        # the debt is refilled before the next request
+        states, wait, scope = take(states, limits, [1], 102.0)
+        self.assertEqual((states, wait, scope), (None, 4.0, "user"))
+
+    def test_expensive_request_global_bucket(self):
+        """
+        Tests an expensive request takes at most a user's capacity from the global bucket
+        """
+        self.assertEqual(consume_operation_cost(self.user.id, 1000), 0)
+        self.assertAlmostEqual(consume_operation_cost(self.user.id, 1), 6, delta=0.1)
+
+        for ident in range(9):
+            self.assertEqual(consume_operation_cost('other{}'.format(ident), 5), 0)
+
+    @override_settings(OPERATION_THROTTLE={})
+    def test_largest_requests_lockout(self):
+        """
+        Tests the largest batch and bulk job hold back the user for at most a minute with the defaults
+        """
+        self.user.balance = 10 ** 7
+        self.user.save()
+        division = Operation.objects.get(type=4)
+        config = throttle_config()
+        lockout = 2 * config['USER_CAPACITY'] / config['USER_RATE']
+        self.assertLessEqual(lockout, 60)
+
+        item = {"operation_id": division.id, "operator1": 3, "operator2": 2}
+        response = self.client.post(reverse('operation_batch'), {"operations": [item] * OperationBatchView.max_batch_size},
+                                    headers=self.headers, format='json')
+        self.assertEqual(response.data['status'], 1)
+        self.assertLessEqual(consume_operation_cost(self.user.id, 1), lockout)
+
+        get_bucket_store().reset()
+        self.assertEqual(consume_operation_cost(self.user.id, division.cost * BulkOperationView.max_count), 0)
+        self.assertLessEqual(consume_operation_cost(self.user.id, 1), lockout)
+
+        # plain operations are served well above one per second
+        get_bucket_store().reset()
+        for i in range(50):
+            self.assertEqual(self.post_operation(Operation.objects.get(type=1)).status_code, status.HTTP_200_OK)
+
+    def test_shared_bucket_store(self):
+        """
+        Tests the buckets are kept in a Django cache when there's one
+        """
+        with override_settings(OPERATION_THROTTLE=dict(THROTTLE, CACHE='default')):
+            store = get_bucket_store()
+            self.assertIsInstance(store, CacheBucketStore)
+            self.addCleanup(store.cache.clear)
+
+            self.assertEqual(consume_operation_cost(self.user.id, 5), 0)
+            self.assertGreater(consume_operation_cost(self.user.id, 1), 0)
+            self.assertEqual(store.cache.get('throttle:user:{}'.format(self.user.id))[0], 0)
+
+    async def test_async_operation_view_throttled(self):
+        """
+        Tests the async operation view takes its cost from the same buckets
+        """
+        operation = await Operation.objects.aget(type=5)
+        await sync_to_async(consume_operation_cost)(self.user.id, 3)
 
-        
\ No newline at end of file
+        response = await AsyncClient().post(reverse('async_operation'),
+                                            {"operation_id": operation.id, "operator1": 4, "operator2": 2},
+                                            headers={'Authorization': 'Bearer {}'.format(self.token)},
+                                            content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(await Record.objects.filter(user=self.user).aexists())
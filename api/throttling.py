@@ -0,0 +1,198 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import receiver
+from django.core.signals import setting_changed
+from rest_framework.throttling import BaseThrottle
+
+from api.metrics import THROTTLED_REQUESTS
+
+DEFAULT_THROTTLE = {
+    "ENABLED": True,
+    "USER_RATE": 20,
+    "USER_CAPACITY": 600,
+    "GLOBAL_RATE": 1000,
+    "GLOBAL_CAPACITY": 20000,
+    "CACHE": None,
+}
+
+
+def throttle_config() -> dict:
+    return dict(DEFAULT_THROTTLE, **getattr(settings, "OPERATION_THROTTLE", {}))
+
+
+def refill(state, rate:float, capacity:float, now:float) -> float:
+    '''
+    Returns the tokens of a bucket at now, from its (tokens, updated) state,
+    a missing bucket is full
+    '''
+    if state is None:
+        return capacity
+    tokens, updated = state
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def take(states:list, limits:list, costs:list, now:float) -> tuple:
+    '''
+    Takes its cost from every bucket, or from none of them
+
+    A cost larger than a bucket is taken once the bucket is full, and leaves
+    it in debt of at most its capacity: after the largest request the next
+    one waits at most 2 * capacity / rate seconds.
+
+    :param states: (tokens, updated) of each bucket, or None
+    :param limits: (scope, key, rate, capacity) of each bucket
+    :param costs: tokens taken from each bucket
+    :returns: the new states, or None with the seconds to wait and the scope
+              of the bucket that has to wait the longest
+    '''
+    tokens = [refill(state, rate, capacity, now) for state, (scope, key, rate, capacity) in zip(states, limits)]
+    wait, wait_scope = 0.0, None
+    for available, cost, (scope, key, rate, capacity) in zip(tokens, costs, limits):
+        missing = min(cost, capacity) - available
+        if missing > 0 and missing / rate > wait:
+            wait, wait_scope = missing / rate, scope
+    if wait_scope is not None:
+        return None, wait, wait_scope
+
+    states = [(max(available - cost, -capacity), now)
+              for available, cost, (scope, key, rate, capacity) in zip(tokens, costs, limits)]
+    return states, 0.0, None
+
+
+class LocalBucketStore:
+    '''
+    Token buckets in the memory of the process, each worker enforces the
+    limits on its own requests
+    '''
+    def __init__(self, max_size:int=100000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def consume(self, limits:list, costs:list) -> tuple:
+        '''
+        Returns the seconds to wait and the limiting scope, or (0, None) once
+        the costs are taken from the buckets
+        '''
+        now = time.monotonic()
+        keys = [key for scope, key, rate, capacity in limits]
+        with self._lock:
+            if len(self._buckets) >= self.max_size:
+                self._prune(now)
+            states, wait, scope = take([self._buckets.get(key, (None,))[0] for key in keys], limits, costs, now)
+            if states is not None:
+                for (bucket_scope, key, rate, capacity), state in zip(limits, states):
+                    # the bucket is dropped once it's full again
+                    self._buckets[key] = (state, now + (capacity - state[0]) / rate)
+        return wait, scope
+
+    def reset(self):
+        with self._lock:
+            self._buckets = {}
+
+    def _prune(self, now:float):
+        # a missing bucket is full, drop the ones refilled since their last request
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[1] > now}
+
+
+class CacheBucketStore:
+    '''
+    Token buckets in a Django cache shared by the workers
+
+    Like the throttles of DRF the buckets are read and written back without
+    a lock, two concurrent requests of a user may both take the same tokens.
+    The entries expire once their bucket would be full again.
+    '''
+    def __init__(self, alias:str):
+        self.cache = caches[alias]
+
+    def consume(self, limits:list, costs:list) -> tuple:
+        now = time.time()
+        keys = ["throttle:{}".format(key) for scope, key, rate, capacity in limits]
+        cached = self.cache.get_many(keys)
+        states, wait, scope = take([cached.get(key) for key in keys], limits, costs, now)
+        if states is not None:
+            timeout = max(math.ceil((capacity - state[0]) / rate)
+                          for state, (scope, key, rate, capacity) in zip(states, limits)) + 1
+            self.cache.set_many(dict(zip(keys, states)), timeout=timeout)
+        return wait, scope
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    '''
+    Returns the bucket store of the OPERATION_THROTTLE setting, created on
+    first use
+    '''
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                alias = throttle_config()["CACHE"]
+                _store = CacheBucketStore(alias) if alias else LocalBucketStore()
+    return _store
+
+
+def consume_operation_cost(ident, cost:float) -> float:
+    '''
+    Takes the cost of a request from the bucket of its user and from the
+    global bucket
+
+    The global bucket is charged at most USER_CAPACITY, the debt of the
+    user's bucket holds back the next requests of that user, so a single
+    user can't drain the global bucket.
+
+    :param ident: user id, or address of an anonymous client
+    :returns: seconds to wait before the request can be served, 0 if it can
+              be served now
+    '''
+    config = throttle_config()
+    if not config["ENABLED"] or cost <= 0:
+        return 0
+    limits = [
+        ("user", "user:{}".format(ident), config["USER_RATE"], config["USER_CAPACITY"]),
+        ("global", "global", config["GLOBAL_RATE"], config["GLOBAL_CAPACITY"]),
+    ]
+    wait, scope = get_bucket_store().consume(limits, [cost, min(cost, config["USER_CAPACITY"])])
+    if wait:
+        THROTTLED_REQUESTS.inc(scope=scope)
+    return wait
+
+
+class OperationCostThrottle(BaseThrottle):
+    '''
+    Throttles the requests by the cost of their operations, instead of their
+    number
+
+    Only the views with a get_throttle_cost(request) method are throttled,
+    it returns the cost of the operations of the request. DRF checks the
+    throttles after the authentication and the permissions, before the view
+    reads or writes the balance.
+    '''
+    def allow_request(self, request, view) -> bool:
+        self.wait_seconds = None
+        get_cost = getattr(view, "get_throttle_cost", None)
+        if get_cost is None or not throttle_config()["ENABLED"]:
+            return True
+
+        user = request.user
+        ident = user.pk if user and user.is_authenticated else self.get_ident(request)
+        self.wait_seconds = consume_operation_cost(ident, get_cost(request))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+@receiver(setting_changed)
+def reset_bucket_store(setting, **kwargs):
+    global _store
+    if setting == "OPERATION_THROTTLE":
+        _store = None
@@ -1,11 +1,21 @@
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('', views.HomeView.as_view(), name ='home'),
     path('operation/', views.OperationView.as_view(), name ='operation'),
+    path('operation/batch/', views.OperationBatchView.as_view(), name ='operation_batch'),
+    path('operation/bulk/', views.BulkOperationView.as_view(), name ='operation_bulk'),
+    path('operation/expression/', views.ExpressionView.as_view(), name ='operation_expression'),
     path('records/', views.RecordView.as_view(), name ='records'),
+    path('records/export/', views.RecordExportView.as_view(), name ='records_export'),
+    path('records/delete/', views.RecordBulkDeleteView.as_view(), name ='records_delete'),
     path('records/<int:id>/', views.RecordView.as_view(), name ='record_delete'),
+    path('usage/', views.UsageView.as_view(), name ='usage'),
+    path('async/', async_views.AsyncHomeView.as_view(), name ='async_home'),
+    path('async/operation/', async_views.AsyncOperationView.as_view(), name ='async_operation'),
+    path('async/records/', async_views.AsyncRecordView.as_view(), name ='async_records'),
+    path('metrics', views.metrics_view, name ='metrics'),
     path('logout/', views.LogoutView.as_view(), name ='logout'),
 ]
\ No newline at end of file
@@ -1,37 +1,53 @@
-from django.http import HttpResponse
+import csv
+import datetime
+import json
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.pagination import PageNumberPagination
 
-from api.models import Operation, Record
+from api.authentication import FilteredRefreshToken
+from api.billing import balance_not_enough, charge, charge_many, current_balance
+from api.catalog import catalog
+from api.expressions import ExpressionError, compile_expression
+from api.metrics import metrics_config, registry
+from api.models import Operation, Record, UsageRollup
 from api.operations import dict_message, perform_operation
-from api.serializers import OperationSerializer, RecordSerializer
+from api.pagination import RecordCursorPagination
+from api.serializers import RECORD_ROW_FIELDS, serialize_record_rows
 
 
 
 class HomeView(APIView):  
    permission_classes = (IsAuthenticated,)
    def get(self, request):
-        # return all operations for now
-        operations = Operation.objects.all()
-        serializer = OperationSerializer(operations, many=True)
+        # return all operations from the cached catalog
         content = {'username': request.user.username, 
-                   'user_balance': request.user.balance,
-                   'operations': serializer.data}
+                   'user_balance': request.user.live_balance,
+                   'operations': catalog.serialized()}
         return Response(content)
    
 
 class OperationView(APIView):  
    permission_classes = (IsAuthenticated,)
+   def get_throttle_cost(self, request):
+        # the invalid operations aren't charged
+        try:
+            return catalog.get(request.data.get("operation_id")).cost
+        except Exception as e:
+            return 0
+
    def post(self, request):
         # search for the operation based on the received operation_id
         operation_id = request.data["operation_id"]
         try:
-            operation = Operation.objects.get(id=operation_id)
+            operation = catalog.get(operation_id)
         except Exception as e:
             return Response(dict_message(error_message="Invalid operation"))
 
@@ -39,7 +55,7 @@ class OperationView(APIView):
         response = dict_message(error_message="Unknown error")
 
         # perform operation if the user has enough balance
-        if user.balance >= operation.cost:
+        if current_balance(user) >= operation.cost:
             response = perform_operation(operation_type=operation.type, 
                                          operator1=request.data["operator1"], 
                                          operator2=request.data["operator2"])
@@ -47,51 +63,431 @@ class OperationView(APIView):
             # check if the operation is performed sucessfully
             if response['status'] == 1:
                 try:
-                    # saves the record
-                    record = Record(cost=operation.cost, 
-                                    user_balance=request.user.balance, 
-                                    operation_response=response, 
-                                    operation=operation, user=user)
-                    record.save()
-
-                    # updates user balance
-                    user.balance -= operation.cost
-                    user.save()
+                    # debits the user balance, only if it's still enough, and saves the record
+                    balance = charge(user, operation, response)
+                    if balance is None:
+                        return Response(balance_not_enough(operation))
 
                     # return updated user_balance
-                    response["user_balance"] = user.balance
+                    response["user_balance"] = balance
                     return Response(response)
                 except Exception as e:
                     return Response(dict_message(error_message=str(e)))
         else:
-            return Response(dict_message(error_message="The user balance is not enough"))
+            return Response(balance_not_enough(operation))
         return Response(response)
    
    
 
-class RecordView(APIView, PageNumberPagination):  
+class OperationBatchView(APIView):  
    permission_classes = (IsAuthenticated,)
-   page_size = 10
-   def get(self, request):
+   max_batch_size = 1000
+   def get_throttle_cost(self, request):
+        # the batches rejected by post() aren't charged
+        items = request.data.get("operations")
+        if not isinstance(items, list) or len(items) > self.max_batch_size:
+            return 0
+        operations = {operation.id: operation for operation in catalog.all()}
+        cost = 0
+        for item in items:
+            try:
+                cost += operations[int(item["operation_id"])].cost
+            except Exception as e:
+                pass
+        return cost
+
+   def post(self, request):
+        items = request.data.get("operations")
+        if not isinstance(items, list) or len(items)==0:
+            return Response(dict_message(error_message="A list of operations is required"))
+        if len(items) > self.max_batch_size:
+            return Response(dict_message(error_message="A batch accepts at most {} operations".format(self.max_batch_size)))
+
+        # parse the operation ids, keeping None for the invalid ones
+        operation_ids = []
+        for item in items:
+            try:
+                operation_ids.append(int(item["operation_id"]))
+            except Exception as e:
+                operation_ids.append(None)
+
+        # look up every referenced operation in the cached catalog
+        operations = {operation.id: operation for operation in catalog.all()}
+
+        user = request.user
+
+        # check the total cost of the batch against the user balance once
+        total_cost = sum(operations[i].cost for i in operation_ids if i in operations)
+        if current_balance(user) < total_cost:
+            return Response(balance_not_enough())
+
+        # perform the operations, only the successful ones are charged
+        results = []
+        performed = []
+        for item, operation_id in zip(items, operation_ids):
+            operation = operations.get(operation_id)
+            if operation is None:
+                results.append(dict_message(error_message="Invalid operation"))
+                continue
+
+            response = perform_operation(operation_type=operation.type, 
+                                         operator1=item.get("operator1"), 
+                                         operator2=item.get("operator2"))
+            results.append(response)
+
+            if response['status'] == 1:
+                performed.append((operation, response))
+
+        # nothing to debit, the balance read above is still current
+        balance = user.live_balance
+        if performed:
+            try:
+                # debits the user balance and saves all the records in one transaction
+                balance = charge_many(user, performed)
+                if balance is None:
+                    return Response(balance_not_enough())
+            except Exception as e:
+                return Response(dict_message(error_message=str(e)))
+
+        response = dict_message(response_data=results)
+        response["user_balance"] = balance
+        return Response(response)
+   
+
+class ExpressionView(APIView):  
+   permission_classes = (IsAuthenticated,)
+   def get_throttle_cost(self, request):
+        # the plan is cached, compiling it again in post() is a lookup
+        try:
+            plan = compile_expression(request.data.get("expression"))
+            return sum(catalog.get_by_type(operation_type).cost * count 
+                       for operation_type, count in plan.operation_counts.items())
+        except Exception as e:
+            return 0
+
+   def post(self, request):
+        try:
+            plan = compile_expression(request.data.get("expression"))
+            if plan.root_type is None:
+                raise ExpressionError("The expression has no operations")
+
+            # each operation of the expression is charged at its cost
+            cost = sum(catalog.get_by_type(operation_type).cost * count 
+                       for operation_type, count in plan.operation_counts.items())
+            operation = catalog.get_by_type(plan.root_type)
+        except ExpressionError as e:
+            return Response(dict_message(error_message=str(e)))
+        except Exception as e:
+            return Response(dict_message(error_message="Invalid operation"))
+
+        variables = request.data.get("variables") or {}
+        if not isinstance(variables, dict):
+            return Response(dict_message(error_message="Variables must be an object"))
+
+        user = request.user
+        if current_balance(user) < cost:
+            return Response(balance_not_enough(operation))
+
+        response = plan.evaluate(variables)
+        if response['status'] != 1:
+            return Response(response)
+
+        try:
+            # debits the whole evaluation at once, with one record under the
+            # outermost operation of the expression
+            response["expression"] = plan.expression
+            balance = charge(user, operation, response, cost=cost)
+            if balance is None:
+                return Response(balance_not_enough(operation))
+        except Exception as e:
+            return Response(dict_message(error_message=str(e)))
+
+        response["cost"] = cost
+        response["user_balance"] = balance
+        return Response(response)
+   
+
+class BulkOperationView(APIView):  
+   permission_classes = (IsAuthenticated,)
+   max_count = 1000000
+   @staticmethod
+   def estimate_count(operand) -> int:
+        # number of elements of an operand from its size, without decoding it
+        if isinstance(operand, list):
+            return len(operand)
+        if isinstance(operand, dict):
+            data = operand.get("data")
+            # the invalid data is rejected by post()
+            return len(data) * 3 // 4 // 8 if isinstance(data, str) else 1
+        if isinstance(getattr(operand, "size", None), int):
+            return operand.size // 8
+        return 1
+
+   def get_throttle_cost(self, request):
+        # the job is priced per element
+        try:
+            operation = catalog.get(request.data.get("operation_id"))
+        except Exception as e:
+            return 0
+        count = max(self.estimate_count(request.data.get("operator1")), 
+                    self.estimate_count(request.data.get("operator2")))
+        return operation.cost * count
+
+   def post(self, request):
+        # numpy is imported by the first bulk operation, not on startup
+        from api.columnar import COLUMN_OPERATIONS, ColumnError, decode_operands, evaluate_columns
+
+        try:
+            operation = catalog.get(request.data.get("operation_id"))
+        except Exception as e:
+            return Response(dict_message(error_message="Invalid operation"))
+        if operation.type not in COLUMN_OPERATIONS:
+            return Response(dict_message(error_message="Invalid operation"))
+
+        # the operands are JSON lists, encoded buffers or uploaded files, the
+        # buffers and the files are checked against max_count before decoding
+        try:
+            column1, column2, count = decode_operands(request.data.get("operator1"), 
+                                                      request.data.get("operator2"),
+                                                      self.max_count)
+        except ColumnError as e:
+            return Response(dict_message(error_message=str(e)))
+        if count > self.max_count:
+            return Response(dict_message(error_message="A bulk operation accepts at most {} elements".format(self.max_count)))
+
+        # price the job before evaluating it
+        user = request.user
+        cost = count * operation.cost
+        if current_balance(user) < cost:
+            return Response(balance_not_enough(operation))
+
+        response = dict_message(response_data=evaluate_columns(operation.type, column1, column2))
+
+        try:
+            # saves one record with the summary of the job
+            summary = {key: response["response_data"][key] for key in ("count", "error_count")}
+            balance = charge(user, operation, dict_message(response_data=summary), cost=cost)
+            if balance is None:
+                return Response(balance_not_enough(operation))
+        except Exception as e:
+            return Response(dict_message(error_message=str(e)))
+
+        response["cost"] = cost
+        response["user_balance"] = balance
+        return Response(response)
+   
+
+class RecordHistoryMixin:
+   def get_queryset(self, request):
         # return all records related to the logged user
         queryset = Record.objects.filter(user__id=request.user.id, 
-                                         is_active=True).order_by('-date')
+                                         is_active=True)
         if 'operations' in request.GET:
             if int(request.GET['operations']) > 0:
-                queryset = queryset.filter(operation__type=int(request.GET['operations']))
+                # filter on the operation ids so the history index can be used
+                operation_type = int(request.GET['operations'])
+                operation_ids = [o.id for o in catalog.all() if o.type == operation_type]
+                queryset = queryset.filter(operation__in=operation_ids)
+        return queryset
+
+
+class RecordView(RecordHistoryMixin, APIView, PageNumberPagination):  
+   '''
+   Records history of the user
+
+   With settings.RECORD_WRITE_BEHIND enabled the records are inserted by a
+   background thread, up to FLUSH_INTERVAL seconds (0.5 by default) after
+   the operation returns, so the latest operations may be missing from the
+   history for that long.
+   '''
+   permission_classes = (IsAuthenticated,)
+   page_size = 10
+   def get(self, request):
+        queryset = self.get_queryset(request)
+
+        # keyset pagination with ?pagination=cursor, page numbers otherwise
+        if request.GET.get('pagination') == 'cursor' or 'cursor' in request.GET:
+            paginator = RecordCursorPagination()
+            paginator.page_size = self.page_size
+        else:
+            paginator = self
+            queryset = queryset.order_by('-date', '-id')
 
-        records = self.paginate_queryset(queryset, request, view=self)
-        serializer = RecordSerializer(records, many=True)
-        return self.get_paginated_response(serializer.data)
+        # read only the serialized columns, without building model instances
+        rows = paginator.paginate_queryset(queryset.values(*RECORD_ROW_FIELDS), request, view=self)
+        type_str = {operation.id: operation.type_str for operation in catalog.all()}
+        return paginator.get_paginated_response(serialize_record_rows(rows, type_str))
    
    def delete(self, request, id=None):
-        try:
-            record = Record.objects.get(id=id)
-            record.is_active = False
-            record.save()
-        except Exception as e:
+        # soft delete the record in one UPDATE, only if it belongs to the user
+        updated = Record.objects.filter(id=id, user__id=request.user.id).update(is_active=False)
+        if updated == 0:
             return Response(status=status.HTTP_404_NOT_FOUND)
         return Response(status=status.HTTP_202_ACCEPTED)
+
+
+class RecordBulkDeleteView(APIView):  
+   permission_classes = (IsAuthenticated,)
+   max_batch_size = 1000
+   def post(self, request):
+        ids = request.data.get("ids")
+        if not isinstance(ids, list) or len(ids)==0:
+            return Response(dict_message(error_message="A list of record ids is required"), 
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.max_batch_size:
+            return Response(dict_message(error_message="A request deletes at most {} records".format(self.max_batch_size)), 
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = [int(id) for id in ids]
+        except (TypeError, ValueError) as e:
+            return Response(dict_message(error_message="Invalid record id"), status=status.HTTP_400_BAD_REQUEST)
+
+        # soft delete all the active records of the user in one UPDATE, the
+        # ids of other users are ignored
+        deleted = Record.objects.filter(id__in=ids, user__id=request.user.id, is_active=True) \
+                                .update(is_active=False)
+        return Response(dict_message(response_data={"deleted": deleted}), status=status.HTTP_202_ACCEPTED)
+   
+
+def parse_date_param(value:str, end:bool=False) -> datetime.datetime:
+    '''
+    Parses an ISO date or datetime query parameter
+
+    :param value: the parameter value
+    :param end: a date means its end instead of its start
+    '''
+    try:
+        date = parse_date(value)
+        parsed = parse_datetime(value) if date is None else None
+    except ValueError as e:
+        date, parsed = None, None
+
+    if date is not None:
+        parsed = datetime.datetime.combine(date, datetime.time.max if end else datetime.time.min)
+    if parsed is None:
+        raise ValueError("Invalid date: {}".format(value))
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Echo:
+    """
+    File-like object that returns the written value, to stream the csv writer
+    """
+    def write(self, value):
+        return value
+
+
+class RecordExportView(RecordHistoryMixin, APIView):  
+   permission_classes = (IsAuthenticated,)
+   chunk_size = 2000
+   fields = ('id', 'date', 'operation_id', 'cost', 'user_balance', 'result_number', 'result_string', 
+             'operation_response')
+   def get(self, request):
+        """
+        Streams all the active records of the user as csv or ndjson, oldest first
+
+        Accepts the operations filter of the records view and a date range
+        with date_from and date_to, as ISO dates or datetimes.
+        """
+        output = request.GET.get('output', 'csv')
+        if output not in ('csv', 'ndjson'):
+            return Response(dict_message(error_message="Invalid output, use csv or ndjson"), 
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset(request)
+        try:
+            if request.GET.get('date_from'):
+                queryset = queryset.filter(date__gte=parse_date_param(request.GET['date_from']))
+            if request.GET.get('date_to'):
+                queryset = queryset.filter(date__lte=parse_date_param(request.GET['date_to'], end=True))
+        except ValueError as e:
+            return Response(dict_message(error_message=str(e)), status=status.HTTP_400_BAD_REQUEST)
+
+        # iterate in chunks so the memory stays flat regardless of the history size
+        rows = queryset.order_by('date', 'id').values_list(*self.fields).iterator(chunk_size=self.chunk_size)
+        type_str = {operation.id: operation.type_str for operation in catalog.all()}
+
+        if output == 'csv':
+            content = self.csv_lines(rows, type_str)
+            content_type = 'text/csv'
+        else:
+            content = self.ndjson_lines(rows, type_str)
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="records.{}"'.format(output)
+        return response
+
+   def csv_lines(self, rows, type_str):
+        writer = csv.writer(Echo())
+        yield writer.writerow(['id', 'date', 'operation', 'operation_type_str', 'cost', 'user_balance', 
+                               'result_number', 'result_string', 'operation_response'])
+        for id, date, operation_id, cost, user_balance, result_number, result_string, operation_response in rows:
+            yield writer.writerow([id, date.isoformat(), operation_id, type_str.get(operation_id), 
+                                   cost, user_balance, result_number, result_string, operation_response])
+
+   def ndjson_lines(self, rows, type_str):
+        for id, date, operation_id, cost, user_balance, result_number, result_string, operation_response in rows:
+            yield json.dumps({'id': id, 'date': date.isoformat(), 'operation': operation_id, 
+                              'operation_type_str': type_str.get(operation_id), 'cost': cost, 
+                              'user_balance': user_balance, 'result_number': result_number, 
+                              'result_string': result_string, 
+                              'operation_response': operation_response}) + "\n"
+   
+
+class UsageView(APIView):  
+   permission_classes = (IsAuthenticated,)
+   default_days = 30
+   max_days = 366
+   def get(self, request):
+        """
+        Operations count and total cost of the user per day and operation
+        type, read from the usage rollups
+
+        Accepts a date range with date_from and date_to, as ISO dates, the
+        last 30 days by default.
+        """
+        today = timezone.localdate()
+        try:
+            date_to = self.parse_day(request.GET.get('date_to'), today)
+            date_from = self.parse_day(request.GET.get('date_from'), 
+                                       date_to - datetime.timedelta(days=self.default_days - 1))
+        except ValueError as e:
+            return Response(dict_message(error_message=str(e)), status=status.HTTP_400_BAD_REQUEST)
+        if date_from > date_to or (date_to - date_from).days >= self.max_days:
+            return Response(dict_message(error_message="Invalid date range, at most {} days".format(self.max_days)), 
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        rows = UsageRollup.objects.filter(user_id=request.user.id, day__gte=date_from, day__lte=date_to) \
+                                  .order_by('day', 'operation_type') \
+                                  .values_list('day', 'operation_type', 'count', 'total_cost')
+        days = {}
+        total_count, total_cost = 0, 0.0
+        for day, operation_type, count, cost in rows:
+            usage = days.setdefault(day, {'day': day.isoformat(), 'count': 0, 'total_cost': 0.0, 'operations': {}})
+            usage['operations'][Operation.TYPE_STR[operation_type]] = {'count': count, 'total_cost': cost}
+            usage['count'] += count
+            usage['total_cost'] += cost
+            total_count += count
+            total_cost += cost
+
+        return Response(dict_message(response_data={'date_from': date_from.isoformat(), 
+                                                     'date_to': date_to.isoformat(),
+                                                     'count': total_count, 'total_cost': total_cost,
+                                                     'days': list(days.values())}))
+
+   def parse_day(self, value, default:datetime.date) -> datetime.date:
+        if not value:
+            return default
+        try:
+            day = parse_date(value)
+        except ValueError as e:
+            day = None
+        if day is None:
+            raise ValueError("Invalid date: {}".format(value))
+        return day
    
 
 class LogoutView(APIView):
@@ -99,10 +495,19 @@ class LogoutView(APIView):
      def post(self, request):
           try:
                refresh_token = request.data["refresh_token"]
-               token = RefreshToken(refresh_token)
+               token = FilteredRefreshToken(refresh_token)
                token.blacklist()
                return Response(status=status.HTTP_205_RESET_CONTENT)
           except Exception as e:
                return Response(status=status.HTTP_400_BAD_REQUEST)
           
 
+
+def metrics_view(request):
+    '''
+    Metrics of all the workers in the Prometheus text format
+    '''
+    token = metrics_config()["AUTH_TOKEN"]
+    if token and request.headers.get("Authorization") != "Bearer {}".format(token):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(registry.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -3,6 +3,16 @@ ASGI config for arithmetic_calculator_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Under an ASGI server the async views (``/async/...``) wait on random.org
+without holding a thread, so one process serves many of them at once:
+
+    uvicorn arithmetic_calculator_api.asgi:application --host 0.0.0.0 --port 8000
+
+or, with the host, port and workers taken from ASGI_HOST, ASGI_PORT and
+ASGI_WORKERS:
+
+    python -m arithmetic_calculator_api.asgi
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -14,3 +24,12 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'arithmetic_calculator_api.settings')
 
 application = get_asgi_application()
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run('arithmetic_calculator_api.asgi:application',
+                host=os.environ.get('ASGI_HOST', '127.0.0.1'),
+                port=int(os.environ.get('ASGI_PORT', 8000)),
+                workers=int(os.environ.get('ASGI_WORKERS', 1)))
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -52,6 +53,7 @@ CORS_ALLOW_CREDENTIALS = True
 
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -86,13 +88,48 @@ WSGI_APPLICATION = 'arithmetic_calculator_api.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# The engine and the connection are selected from the environment,
+# DATABASE_ENGINE is the backend module: sqlite3 (default), postgresql or mysql.
+# The connections are kept open DATABASE_CONN_MAX_AGE seconds by the thread
+# that opened them, one per worker thread, and checked before they're reused.
+# Behind a transaction pooler like PgBouncer set DATABASE_CONN_MAX_AGE=0 and
+# DATABASE_DISABLE_SERVER_SIDE_CURSORS=1.
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': 'django.db.backends.{}'.format(DATABASE_ENGINE),
+        'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+        'USER': os.environ.get('DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', ''),
+        'PORT': os.environ.get('DATABASE_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DATABASE_DISABLE_SERVER_SIDE_CURSORS') == '1',
     }
 }
 
+if DATABASE_ENGINE == 'sqlite3':
+    # a file database makes the concurrency tests use the real SQLite locking
+    DATABASES['default']['TEST'] = {
+        'NAME': BASE_DIR / 'test_db.sqlite3',
+    }
+
+# Pragmas run on every new SQLite connection. In WAL mode the readers don't
+# block the writer and the writer doesn't block the readers, and a commit
+# only syncs the log (synchronous=normal, durable up to the last checkpoint
+# on a power loss). busy_timeout makes a writer wait for the lock, in
+# milliseconds, instead of failing with "database is locked". cache_size is
+# in KiB when negative.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'temp_store': 'memory',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -137,14 +174,118 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
      'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
+      ],
+     'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.OperationCostThrottle',
       ],
 }
 
 
+# Token buckets of the operation endpoints, charged the cost of the operations
+# of each request instead of one token per request. The bucket of each user
+# holds up to USER_CAPACITY cost units and refills USER_RATE units per second,
+# the bucket shared by all the users GLOBAL_CAPACITY and GLOBAL_RATE. A request
+# costing more than USER_CAPACITY waits for the user's bucket to be full and
+# leaves it in debt of at most USER_CAPACITY, so even the largest batch or
+# bulk job holds back the next request of the user for at most
+# 2 * USER_CAPACITY / USER_RATE seconds (a minute). The global bucket is
+# charged at most USER_CAPACITY per request.
+# The rejected requests get a 429 with Retry-After, before anything is written.
+# The buckets live in each process, CACHE names a Django cache shared by the
+# workers (Redis or Memcached) to enforce the limits across processes.
+OPERATION_THROTTLE = {
+    'ENABLED': True,
+    'USER_RATE': 20,
+    'USER_CAPACITY': 600,
+    'GLOBAL_RATE': 1000,
+    'GLOBAL_CAPACITY': 20000,
+    'CACHE': None,
+}
+
+
+# Seconds the users authenticated by a JWT are cached in each process, the
+# cache is dropped when the user is saved or its balance debited
+AUTHENTICATED_USER_CACHE_TTL = 10
+
+
 SIMPLE_JWT = {
      'ACCESS_TOKEN_LIFETIME': timedelta(minutes=10),
      'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
      'ROTATE_REFRESH_TOKENS': True,
-     'BLACKLIST_AFTER_ROTATION': True
-}
\ No newline at end of file
+     'BLACKLIST_AFTER_ROTATION': True,
+     'TOKEN_REFRESH_SERIALIZER': 'api.serializers.FilteredTokenRefreshSerializer',
+}
+
+
+# Write-behind mode of the records: once the balance debit commits, the records
+# are queued in a per process buffer and bulk inserted by a background thread
+# every BATCH_SIZE records or FLUSH_INTERVAL seconds, so they show up in the
+# records history a moment after the operation. When the queue holds MAX_SIZE
+# records the new ones are appended to a file in SPILL_DIR, loaded back by
+# `manage.py replay_record_spill`, or saved by the request without SPILL_DIR.
+# FLUSH_ON_SHUTDOWN inserts the queued records when the process exits.
+RECORD_WRITE_BEHIND = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 0.5,
+    'FLUSH_ON_SHUTDOWN': True,
+    'SPILL_DIR': BASE_DIR / 'record_spill',
+}
+
+
+# Per process Bloom filter of the blacklisted refresh tokens, checked before
+# the token_blacklist tables. The tokens blacklisted by other processes are
+# read every TOKEN_BLACKLIST_FILTER_SYNC_INTERVAL seconds, the filter is
+# rebuilt once it holds more than TOKEN_BLACKLIST_FILTER_CAPACITY tokens. Each
+# sync reads back TOKEN_BLACKLIST_FILTER_SYNC_MARGIN seconds before the last
+# one, for the late commits and the clock skew between the servers.
+TOKEN_BLACKLIST_FILTER_CAPACITY = 100000
+TOKEN_BLACKLIST_FILTER_ERROR_RATE = 0.001
+TOKEN_BLACKLIST_FILTER_SYNC_INTERVAL = 5
+TOKEN_BLACKLIST_FILTER_SYNC_MARGIN = 60
+
+
+# Provider of the random_string operation. RandomOrgProvider prefetches the
+# strings from random.org in batches into a per process pool, refilled in the
+# background below low_watermark. api.random_strings.SecretsProvider generates
+# them locally with the secrets module, with the same length and characters.
+RANDOM_STRING_PROVIDER = {
+    'BACKEND': 'api.random_strings.RandomOrgProvider',
+    'OPTIONS': {
+        'length': 10,
+        'digits': True,
+        'upperalpha': True,
+        'loweralpha': True,
+        'unique': True,
+        'url': 'https://www.random.org/strings/',
+        'batch_size': 200,
+        'low_watermark': 50,
+        'high_watermark': 500,
+        'timeout': (3.05, 10),
+    },
+}
+
+
+# Seconds the per process Operation catalog is kept before being reloaded,
+# edits of the operations invalidate it right away. None disables the TTL.
+OPERATION_CATALOG_TTL = 300
+
+
+# Number of compiled expressions kept by the expression endpoint
+EXPRESSION_PLAN_CACHE_SIZE = 256
+
+
+# Request, operation, database and random.org metrics, served at /metrics in
+# the Prometheus text format. Without DIR each process serves its own values.
+# With DIR every process writes its values to a file in that directory every
+# FLUSH_INTERVAL seconds, and /metrics sums the files of all the workers;
+# manage.py serve clears the directory when it starts. With AUTH_TOKEN the scraper
+# sends it as a Bearer token.
+METRICS = {
+    'ENABLED': True,
+    'DIR': None,
+    'FLUSH_INTERVAL': 1.0,
+    'AUTH_TOKEN': None,
+}
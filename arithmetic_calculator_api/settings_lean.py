@@ -0,0 +1,37 @@
+"""
+API only settings, for the processes that start often
+
+Same as arithmetic_calculator_api.settings without the admin, the sessions,
+the messages and the static files, whose apps and middleware a JWT API
+doesn't use, and with JSON responses only, without the browsable API:
+
+    DJANGO_SETTINGS_MODULE=arithmetic_calculator_api.settings_lean python manage.py serve
+
+`manage.py profile_startup` reports the import time of each profile.
+"""
+from arithmetic_calculator_api.settings import *  # noqa: F401,F403
+
+UNUSED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)
+
+UNUSED_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+)
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in UNUSED_APPS]
+
+# the API views are csrf exempt and authenticate the JWT themselves
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in UNUSED_MIDDLEWARE]
+
+TEMPLATES = []
+
+REST_FRAMEWORK = dict(REST_FRAMEWORK,
+                      DEFAULT_RENDERER_CLASSES=['rest_framework.renderers.JSONRenderer'])
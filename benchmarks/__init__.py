@@ -0,0 +1,9 @@
+"""
+Local benchmarks of the API
+
+Each module is run from the repository root, for example:
+
+    python -m benchmarks.record_serialization
+
+The benchmarks run on a throwaway test database, never on db.sqlite3.
+"""
@@ -0,0 +1,242 @@
+"""
+Load test of the API endpoints against a local gunicorn server
+
+Seeds synthetic users and records in a throwaway database, then drives
+each endpoint with concurrent clients and reports the throughput and the
+latency percentiles per endpoint. The random strings are generated in
+process, without random.org:
+
+    python -m benchmarks.api_load --users 100 --records 1000000 --output bench.json
+
+The results are written as JSON with --output, and compared against a
+previous run with --baseline. The exit status is 1 when an endpoint is
+slower than the baseline by more than --tolerance:
+
+    python -m benchmarks.api_load --baseline benchmarks/baseline.json
+    python -m benchmarks.api_load --compare bench.json --baseline benchmarks/baseline.json
+"""
+import argparse
+import datetime
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.utils import benchmark_database, print_table, setup_django, start_server, summarize
+
+PASSWORD = 'benchmark'
+
+# method, path and payload of each endpoint, the payloads are filled with
+# the ids of the seeded data
+ENDPOINTS = {
+    'token': ('POST', '/token/', lambda data, user: {'username': user['username'], 'password': PASSWORD}),
+    'operation': ('POST', '/operation/',
+                  lambda data, user: {'operation_id': data['operations'][1], 'operator1': 2, 'operator2': 3}),
+    'random_string': ('POST', '/operation/',
+                      lambda data, user: {'operation_id': data['operations'][6], 'operator1': '', 'operator2': ''}),
+    'records': ('GET', '/records/', lambda data, user: {'page': random.randint(1, 20)}),
+    'records_cursor': ('GET', '/records/', lambda data, user: {'pagination': 'cursor'}),
+    'usage': ('GET', '/usage/', lambda data, user: {}),
+}
+
+
+def seed(users:int, records:int, chunk_size:int=10000) -> dict:
+    '''
+    Creates users with an unlimited balance and records spread over the
+    users, the operations and the last year
+
+    :return: the users with their access token and the operation ids by type
+    '''
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+    from django.utils import timezone
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    from api.models import Operation, Record, User
+
+    # hash the password once, the token endpoint still checks it on every request
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([User(username='benchmark{}'.format(i), password=password, balance=10 ** 9)
+                              for i in range(users)])
+    seeded_users = list(User.objects.filter(username__startswith='benchmark').order_by('id'))
+    operations = list(Operation.objects.order_by('type'))
+
+    now = timezone.now()
+    step = datetime.timedelta(days=365) / max(1, records)
+    for start in range(0, records, chunk_size):
+        Record.objects.bulk_create([
+            Record(user=seeded_users[i % users], operation=operations[i % len(operations)],
+                   cost=operations[i % len(operations)].cost, user_balance=10 ** 9,
+                   result_number=float(i), date=now - step * (records - i))
+            for i in range(start, min(records, start + chunk_size))])
+    call_command('rebuild_usage_rollups', stdout=io.StringIO())
+
+    return {
+        'users': [{'username': user.username, 'token': str(RefreshToken.for_user(user).access_token)}
+                  for user in seeded_users],
+        'operations': {operation.type: operation.id for operation in operations},
+    }
+
+
+def run_load(base_url:str, endpoint:str, data:dict, total:int, concurrency:int) -> dict:
+    '''
+    Sends total requests to endpoint with concurrency clients, each request
+    as a random seeded user
+
+    :return: the summary of the successful requests, with the throughput and
+             the number of failed requests
+    '''
+    method, path, payload = ENDPOINTS[endpoint]
+    sessions = threading.local()
+
+    def request(i):
+        # one keep-alive connection per client
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+        user = random.choice(data['users'])
+        headers = {} if endpoint == 'token' else {'Authorization': 'Bearer {}'.format(user['token'])}
+        arguments = {'json': payload(data, user)} if method == 'POST' else {'params': payload(data, user)}
+
+        start = time.perf_counter()
+        try:
+            response = sessions.session.request(method, base_url + path, headers=headers, timeout=60, **arguments)
+        except requests.RequestException:
+            return time.perf_counter() - start, False
+        ok = response.status_code == 200 and (endpoint in ('token', 'records', 'records_cursor')
+                                              or response.json().get('status') == 1)
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, range(total)))
+    elapsed = time.perf_counter() - start
+
+    durations = [duration for duration, ok in results if ok]
+    summary = summarize(durations)
+    summary['failed'] = len(results) - len(durations)
+    summary['throughput_rps'] = len(durations) / elapsed
+    return summary
+
+
+def compare(results:dict, baseline:dict, tolerance:float) -> list:
+    '''
+    Prints the change of each endpoint against the baseline
+
+    :return: the endpoints whose p95 latency grew, or throughput dropped,
+             by more than tolerance
+    '''
+    if results['parameters'] != baseline['parameters']:
+        print('warning: the parameters differ from the baseline {}'.format(baseline['parameters']))
+
+    regressions = []
+    print('{:<28}{:>12}{:>12}{:>10}{:>12}{:>12}{:>10}'.format(
+        '', 'p95 ms', 'baseline', 'change', 'req/s', 'baseline', 'change'))
+    for endpoint, stats in results['endpoints'].items():
+        reference = baseline['endpoints'].get(endpoint)
+        if reference is None:
+            continue
+        latency_change = stats['p95_ms'] / reference['p95_ms'] - 1 if reference['p95_ms'] else 0.0
+        throughput_change = stats['throughput_rps'] / reference['throughput_rps'] - 1 \
+            if reference['throughput_rps'] else 0.0
+        regressed = latency_change > tolerance or throughput_change < -tolerance or stats['failed'] > 0
+        if regressed:
+            regressions.append(endpoint)
+        print('{:<28}{:>12.1f}{:>12.1f}{:>+10.0%}{:>12.1f}{:>12.1f}{:>+10.0%}{}'.format(
+            endpoint, stats['p95_ms'], reference['p95_ms'], latency_change,
+            stats['throughput_rps'], reference['throughput_rps'], throughput_change,
+            '  regression' if regressed else ''))
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def benchmark(args) -> dict:
+    setup_django()
+    with benchmark_database() as connection:
+        start = time.perf_counter()
+        data = seed(args.users, args.records)
+        print('Seeded {} users and {} records in {:.1f}s'.format(args.users, args.records,
+                                                                 time.perf_counter() - start))
+
+        command = ['gunicorn', 'arithmetic_calculator_api.wsgi:application', '--workers', str(args.workers),
+                   '--threads', str(args.threads), '--bind', '127.0.0.1:{}'.format(args.port)]
+        process = start_server(command, args.port, {'BENCHMARK_DATABASE': str(connection.settings_dict['NAME']),
+                                                    'BENCHMARK_RANDOM_STRINGS': 'local'})
+        base_url = 'http://127.0.0.1:{}'.format(args.port)
+        endpoints = {}
+        try:
+            for endpoint in args.endpoints:
+                run_load(base_url, endpoint, data, args.warmup, args.concurrency)
+                endpoints[endpoint] = run_load(base_url, endpoint, data, args.requests, args.concurrency)
+        finally:
+            process.terminate()
+            process.wait()
+
+    return {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'parameters': {name: getattr(args, name) for name in ('users', 'records', 'requests', 'concurrency',
+                                                               'workers', 'threads')},
+        'endpoints': endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='requests per endpoint before measuring')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='RESULTS', help='compare this results file instead of running')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p95 latency growth and throughput drop, as a fraction')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare) as results_file:
+            results = json.load(results_file)
+    else:
+        results = benchmark(args)
+        print('{parameters[requests]} requests per endpoint, {parameters[concurrency]} clients, '
+              '{parameters[workers]} workers of {parameters[threads]} threads'.format(**results))
+        print_table(results['endpoints'])
+        print()
+        for endpoint, stats in results['endpoints'].items():
+            print('{:<28}{:>8.1f} requests/s, {} failed'.format(endpoint, stats['throughput_rps'], stats['failed']))
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print()
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('Regressed: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
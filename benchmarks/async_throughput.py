@@ -0,0 +1,102 @@
+"""
+Benchmarks the concurrent throughput of the random_string operation under
+WSGI and ASGI
+
+Every random string waits on a local random.org stand-in with a fixed
+latency. The same single process serves the operation view with gunicorn
+threads (WSGI) and the async operation view with uvicorn (ASGI):
+
+    python -m benchmarks.async_throughput --requests 400 --concurrency 50 --latency 0.2
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.random_org import RandomOrgStandIn
+from benchmarks.utils import benchmark_database, print_table, setup_django, start_server, summarize
+
+SERVERS = {
+    'wsgi': ['gunicorn', 'arithmetic_calculator_api.wsgi:application',
+             '--workers', '1', '--threads', '{threads}', '--bind', '127.0.0.1:{port}'],
+    'asgi': ['uvicorn', 'arithmetic_calculator_api.asgi:application',
+             '--workers', '1', '--host', '127.0.0.1', '--port', '{port}', '--log-level', 'warning'],
+}
+PATHS = {
+    'wsgi': '/operation/',
+    'asgi': '/async/operation/',
+}
+
+
+def run_load(url:str, token:str, operation_id:int, total:int, concurrency:int) -> tuple:
+    '''
+    Sends total requests with concurrency clients
+
+    :return: the duration of each successful request, the number of failed
+             requests and the elapsed time
+    '''
+    headers = {'Authorization': 'Bearer {}'.format(token)}
+
+    def request(i):
+        start = time.perf_counter()
+        payload = {'operation_id': operation_id, 'operator1': '', 'operator2': ''}
+        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        ok = response.status_code == 200 and response.json().get('status') == 1
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, range(total)))
+    elapsed = time.perf_counter() - start
+
+    durations = [duration for duration, ok in results if ok]
+    return durations, len(results) - len(durations), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2, help='random.org latency, in seconds')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads of the WSGI server')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database() as connection, RandomOrgStandIn(latency=args.latency) as stand_in:
+        from rest_framework_simplejwt.tokens import RefreshToken
+
+        from api.models import Operation, User
+
+        user = User.objects.create_user(username='benchmark', password='benchmark', balance=10 ** 9)
+        token = str(RefreshToken.for_user(user).access_token)
+        operation = Operation.objects.get(type=6)
+        database = str(connection.settings_dict['NAME'])
+
+        rows = {}
+        throughput = {}
+        for server in SERVERS:
+            command = [argument.format(port=args.port, threads=args.threads) for argument in SERVERS[server]]
+            process = start_server(command, args.port, {'BENCHMARK_DATABASE': database,
+                                                        'BENCHMARK_RANDOM_ORG_URL': stand_in.url})
+            try:
+                url = 'http://127.0.0.1:{}{}'.format(args.port, PATHS[server])
+                durations, failed, elapsed = run_load(url, token, operation.id, args.requests, args.concurrency)
+            finally:
+                process.terminate()
+                process.wait()
+
+            rows[server] = summarize(durations)
+            throughput[server] = (len(durations) / elapsed, failed)
+
+        print('{} requests, {} clients, {:.0f} ms random.org latency, {} WSGI threads'.format(
+            args.requests, args.concurrency, args.latency * 1000, args.threads))
+        print_table(rows)
+        print()
+        for server, (per_second, failed) in throughput.items():
+            print('{:<28}{:>8.1f} requests/s, {} failed'.format(server, per_second, failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmarks the sustained operations per second of concurrent writer
+processes on SQLite
+
+Every process charges operations through api.billing.charge, a balance
+debit plus a record per operation, as fast as it can for a fixed time.
+The same database is written with the rollback journal of SQLite's
+defaults and with the SQLITE_PRAGMAS of the settings (WAL):
+
+    python -m benchmarks.db_writes --processes 4 --duration 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+
+from benchmarks.utils import benchmark_database, print_table, setup_django, summarize
+
+# SQLite pragmas of the writers, None for the SQLITE_PRAGMAS of the settings
+PROFILES = {
+    'default': {},
+    'settings': None,
+}
+
+
+def writer(index:int, database:str, pragmas, duration:float, shared_user:bool, results):
+    '''
+    Charges operations until duration seconds passed, in its own process
+    '''
+    # the spawned process inherits the settings module of the parent
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    os.environ['BENCHMARK_DATABASE'] = database
+    os.environ['BENCHMARK_SQLITE_PRAGMAS'] = json.dumps(pragmas)
+    setup_django()
+
+    from django.db import OperationalError
+
+    from api.billing import charge
+    from api.models import Operation, User
+    from api.operations import dict_message
+
+    durations = []
+    errors = 0
+    try:
+        user = User.objects.get(username='writer{}'.format(0 if shared_user else index))
+        operation = Operation.objects.get(type=1)
+
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                charge(user, operation, dict_message(response_data=3.0))
+            except OperationalError:
+                # database is locked
+                errors += 1
+                continue
+            durations.append(time.perf_counter() - start)
+    finally:
+        results.put((durations, errors))
+
+
+def run_profile(database:str, pragmas, processes:int, duration:float, shared_user:bool) -> tuple:
+    '''
+    Runs the writer processes and returns their operation durations and
+    the number of failed operations
+    '''
+    from django.conf import settings
+
+    # the journal mode sticks to the database file, and changing it needs
+    # the only connection to the database
+    if pragmas is None:
+        journal_mode = settings.SQLITE_PRAGMAS.get('journal_mode', 'delete')
+    else:
+        journal_mode = pragmas.get('journal_mode', 'delete')
+    with sqlite3.connect(database) as journal_connection:
+        journal_connection.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    journal_connection.close()
+    pragmas = {name: value for name, value in (settings.SQLITE_PRAGMAS if pragmas is None else pragmas).items()
+               if name != 'journal_mode'}
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = [context.Process(target=writer, args=(i, database, pragmas, duration, shared_user, results))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    collected = [results.get() for worker in workers]
+    for worker in workers:
+        worker.join()
+
+    durations = [duration for worker_durations, errors in collected for duration in worker_durations]
+    return durations, sum(errors for worker_durations, errors in collected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10, help='seconds of writes per profile')
+    parser.add_argument('--shared-user', action='store_true', help='all the processes charge the same user')
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database() as connection:
+        from api.models import User
+
+        User.objects.bulk_create([User(username='writer{}'.format(i), balance=10 ** 9)
+                                  for i in range(args.processes)])
+        database = str(connection.settings_dict['NAME'])
+        connection.close()
+
+        rows = {}
+        throughput = {}
+        for profile, pragmas in PROFILES.items():
+            durations, errors = run_profile(database, pragmas, args.processes, args.duration, args.shared_user)
+            rows[profile] = summarize(durations)
+            throughput[profile] = (len(durations) / args.duration, errors)
+
+        print('{} writer processes, {:.0f}s per profile{}'.format(
+            args.processes, args.duration, ', one shared user' if args.shared_user else ''))
+        print_table(rows)
+        print()
+        for profile, (per_second, errors) in throughput.items():
+            print('{:<28}{:>8.1f} operations/s, {} failed'.format(profile, per_second, errors))
+
+
+if __name__ == '__main__':
+    main()
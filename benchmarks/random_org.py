@@ -0,0 +1,76 @@
+"""
+Local stand-in for random.org, used by the tests and the benchmarks
+
+    python -m benchmarks.random_org --port 8001 --latency 0.2
+"""
+import argparse
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class RandomOrgStandIn:
+    '''
+    Local HTTP server answering like random.org/strings/ so the random string
+    path can be tested and benchmarked offline
+
+    :param status_code: status code of the responses
+    :param latency: seconds waited before each response, like the network
+                    round trip to random.org
+    '''
+    def __init__(self, status_code=200, latency=0.0, port=0):
+        stand_in = self
+        self.status_code = status_code
+        self.latency = latency
+        self.requests = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests += 1
+                params = parse_qs(urlparse(self.path).query)
+                num = int(params["num"][0])
+                length = int(params["len"][0])
+                body = "\n".join(secrets.token_hex(length)[:length] for i in range(num))
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+
+                self.send_response(stand_in.status_code)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body.encode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/strings/".format(self.server.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with RandomOrgStandIn(latency=args.latency, port=args.port) as stand_in:
+        print('Serving random strings on {}'.format(stand_in.url))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmarks the cost of serializing one page of the records history
+
+Compares RecordSerializer on model instances, which loads the operation of
+each record, with serialize_record_rows() on values() rows:
+
+    python -m benchmarks.record_serialization --records 10000 --repeat 500
+"""
+import argparse
+
+from benchmarks.utils import benchmark_database, measure, print_table, setup_django, summarize
+
+
+def seed(records:int):
+    from api.models import Operation, Record, User
+
+    user = User.objects.create_user(username='benchmark', password='benchmark')
+    operations = list(Operation.objects.all())
+    Record.objects.bulk_create([Record(user=user, operation=operations[i % len(operations)],
+                                       cost=operations[i % len(operations)].cost,
+                                       user_balance=0, operation_response="")
+                                for i in range(records)], batch_size=5000)
+    return user
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        from api.catalog import catalog
+        from api.models import Record
+        from api.serializers import RECORD_ROW_FIELDS, RecordSerializer, serialize_record_rows
+
+        user = seed(args.records)
+        history = Record.objects.filter(user__id=user.id, is_active=True).order_by('-date', '-id')
+
+        def model_page():
+            return RecordSerializer(list(history[:args.page_size]), many=True).data
+
+        def rows_page():
+            rows = history.values(*RECORD_ROW_FIELDS)[:args.page_size]
+            type_str = {operation.id: operation.type_str for operation in catalog.all()}
+            return serialize_record_rows(rows, type_str)
+
+        assert [dict(r) for r in model_page()] == rows_page()
+
+        print('{} records, pages of {}'.format(args.records, args.page_size))
+        print_table({
+            'RecordSerializer': summarize(measure(model_page, args.repeat)),
+            'serialize_record_rows': summarize(measure(rows_page, args.repeat)),
+        })
+
+
+if __name__ == '__main__':
+    main()
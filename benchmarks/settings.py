@@ -0,0 +1,39 @@
+"""
+Settings of the servers started by the benchmarks
+
+The benchmark passes the database it created and the random.org stand-in
+in the environment. BENCHMARK_RANDOM_STRINGS=local generates the random
+strings in process instead, without any network wait. BENCHMARK_SQLITE_PRAGMAS
+replaces the SQLite pragmas, as a JSON object.
+"""
+import json
+import os
+
+from arithmetic_calculator_api.settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+# the load benchmark measures the endpoints, not the throttle's 429s
+OPERATION_THROTTLE = dict(OPERATION_THROTTLE, ENABLED=False)
+
+DATABASES['default']['NAME'] = os.environ.get('BENCHMARK_DATABASE', DATABASES['default']['TEST']['NAME'])
+
+# every random string waits on the stand-in, like an empty pool waits on random.org
+RANDOM_STRING_PROVIDER = {
+    'BACKEND': 'api.random_strings.RandomOrgProvider',
+    'OPTIONS': {
+        'url': os.environ.get('BENCHMARK_RANDOM_ORG_URL', 'http://127.0.0.1:8001/strings/'),
+        'batch_size': 1,
+        'low_watermark': 0,
+        'high_watermark': 0,
+    },
+}
+
+if os.environ.get('BENCHMARK_RANDOM_STRINGS') == 'local':
+    RANDOM_STRING_PROVIDER = {
+        'BACKEND': 'api.random_strings.SecretsProvider',
+        'OPTIONS': {'length': 10},
+    }
+
+if os.environ.get('BENCHMARK_SQLITE_PRAGMAS'):
+    SQLITE_PRAGMAS = json.loads(os.environ['BENCHMARK_SQLITE_PRAGMAS'])
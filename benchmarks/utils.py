@@ -0,0 +1,100 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+
+def setup_django(settings_module:str='arithmetic_calculator_api.settings'):
+    '''
+    Configures django for a standalone benchmark script
+    '''
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def benchmark_database(verbosity:int=0):
+    '''
+    Creates the test database, migrated, and destroys it on exit
+    '''
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def start_server(command:list, port:int, env:dict, timeout:float=30) -> subprocess.Popen:
+    '''
+    Runs the server module of command with the benchmark settings and waits
+    until it accepts requests on port
+
+    :param command: module and arguments, run with python -m
+    :param env: environment variables added to the server environment
+    '''
+    import requests
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='benchmarks.settings', **env)
+    process = subprocess.Popen([sys.executable, '-m'] + command, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get('http://127.0.0.1:{}/'.format(port), timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('{} did not start'.format(command[0]))
+
+
+def percentile(values:list, percent:float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(durations:list) -> dict:
+    '''
+    Returns the count, mean and percentiles of durations, in milliseconds
+    '''
+    millis = [d * 1000 for d in durations]
+    return {
+        'count': len(millis),
+        'mean_ms': statistics.fmean(millis) if millis else 0.0,
+        'p50_ms': percentile(millis, 50),
+        'p95_ms': percentile(millis, 95),
+        'p99_ms': percentile(millis, 99),
+    }
+
+
+def measure(function, repeat:int) -> list:
+    '''
+    Calls function repeat times and returns the duration of each call
+    '''
+    durations = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def print_table(rows:dict):
+    print('{:<28}{:>8}{:>12}{:>12}{:>12}{:>12}'.format('', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, stats in rows.items():
+        print('{:<28}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}'.format(
+            name, stats['count'], stats['mean_ms'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))